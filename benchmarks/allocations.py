@@ -0,0 +1,64 @@
+#
+# Per-request allocations: webob Request and Response objects constructed
+# and peak traced memory for one request through WPApp
+#
+
+import tracemalloc
+
+from harness import measurement
+
+from webpie import WPApp, WPHandler
+from webpie.webob.request import BaseRequest
+from webpie.webob.response import Response
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    def hello(self, request, relpath, **args):
+        return "Hello world\n", "text/plain"
+
+class ConstructorCounter(object):
+
+    def __init__(self, cls):
+        self.Class = cls
+        self.Count = 0
+
+    def __enter__(self):
+        counter = self
+        self.Original = original = self.Class.__init__
+        def counting_init(obj, *params, **args):
+            counter.Count += 1
+            return original(obj, *params, **args)
+        self.Class.__init__ = counting_init
+        return self
+
+    def __exit__(self, *params):
+        self.Class.__init__ = self.Original
+
+def allocations(uri, n = 100):
+    client = Client(WPApp(Handler), cookies = False)
+    environ = client.prepare("GET", uri)
+    client.call(environ)            # warm up
+    with ConstructorCounter(BaseRequest) as requests, ConstructorCounter(Response) as responses:
+        for _ in range(n):
+            client.call(environ)
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(n):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            client.call(environ)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    peaks.sort()
+    return {
+        "request_objects":  requests.Count / float(n),
+        "response_objects": responses.Count / float(n),
+        "peak_bytes":       peaks[len(peaks)//2]
+    }
+
+@measurement("allocations.app_call")
+def app_call_allocations(quick):
+    return allocations("/hello?a=1")
@@ -0,0 +1,125 @@
+#
+# Minimal benchmark harness
+#
+# Benchmarks are registered with decorators:
+#
+#   @benchmark("group.name")
+#   def setup():
+#       ...                     # prepare
+#       return operation        # zero-argument callable to be timed
+#
+#   @measurement("group.name")
+#   def measure(quick):
+#       ...
+#       return {"metric": value, ...}
+#
+# Timed benchmarks report "usec" (median time per operation) and "best_usec".
+# Metrics with names ending with "per_sec" are "higher is better", all others are
+# "lower is better" when compared to a baseline.
+#
+
+import time, json, sys, os, fnmatch, gc
+
+Registry = []           # [(name, kind, function)]
+
+def benchmark(name):
+    def decorator(setup):
+        Registry.append((name, "timeit", setup))
+        return setup
+    return decorator
+
+def measurement(name):
+    def decorator(function):
+        Registry.append((name, "measurement", function))
+        return function
+    return decorator
+
+def time_operation(op, min_time = 0.05, repeat = 5):
+    # find number of iterations which takes at least min_time, then repeat
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            op()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time/elapsed*1.2)+1))
+    times = [elapsed/number]
+    for _ in range(repeat-1):
+        gc.collect()
+        t0 = time.perf_counter()
+        for _ in range(number):
+            op()
+        times.append((time.perf_counter() - t0)/number)
+    times.sort()
+    return {
+        "usec":         round(times[len(times)//2]*1e6, 3),
+        "best_usec":    round(times[0]*1e6, 3)
+    }
+
+def run(patterns = None, quick = False, out = sys.stdout):
+    results = {}
+    for name, kind, function in Registry:
+        if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        try:
+            if kind == "timeit":
+                op = function()
+                if op is None:
+                    out.write("%-40s skipped\n" % (name,))
+                    continue
+                metrics = time_operation(op, min_time = 0.01 if quick else 0.05, repeat = 3 if quick else 5)
+            else:
+                metrics = function(quick)
+                if metrics is None:
+                    out.write("%-40s skipped\n" % (name,))
+                    continue
+        except Exception as e:
+            out.write("%-40s failed: %s: %s\n" % (name, type(e).__name__, e))
+            continue
+        results[name] = metrics
+        out.write("%-40s %s\n" % (name, "  ".join("%s=%s" % (k, v) for k, v in sorted(metrics.items()))))
+        out.flush()
+    return results
+
+def higher_is_better(metric):
+    return metric.endswith("per_sec")
+
+def compare(results, baseline, threshold = 0.10, out = sys.stdout):
+    # returns list of (name, metric, baseline value, new value) for regressions
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in sorted(metrics.items()):
+            if metric.startswith("best_"):
+                continue
+            base_value = base.get(metric)
+            if not base_value or not isinstance(value, (int, float)):
+                continue
+            change = (value - base_value)/base_value
+            worse = -change if higher_is_better(metric) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, base_value, value))
+            out.write("%-40s %-14s %12s -> %-12s %+7.1f%%%s\n" % (name, metric, base_value, value, change*100, flag))
+    return regressions
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f).get("results", {})
+
+def save(path, results):
+    d = os.path.dirname(path)
+    if d and not os.path.isdir(d):
+        os.makedirs(d)
+    with open(path, "w") as f:
+        json.dump({
+            "python":   sys.version.split()[0],
+            "platform": sys.platform,
+            "created":  time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results":  results
+        }, f, indent=2, sort_keys=True)
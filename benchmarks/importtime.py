@@ -0,0 +1,52 @@
+#
+# Import time of the package, measured with "python -X importtime" in a new process.
+#
+# Reports the cumulative import time of the statement and the number of modules it imports,
+# median of several runs. Modules already imported by the interpreter startup are not counted.
+#
+
+import sys, os, subprocess
+
+from harness import measurement
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def importtime_lines(statement):
+    # returns [(cumulative microseconds, module name indented by nesting level)]
+    env = os.environ.copy()
+    env["PYTHONPATH"] = Root + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+            env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode("utf-8")
+    lines = []
+    for line in out.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                lines.append((int(cumulative), name.rstrip()[1:]))      # nesting is indented by 2 spaces
+    return lines
+
+def import_time(statement, startup):
+    # returns (microseconds, number of modules)
+    # children are listed before their parents, so the modules imported by the interpreter startup are
+    # found as the first "startup" lines
+    lines = importtime_lines(statement)[startup:]
+    usec = sum(t for t, name in lines if not name.startswith(" "))       # top level entries only
+    return usec, len(lines)
+
+def measure(statement, quick):
+    startup = len(importtime_lines("pass"))
+    runs = sorted(import_time(statement, startup) for _ in range(3 if quick else 9))
+    usec, modules = runs[len(runs)//2]
+    return {"usec": usec, "modules": modules}
+
+@measurement("importtime.webpie")
+def importtime_webpie(quick):
+    return measure("import webpie", quick)
+
+@measurement("importtime.wpapp")
+def importtime_wpapp(quick):
+    return measure("from webpie import WPApp, WPHandler", quick)
+
+@measurement("importtime.server")
+def importtime_server(quick):
+    return measure("from webpie import WPApp, WPHandler, HTTPServer", quick)
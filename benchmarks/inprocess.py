@@ -0,0 +1,65 @@
+#
+# Application-level benchmarks driven by webpie.testing, without sockets
+#
+
+import tempfile
+
+from harness import benchmark, measurement
+
+from webpie import WPApp, WPHandler, WebPieSessionApp, WebPieHandler, app_synchronized
+from webpie.testing import Client, Driver, LockProbe
+from webpie.WebPieSessionApp import SessionStorage
+
+class Handler(WPHandler):
+
+    def hello(self, request, relpath, **args):
+        return "Hello world\n", "text/plain"
+
+    @app_synchronized
+    def locked(self, request, relpath, **args):
+        return "Hello world\n", "text/plain"
+
+class SessionHandler(WebPieHandler):
+
+    def count(self, request, relpath, **args):
+        session = request.environ["webpie.session"]
+        session["count"] = session.get("count", 0) + 1
+        return str(session["count"]), "text/plain"
+
+@benchmark("inprocess.hello")
+def inprocess_hello():
+    client = Client(WPApp(Handler))
+    environ = client.prepare("GET", "/hello?a=1&b=2")
+    return lambda: client.call(environ)
+
+def concurrent(app, uri, quick, threads = 8, probes = ()):
+    environ = Client(app).prepare("GET", uri)
+    stats = Driver(app, threads = threads).run(lambda client: client.call(environ), 500 if quick else 5000)
+    out = {
+        "req_per_sec":  round(stats["req_per_sec"], 1),
+        "p50_ms":       round(stats["p50_ms"], 3),
+        "p99_ms":       round(stats["p99_ms"], 3),
+        "errors":       stats["errors"]
+    }
+    for name, probe in probes:
+        lock_stats = probe.stats()
+        out[name + "_contended"] = lock_stats["contended"]
+        out[name + "_wait_ms"] = round(lock_stats["wait_time"]*1000, 3)
+    return out
+
+@measurement("inprocess.concurrent_hello")
+def concurrent_hello(quick):
+    return concurrent(WPApp(Handler), "/hello", quick)
+
+@measurement("inprocess.concurrent_app_lock")
+def concurrent_app_lock(quick):
+    app = WPApp(Handler)
+    probe = LockProbe.install(app, "_AppLock")
+    return concurrent(app, "/locked", quick, probes = [("app_lock", probe)])
+
+@measurement("inprocess.concurrent_session")
+def concurrent_session(quick):
+    storage_path = tempfile.mkdtemp(prefix="webpie-bench-")
+    app = WebPieSessionApp(SessionHandler, session_storage = storage_path)
+    probe = LockProbe.install(SessionStorage.storage(storage_path), "Lock")
+    return concurrent(app, "/count", quick, probes = [("session_storage", probe)])
@@ -0,0 +1,242 @@
+#
+# Micro-benchmarks of the request hot path components, no sockets involved
+#
+
+import os, tempfile
+
+from harness import benchmark
+
+from webpie import WPApp, WPHandler, HTTPServer, JSONStream
+from webpie.HTTPServer import HTTPConnection
+from webpie.WPApp import Request, makeResponse
+from webpie.WebPieSessionApp import Session
+from webpie.Negotiation import Negotiator
+
+REQUEST = (
+    "GET /app/hello/world?a=1&b=2&text=hello%20world&x=y+z HTTP/1.1\r\n"
+    "Host: localhost:8080\r\n"
+    "User-Agent: webpie-bench/1.0\r\n"
+    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    "Accept-Encoding: gzip, deflate\r\n"
+    "Accept-Language: en-US,en;q=0.5\r\n"
+    "Connection: keep-alive\r\n"
+    "Cookie: webpie_session_id=0123456789abcdef\r\n"
+    "\r\n"
+)
+
+def null_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"OK"]
+
+def start_response(status, headers):
+    pass
+
+def make_environ(path = "/hello", query = ""):
+    return {
+        "REQUEST_METHOD":   "GET",
+        "PATH_INFO":        path,
+        "SCRIPT_NAME":      "",
+        "QUERY_STRING":     query,
+        "SERVER_NAME":      "localhost",
+        "SERVER_PORT":      "8080",
+        "SERVER_PROTOCOL":  "HTTP/1.1",
+        "HTTP_HOST":        "localhost:8080",
+        "wsgi.url_scheme":  "http"
+    }
+
+#
+# HTTPConnection request parsing
+#
+
+Server = HTTPServer(0, null_app, logging=False)
+
+@benchmark("http.parse_request")
+def http_parse_request():
+    def op():
+        conn = HTTPConnection(Server, None, ("127.0.0.1", 0))
+        conn.addToRequest(REQUEST)
+    return op
+
+@benchmark("http.parse_and_environ")
+def http_parse_and_environ():
+    def op():
+        conn = HTTPConnection(Server, None, ("127.0.0.1", 0))
+        conn.addToRequest(REQUEST)
+        conn.processRequest()
+    return op
+
+#
+# Handler tree dispatch
+#
+
+class Leaf(WPHandler):
+
+    def hello(self, request, relpath, **args):
+        return "hello"
+
+def handler_tree(depth):
+    cls = Leaf
+    for _ in range(depth):
+        class Node(WPHandler):
+            Child = cls
+            def __init__(self, request, app):
+                WPHandler.__init__(self, request, app)
+                self.sub = self.Child(request, app)
+        cls = Node
+    return cls
+
+def dispatch_benchmark(depth):
+    root_class = handler_tree(depth)
+    app = WPApp(root_class)
+    path = "/sub" * depth + "/hello"
+    request = Request(make_environ(path))
+    def op():
+        root = root_class(request, app)
+        root.walk_down(request, "", path.split("/"), {})
+    return op
+
+@benchmark("dispatch.walk_down_shallow")
+def dispatch_shallow():
+    return dispatch_benchmark(0)
+
+@benchmark("dispatch.walk_down_deep")
+def dispatch_deep():
+    return dispatch_benchmark(8)
+
+@benchmark("dispatch.app_call")
+def dispatch_app_call():
+    app = WPApp(Leaf)
+    environ = make_environ("/hello", "a=1&b=2")
+    def op():
+        b"".join(app(environ.copy(), start_response))
+    return op
+
+#
+# makeResponse for each return shape
+#
+
+Text = "x" * 1000
+Shapes = {
+    "str":              lambda: Text,
+    "bytes":            lambda: b"x" * 1000,
+    "int":              lambda: 404,
+    "text_type":        lambda: (Text, "text/plain"),
+    "text_headers":     lambda: (Text, {"Content-Type": "text/plain", "X-Bench": "1"}),
+    "text_status_type": lambda: (Text, 200, "text/plain"),
+    "list":             lambda: ["line %d\n" % (i,) for i in range(20)],
+    "generator":        lambda: ("line %d\n" % (i,) for i in range(20)),
+    "json_dict":        lambda: {"items": [{"id": i, "name": "item %d" % (i,)} for i in range(20)]},
+    "json_stream":      lambda: JSONStream({"id": i, "name": "item %d" % (i,)} for i in range(20))
+}
+
+def make_response_benchmark(shape):
+    make = Shapes[shape]
+    environ = make_environ()
+    def op():
+        response = makeResponse(make())
+        b"".join(response(environ, start_response))
+    return op
+
+for _shape in Shapes:
+    benchmark("make_response." + _shape)(lambda shape=_shape: make_response_benchmark(shape))
+
+#
+# Query parsing
+#
+
+Queries = {
+    "empty":    "",
+    "short":    "a=1&b=2",
+    "long":     "&".join("param%d=value%%20%d+x" % (i, i) for i in range(20))
+}
+
+def parse_query_benchmark(query):
+    handler = Leaf(Request(make_environ()), WPApp(Leaf))
+    def op():
+        handler.parseQuery(query)
+    return op
+
+for _name, _query in Queries.items():
+    benchmark("parse_query." + _name)(lambda query=_query: parse_query_benchmark(query))
+
+#
+# Content negotiation
+#
+
+AcceptValue = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+Offers = ["application/json", "text/html"]
+
+@benchmark("negotiation.parse_uncached")
+def negotiation_parse_uncached():
+    from webpie.webob.acceptparse import AcceptValidHeader
+    return lambda: AcceptValidHeader(AcceptValue).acceptable_offers(Offers)
+
+@benchmark("negotiation.request_accept")
+def negotiation_request_accept():
+    environ = make_environ()
+    environ["HTTP_ACCEPT"] = AcceptValue
+    return lambda: Request(environ).accept.acceptable_offers(Offers)
+
+@benchmark("negotiation.negotiator")
+def negotiation_negotiator():
+    negotiator = Negotiator(Offers)
+    environ = make_environ()
+    environ["HTTP_ACCEPT"] = AcceptValue
+    return lambda: negotiator.best_match(environ)
+
+#
+# Sessions
+#
+
+SessionDir = tempfile.mkdtemp(prefix="webpie-bench-")
+
+@benchmark("session.save")
+def session_save():
+    session = Session(SessionDir, None, 3600)
+    sid = session.SessionID
+    counter = [0]
+    def op():
+        s = Session(SessionDir, sid, 3600)
+        counter[0] += 1
+        s["counter"] = counter[0]
+        s["data"] = {"list": list(range(20)), "text": Text}
+        s.saveIfChanged()
+    return op
+
+@benchmark("session.load")
+def session_load():
+    session = Session(SessionDir, None, 3600)
+    session["data"] = {"list": list(range(20)), "text": Text}
+    session.save()
+    sid = session.SessionID
+    def op():
+        s = Session(SessionDir, sid, 3600)
+        s.get("data")
+    return op
+
+#
+# Jinja rendering
+#
+
+Template = """<html><body><h1>{{ title }}</h1>
+<table>
+{% for row in rows %}<tr><td>{{ row.name|e }}</td><td>{{ row.value }}</td></tr>
+{% endfor %}</table>
+</body></html>
+"""
+
+@benchmark("jinja.render_to_string")
+def jinja_render():
+    try:
+        import jinja2
+    except ImportError:
+        return None
+    tempdir = tempfile.mkdtemp(prefix="webpie-bench-")
+    with open(os.path.join(tempdir, "page.html"), "w") as f:
+        f.write(Template)
+    app = WPApp(Leaf)
+    app.initJinjaEnvironment(tempdir)
+    rows = [{"name": "<row %d>" % (i,), "value": i} for i in range(100)]
+    def op():
+        app.render_to_string("page.html", title="Benchmark", rows=rows)
+    return op
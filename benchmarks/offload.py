@@ -0,0 +1,53 @@
+#
+# CPU bound handler methods run in the server process and offloaded to worker processes,
+# see webpie/Offload.py. With N cores, the offloaded variant should scale up to N times
+# the in-process throughput, which is limited to one core by the GIL.
+#
+
+import os
+
+from harness import measurement
+
+from webpie import WPApp, WPHandler, webmethod
+from webpie.testing import Client, Driver
+
+Work = 20000            # loop iterations per request, a few milliseconds
+
+def cpu_work(n):
+    x = 0
+    for i in range(n):
+        x += i*i % 7
+    return x
+
+class Handler(WPHandler):
+
+    def inline(self, request, relpath, **args):
+        return str(cpu_work(Work)), "text/plain"
+
+    @webmethod(offload="process")
+    def offloaded(self, request, relpath, **args):
+        return str(cpu_work(Work)), "text/plain"
+
+def run(app, uri, quick):
+    threads = max(2, 2*(os.cpu_count() or 1))
+    environ = Client(app).prepare("GET", uri)
+    Client(app).call(environ)                       # start worker processes
+    stats = Driver(app, threads = threads).run(lambda client: client.call(environ), 200 if quick else 2000)
+    return {
+        "req_per_sec":  round(stats["req_per_sec"], 1),
+        "p50_ms":       round(stats["p50_ms"], 3),
+        "p99_ms":       round(stats["p99_ms"], 3),
+        "errors":       stats["errors"]
+    }
+
+@measurement("offload.cpu_inline")
+def cpu_inline(quick):
+    return run(WPApp(Handler), "/inline", quick)
+
+@measurement("offload.cpu_process")
+def cpu_process(quick):
+    app = WPApp(Handler)
+    try:
+        return run(app, "/offloaded", quick)
+    finally:
+        app.processPool().shutdown()
@@ -0,0 +1,50 @@
+#
+# Run webpie benchmarks
+#
+#   python benchmarks/run.py [options] [pattern ...]
+#
+#   pattern                     - run only benchmarks with matching names, e.g. "http.*" "server.*"
+#   -q                          - quick mode, fewer iterations
+#   -o <file.json>              - save results as a baseline file
+#   -c <file.json>              - compare results with a baseline file, exit with status 1 on regressions
+#   -t <threshold>              - regression threshold, default 0.10 (10%)
+#
+# Baselines are kept in benchmarks/baselines/
+#
+
+import sys, os, getopt
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.dirname(here))
+
+import harness
+import micro, allocations, inprocess, server, offload, importtime
+
+Usage = """python benchmarks/run.py [-q] [-o <output.json>] [-c <baseline.json>] [-t <threshold>] [pattern ...]"""
+
+def main():
+    opts, patterns = getopt.getopt(sys.argv[1:], "qo:c:t:h")
+    opts = dict(opts)
+    if "-h" in opts:
+        print(Usage)
+        return 0
+
+    results = harness.run(patterns, quick = "-q" in opts)
+    status = 0
+    if "-o" in opts:
+        harness.save(opts["-o"], results)
+        print("Results saved to", opts["-o"])
+    if "-c" in opts:
+        print("")
+        print("Comparison with", opts["-c"])
+        regressions = harness.compare(results, harness.load(opts["-c"]), float(opts.get("-t", 0.10)))
+        if regressions:
+            print("%d regressions found" % (len(regressions),))
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    status = main()
+    sys.stdout.flush()
+    os._exit(status)            # session storage cleaner threads are not daemon threads
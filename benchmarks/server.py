@@ -0,0 +1,131 @@
+#
+# End-to-end benchmarks: requests sent over local TCP connections to HTTPServer
+# by a multi-connection load generator
+#
+
+import time, socket, tempfile, os
+from threading import Thread
+
+from harness import measurement
+
+from webpie import WPApp, WPHandler, HTTPServer
+
+class Handler(WPHandler):
+
+    def hello(self, request, relpath, **args):
+        return "Hello world\n", "text/plain"
+
+    def data(self, request, relpath, size="100000", **args):
+        return "x" * int(size), "text/plain"
+
+    def lines(self, request, relpath, n="100", **args):
+        return ("line %d\n" % (i,) for i in range(int(n))), "text/plain"
+
+def start_server(app, **args):
+    server = HTTPServer(0, app, logging=False, **args)
+    server.daemon = True
+    server.start()
+    while getattr(server, "Sock", None) is None:
+        time.sleep(0.01)
+    time.sleep(0.05)        # let the server get to accept()
+    return server, server.Sock.getsockname()[1]
+
+def http_get(port, uri):
+    sock = socket.create_connection(("127.0.0.1", port))
+    try:
+        sock.sendall(("GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % (uri,)).encode("ascii"))
+        response = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response.append(data)
+    finally:
+        sock.close()
+    response = b"".join(response)
+    if not (response.startswith(b"HTTP/1.1 200") or response.startswith(b"HTTP/1.0 200")):
+        raise RuntimeError("Unexpected response: %s" % (response[:100],))
+    return len(response)
+
+class LoadGenerator(object):
+
+    def __init__(self, port, uri, concurrency = 8, requests = 2000):
+        self.Port = port
+        self.URI = uri
+        self.Concurrency = concurrency
+        self.Requests = requests
+        self.Latencies = []
+        self.Errors = 0
+
+    def client(self, n):
+        latencies = []
+        errors = 0
+        for _ in range(n):
+            t0 = time.perf_counter()
+            try:
+                http_get(self.Port, self.URI)
+            except Exception:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - t0)
+        self.Latencies += latencies
+        self.Errors += errors
+
+    def run(self):
+        per_client = max(1, self.Requests // self.Concurrency)
+        threads = [Thread(target=self.client, args=(per_client,)) for _ in range(self.Concurrency)]
+        t0 = time.perf_counter()
+        for t in threads:   t.start()
+        for t in threads:   t.join()
+        elapsed = time.perf_counter() - t0
+        latencies = sorted(self.Latencies)
+        if not latencies:
+            raise RuntimeError("All requests failed")
+        return {
+            "req_per_sec":  round(len(latencies)/elapsed, 1),
+            "p50_ms":       round(percentile(latencies, 0.50)*1000, 3),
+            "p99_ms":       round(percentile(latencies, 0.99)*1000, 3),
+            "errors":       self.Errors
+        }
+
+def percentile(sorted_values, p):
+    i = min(len(sorted_values)-1, int(round(p*(len(sorted_values)-1))))
+    return sorted_values[i]
+
+Server = None
+Port = None
+
+def server_port():
+    global Server, Port
+    if Server is None:
+        static_dir = tempfile.mkdtemp()
+        with open(os.path.join(static_dir, "data.txt"), "w") as f:
+            f.write("x" * 100000)
+        Server, Port = start_server(WPApp(Handler), max_connections=100, max_queued=1000, 
+                static = {"/static": static_dir})
+    return Port
+
+def round_trip(uri, quick, concurrency = 8):
+    port = server_port()
+    http_get(port, uri)         # warm up
+    return LoadGenerator(port, uri, concurrency = concurrency, requests = 400 if quick else 4000).run()
+
+@measurement("server.hello")
+def server_hello(quick):
+    return round_trip("/hello", quick)
+
+@measurement("server.hello_1_connection")
+def server_hello_single(quick):
+    return round_trip("/hello", quick, concurrency = 1)
+
+@measurement("server.data_100k")
+def server_data(quick):
+    return round_trip("/data?size=100000", quick)
+
+@measurement("server.static_100k")
+def server_static(quick):
+    return round_trip("/static/data.txt", quick)
+
+@measurement("server.stream_lines")
+def server_lines(quick):
+    return round_trip("/lines?n=100", quick)
@@ -1,13 +1,21 @@
-from webpie import WPApp, WPHandler
-import time, json
+from webpie import WPApp, WPHandler, JSONStream
+import time
 
 class Handler(WPHandler):
     
     def time(self, req, relpath, **args):
         t = time.time()
-        return json.dumps({
+        return {
             "epoch":    t,
             "text": time.ctime(t)
-        }) + "\n", "text/json"
+        }
         
-WPApp(Handler).run_server(8080)
\ No newline at end of file
+    def times(self, req, relpath, n="10", **args):
+        # streamed as JSON array, or as newline-delimited JSON with ?ndjson=yes
+        def generate(n):
+            for i in range(n):
+                t = time.time() + i*3600
+                yield {"epoch": t, "text": time.ctime(t)}
+        return JSONStream(generate(int(n)), ndjson = args.get("ndjson") == "yes")
+        
+WPApp(Handler).run_server(8080)
@@ -0,0 +1,53 @@
+import socket, threading, tracemalloc, unittest
+
+from webpie.HTTPServer import BodyFile, RequestBodyTooLarge
+
+class TestBodyFile(unittest.TestCase):
+
+    def body(self, declared, data, max_size = None):
+        server, client = socket.socketpair()
+        def send():
+            client.sendall(data)
+            client.shutdown(socket.SHUT_WR)
+        sender = threading.Thread(target=send)
+        sender.start()
+        self.addCleanup(sender.join)
+        self.addCleanup(server.close)
+        self.addCleanup(client.close)
+        return BodyFile([], server, declared, max_size = max_size)
+
+    def test_declared_length_not_allocated(self):
+        # a small body with a huge declared Content-Length
+        for read in (lambda f: f.read(2*1024**3), lambda f: f.read()):
+            f = self.body(2*1024**3, b"abcdefghijklm")
+            tracemalloc.start()
+            try:
+                data = read(f)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(data, b"abcdefghijklm")
+            self.assertLess(peak, 10*1024*1024)
+
+    def test_read(self):
+        data = bytes(bytearray(range(256)))*4000          # larger than ReadSize and MaxBuffered
+        f = self.body(len(data), data)
+        self.assertEqual(f.read(10), data[:10])
+        self.assertEqual(f.read(len(data)), data[10:])
+        self.assertEqual(f.read(10), b"")
+
+    def test_max_size(self):
+        data = b"x"*1000
+        for declared in (None, 1000):
+            f = self.body(declared, data, max_size = 1000)
+            self.assertEqual(f.read(), data)
+            self.assertFalse(f.TooLarge)
+        for declared in (None, 1001):
+            for read in (lambda f: f.read(), lambda f: f.read(5000), lambda f: list(f)):
+                f = self.body(declared, data + b"y", max_size = 1000)
+                with self.assertRaises(RequestBodyTooLarge):
+                    read(f)
+                self.assertTrue(f.TooLarge)
+
+if __name__ == "__main__":
+    unittest.main()
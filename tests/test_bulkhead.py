@@ -0,0 +1,25 @@
+import unittest
+
+from webpie import WPApp, WPHandler, webmethod, Bulkhead
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    _Pools = {"*": "one"}
+
+    @webmethod(pool="one")
+    def both(self, request, relpath, **args):
+        return "ok", "text/plain"
+
+class TestBulkhead(unittest.TestCase):
+
+    def test_same_bulkhead_in_pools_and_webmethod(self):
+        # _Pools and webmethod(pool=) name the same bulkhead, the request must take only one slot
+        app = WPApp(Handler, pools = {"one": Bulkhead(max_concurrent = 1, queue_timeout = 0.5)})
+        response = Client(app).get("/both")
+        self.assertEqual(response.status.split()[0], "200")
+        stats = app.bulkhead("one").stats()
+        self.assertEqual((stats["admitted"], stats["timeout"], stats["active"]), (1, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from webpie import WPApp, WPHandler, webmethod, cached
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    def _roles(self, request, relpath):
+        return ["user"] if request.environ.get("HTTP_X_USER") == "alice" else []
+
+    @webmethod(permissions=["user"])
+    @cached(ttl=60)
+    def secret(self, request, relpath, **args):
+        return "secret data", "text/plain"
+
+class TestCachedPermissions(unittest.TestCase):
+
+    def test_unauthorized_after_authorized(self):
+        client = Client(WPApp(Handler), cookies = False)
+        response = client.get("/secret", headers = {"X-User": "alice"})
+        self.assertEqual(response.status.split()[0], "200")
+        self.assertEqual(response.body, b"secret data")
+        self.assertEqual(Handler.secret.__doc__, "__WebPie:webmethod__")
+        response = client.get("/secret")
+        self.assertEqual(response.status.split()[0], "403")
+        response = client.get("/secret", headers = {"X-User": "mallory"})
+        self.assertEqual(response.status.split()[0], "403")
+
+    def test_cached_above_webmethod_is_refused(self):
+        with self.assertRaises(TypeError):
+            class Bad(WPHandler):
+                @cached(ttl=60)
+                @webmethod(permissions=["user"])
+                def secret(self, request, relpath, **args):
+                    return "secret data"
+
+if __name__ == "__main__":
+    unittest.main()
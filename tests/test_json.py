@@ -0,0 +1,41 @@
+import json, unittest
+
+from webpie import WPApp, WPHandler
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    def empty(self, request, relpath, **args):
+        return []
+
+    def items(self, request, relpath, **args):
+        return [1, 2]
+
+    def chunks(self, request, relpath, **args):
+        return ["hello ", "world"]
+
+class TestJSONBody(unittest.TestCase):
+
+    def setUp(self):
+        self.Client = Client(WPApp(Handler))
+
+    def content_type(self, response):
+        return dict(response.headers)["Content-Type"].split(";")[0]
+
+    def test_empty_list(self):
+        response = self.Client.get("/empty")
+        self.assertEqual(self.content_type(response), "application/json")
+        self.assertEqual(json.loads(response.body), [])
+
+    def test_list(self):
+        response = self.Client.get("/items")
+        self.assertEqual(self.content_type(response), "application/json")
+        self.assertEqual(json.loads(response.body), [1, 2])
+
+    def test_chunks(self):
+        response = self.Client.get("/chunks")
+        self.assertEqual(self.content_type(response), "text/html")
+        self.assertEqual(response.body, b"hello world")
+
+if __name__ == "__main__":
+    unittest.main()
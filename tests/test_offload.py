@@ -0,0 +1,32 @@
+import time, unittest
+
+from webpie import WPApp, WPHandler, webmethod
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    @webmethod(offload="process")
+    def sleep(self, request, relpath, t="0", **args):
+        time.sleep(float(t))
+        return "slept", "text/plain"
+
+class TestOffload(unittest.TestCase):
+
+    def setUp(self):
+        self.App = WPApp(Handler, process_pool = 1, offload_timeout = 0.5)
+        self.Client = Client(self.App)
+
+    def tearDown(self):
+        self.App.shutdown()
+
+    def test_timeout(self):
+        self.assertEqual(self.Client.get("/sleep?t=0").status.split()[0], "200")
+        self.assertEqual(self.Client.get("/sleep?t=2").status.split()[0], "504")
+
+    def test_shutdown(self):
+        self.assertEqual(self.Client.get("/sleep").status.split()[0], "200")
+        self.App.shutdown()
+        self.assertEqual(self.Client.get("/sleep").status.split()[0], "503")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from webpie.RateLimit import RateLimiter
+from webpie.HTTPServer import HTTPHeaders
+
+def headers(**values):
+    h = HTTPHeaders()
+    for name, value in values.items():
+        h.add(name.replace("_", "-"), value)
+    return h
+
+class TestClientKey(unittest.TestCase):
+
+    def test_forwarded_for(self):
+        limiter = RateLimiter(1.0, key_header = "X-Forwarded-For")
+        caddr = ("10.0.0.1", 12345)
+        # the client controls the leftmost values
+        self.assertEqual(limiter.clientKey(caddr, headers(X_Forwarded_For = "1.1.1.1, 2.2.2.2")), "2.2.2.2")
+        self.assertEqual(limiter.clientKey(caddr, headers(X_Forwarded_For = "3.3.3.3, 2.2.2.2")), "2.2.2.2")
+        self.assertEqual(limiter.clientKey(caddr, headers()), "10.0.0.1")
+
+    def test_trusted_proxies(self):
+        caddr = ("10.0.0.1", 12345)
+        h = headers(X_Forwarded_For = "1.1.1.1, 2.2.2.2, 3.3.3.3")
+        self.assertEqual(RateLimiter(1.0, key_header = "X-Forwarded-For", trusted_proxies = 2).clientKey(caddr, h),
+                "2.2.2.2")
+        self.assertEqual(RateLimiter(1.0, key_header = "X-Forwarded-For", trusted_proxies = 5).clientKey(caddr, h),
+                "1.1.1.1")
+        self.assertEqual(RateLimiter(1.0, key_header = "X-Forwarded-For", trusted_proxies = 0).clientKey(caddr, h),
+                "10.0.0.1")
+
+    def test_spoofed_header_does_not_reset_bucket(self):
+        limiter = RateLimiter(1.0, burst = 2, key_header = "X-Forwarded-For")
+        caddr = ("10.0.0.1", 12345)
+        results = [limiter.allow(limiter.clientKey(caddr, headers(X_Forwarded_For = "9.9.9.%d, 2.2.2.2" % (i,))),
+                now = 1000.0)[0] for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+if __name__ == "__main__":
+    unittest.main()
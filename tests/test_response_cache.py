@@ -0,0 +1,42 @@
+import io, unittest
+
+from webpie import ResponseCache
+
+def environ(path, method = "GET"):
+    return {"REQUEST_METHOD": method, "SCRIPT_NAME": "", "PATH_INFO": path, "QUERY_STRING": "",
+            "wsgi.input": io.BytesIO(b"")}
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Cache-Control", "max-age=60"),
+            ("Vary", "Accept")])
+    return [b"x" * 100]
+
+def call(cache, env):
+    out = []
+    body = b"".join(cache(env, lambda status, headers, exc_info = None: out.append((status, dict(headers)))))
+    return out[0], body
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_eviction_and_invalidation(self):
+        cache = ResponseCache(app, max_bytes = 3*(100 + ResponseCache.EntryOverhead))
+        for i in range(10):
+            for accept in ("text/plain", "text/html"):
+                env = environ("/p%d" % (i,))
+                env["HTTP_ACCEPT"] = accept
+                call(cache, env)
+        self.assertEqual(len(cache.Entries), 3)
+        self.assertEqual(set(k for keys in cache.UrlKeys.values() for k in keys), set(cache.Entries))
+        self.assertEqual(set(cache.VaryHeaders), set(cache.UrlKeys))
+        call(cache, environ("/p9", "POST"))
+        self.assertNotIn(("/p9", ""), cache.UrlKeys)
+        self.assertEqual(cache.Bytes, sum(e.size for e in cache.Entries.values()))
+
+    def test_start_response_not_called(self):
+        cache = ResponseCache(lambda environ, start_response: [], max_bytes = 10000)
+        out = cache(environ("/"), lambda status, headers, exc_info = None: None)
+        self.assertEqual(list(out), [])
+        self.assertEqual(cache.stats()["entries"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
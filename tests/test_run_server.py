@@ -0,0 +1,57 @@
+import socket, threading, time, unittest
+
+from webpie import HTTPServer, run_server
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"hello"]
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def http_get(port, uri):
+    sock = socket.create_connection(("127.0.0.1", port), timeout = 5)
+    try:
+        sock.sendall(("GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % (uri,)).encode("ascii"))
+        response = b""
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+        return response
+    finally:
+        sock.close()
+
+class TestRunServerInThread(unittest.TestCase):
+
+    def test_run_server_in_thread(self):
+        port = free_port()
+        errors = []
+        def run():
+            try:    run_server(port, app, logging = False)
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        deadline = time.time() + 5
+        response = None
+        while response is None and time.time() < deadline and not errors:
+            try:    response = http_get(port, "/")
+            except socket.error:
+                time.sleep(0.05)
+        self.assertEqual(errors, [])
+        self.assertTrue(response.startswith(b"HTTP/1.1 200"), response)
+        self.assertTrue(response.endswith(b"hello"))
+        for server in [t for t in threading.enumerate() if isinstance(t, HTTPServer)]:
+            server.stop(1.0)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import socket, threading, time, unittest
+
+from webpie import HTTPServer
+
+def app(environ, start_response):
+    time.sleep(1.0)
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"slow"]
+
+class TestServerStop(unittest.TestCase):
+
+    def test_queued_connections_closed(self):
+        server = HTTPServer(0, app, logging = False, max_connections = 1, min_workers = 1)
+        server.daemon = True
+        server.start()
+        while server.Sock is None:
+            time.sleep(0.01)
+        port = server.Sock.getsockname()[1]
+        clients = []
+        for _ in range(3):
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            clients.append(sock)
+        time.sleep(0.2)             # the first request is running, the others are queued
+        server.stop(0.1)
+        self.assertEqual(server.activeCount(), 1)         # only the running request
+        for sock in clients[1:]:
+            sock.settimeout(2.0)
+            self.assertEqual(sock.recv(100), b"")       # closed, not left hanging
+            sock.close()
+        clients[0].close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import itertools, threading, time, unittest
+
+from webpie import WPApp, WPHandler
+from webpie.WPApp import makeResponse
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    _Coalesce = "*"
+    Counter = itertools.count()
+
+    def session(self, request, relpath, **args):
+        time.sleep(0.2)
+        response = makeResponse(("hello", "text/plain"))
+        response.headerlist.append(("Set-Cookie", "session=%d; Path=/" % (next(self.Counter),)))
+        return response
+
+    def shared(self, request, relpath, **args):
+        time.sleep(0.2)
+        next(self.Counter)
+        return "shared", "text/plain"
+
+def concurrent_get(app, uri, n):
+    responses = []
+    def get():
+        responses.append(Client(app, cookies = False).get(uri))
+    threads = [threading.Thread(target=get) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return responses
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_set_cookie_not_shared(self):
+        app = WPApp(Handler)
+        responses = concurrent_get(app, "/session", 5)
+        cookies = [dict(r.headers).get("Set-Cookie") for r in responses]
+        self.assertEqual(len(set(cookies)), 5, cookies)
+        self.assertEqual(app.singleFlight().stats()["follower"], 0)
+
+    def test_shared(self):
+        app = WPApp(Handler)
+        responses = concurrent_get(app, "/shared", 5)
+        self.assertEqual([r.body for r in responses], [b"shared"]*5)
+        self.assertEqual(app.singleFlight().stats()["follower"], 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from webpie import WPApp, WPHandler, webmethod
+from webpie.testing import Client
+
+class Handler(WPHandler):
+
+    def _roles(self, request, relpath):
+        return [request.environ.get("HTTP_X_ROLE", "")]
+
+    @webmethod(permissions="admin")
+    def admin(self, request, relpath, **args):
+        return "ok", "text/plain"
+
+class TestWebmethod(unittest.TestCase):
+
+    def test_string_permission(self):
+        client = Client(WPApp(Handler))
+        self.assertEqual(client.get("/admin", headers = {"X-Role": "admin"}).status.split()[0], "200")
+        self.assertEqual(client.get("/admin", headers = {"X-Role": "adm"}).status.split()[0], "403")
+        self.assertEqual(client.get("/admin", headers = {"X-Role": ""}).status.split()[0], "403")
+
+if __name__ == "__main__":
+    unittest.main()
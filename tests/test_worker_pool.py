@@ -0,0 +1,33 @@
+import threading, time, unittest
+
+from webpie.WorkerPool import WorkerPool
+
+class Task(object):
+
+    def __init__(self, done):
+        self.Done = done
+
+    def run(self):
+        self.Done.append(1)
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_producers_blocked_on_full_queue(self):
+        # producers waiting for a queue slot must not take the wakeups meant for the workers
+        pool = WorkerPool(min_workers = 2, max_workers = 2, capacity = 1)
+        done = []
+        def produce():
+            for _ in range(200):
+                pool.add(Task(done))
+        producers = [threading.Thread(target=produce) for _ in range(8)]
+        for t in producers:
+            t.daemon = True
+            t.start()
+        deadline = time.time() + 10
+        while len(done) < 1600 and time.time() < deadline:
+            time.sleep(0.01)
+        pool.stop()
+        self.assertEqual(len(done), 1600)
+
+if __name__ == "__main__":
+    unittest.main()
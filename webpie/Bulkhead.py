@@ -0,0 +1,156 @@
+import time
+from threading import Condition
+
+#
+# Bulkheads: separate concurrency limits and queues for groups of handler methods
+#
+#   class Handler(WPHandler):
+#
+#       @webmethod(pool="reports")
+#       def report(self, request, relpath, **args):
+#           ...
+#
+#   class AdminHandler(WPHandler):
+#
+#       _Pools = {"export": "reports", "*": "admin"}        # method name or "*" -> bulkhead name
+#
+#   app = WPApp(Handler, pools = {
+#           "reports":  Bulkhead(max_concurrent = 4, max_queued = 8, queue_timeout = 5.0),
+#           "admin":    2                                   # max_concurrent
+#   })
+#
+# The bulkhead is chosen after routing, before the method is called. At most max_concurrent calls run at a time,
+# up to max_queued more wait for a slot in FIFO order. A request which finds the queue full, or waits longer than
+# queue_timeout, is answered with "503 Service Unavailable" and Retry-After, so it releases the server worker
+# instead of waiting for it. Requests for other methods are not affected as long as max_connections of the server
+# is larger than the sum of max_concurrent + max_queued of the bulkheads.
+#
+# Bulkheads used by name without configuration get the default limits.
+#
+# A method returning a generator holds the slot only until the generator is returned, the response body is
+# produced after the slot is released.
+#
+# A request takes at most one slot in each bulkhead: if both _Pools and webmethod(pool=) name the same
+# bulkhead, the inner call runs in the slot already held. The bulkheads held by the request are kept
+# in environ["webpie.bulkheads"].
+#
+# Metrics: webpie_bulkhead_requests_total{pool, result=admitted|queued|rejected|timeout},
+# webpie_bulkhead_active{pool}, webpie_bulkhead_queue_wait_seconds{pool}
+#
+
+class Bulkhead(object):
+
+    RetryAfter = 1          # seconds, for the 503 response
+
+    def __init__(self, max_concurrent = 10, max_queued = None, queue_timeout = 10.0, name = None, metrics = None):
+        self.Name = name
+        self.MaxConcurrent = max_concurrent
+        self.MaxQueued = max_concurrent if max_queued is None else max_queued
+        self.QueueTimeout = queue_timeout          # seconds or None
+        self.Metrics = metrics
+        self.Lock = Condition()
+        self.Active = 0
+        self.Waiting = 0
+        self.NextTicket = 0         # FIFO order of waiting calls
+        self.Serving = 0
+        self.Abandoned = set()      # tickets of the calls which stopped waiting before their turn
+        self.Counts = {"admitted": 0, "queued": 0, "rejected": 0, "timeout": 0}
+
+    def acquire(self):
+        # returns "admitted", "queued" - got a slot, "rejected" or "timeout" - did not
+        with self.Lock:
+            if self.Active < self.MaxConcurrent and not self.Waiting:
+                self.Active += 1
+                return "admitted"
+            if self.Waiting >= self.MaxQueued:
+                return "rejected"
+            ticket = self.NextTicket
+            self.NextTicket += 1
+            self.Waiting += 1
+            deadline = None if self.QueueTimeout is None else time.time() + self.QueueTimeout
+            try:
+                while self.Active >= self.MaxConcurrent or ticket != self.Serving:
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.time()
+                        if timeout <= 0:
+                            if ticket == self.Serving:
+                                self.Serving += 1
+                            else:
+                                self.Abandoned.add(ticket)
+                            return "timeout"
+                    self.Lock.wait(timeout)
+                self.Serving += 1
+                self.Active += 1
+                return "queued"
+            finally:
+                self.Waiting -= 1
+                self.skipAbandoned()
+                self.Lock.notify_all()
+
+    def skipAbandoned(self):
+        # called with the lock held
+        while self.Serving in self.Abandoned:
+            self.Abandoned.remove(self.Serving)
+            self.Serving += 1
+
+    def release(self):
+        with self.Lock:
+            self.Active -= 1
+            self.Lock.notify_all()
+
+    def count(self, result, wait):
+        with self.Lock:
+            self.Counts[result] += 1
+        metrics = self.Metrics
+        if metrics is not None:
+            labels = (("pool", self.Name),)
+            metrics.inc("webpie_bulkhead_requests_total", 1, labels + (("result", result),))
+            if result == "queued":
+                metrics.observe("webpie_bulkhead_queue_wait_seconds", wait, labels)
+
+    def rejection(self):
+        from .webob.exc import HTTPServiceUnavailable
+        return HTTPServiceUnavailable("Too many concurrent requests for %s" % (self.Name,),
+                headers = [("Retry-After", str(self.RetryAfter))])
+
+    HeldKey = "webpie.bulkheads"
+
+    def call(self, function, environ = None):
+        # returns function() or the 503 response
+        # environ: WSGI environ of the request, to avoid taking a second slot for the same request
+        held = None
+        if environ is not None:
+            held = environ.get(self.HeldKey)
+            if held is None:
+                held = environ[self.HeldKey] = set()
+            elif self in held:
+                return function()
+        t0 = time.time()
+        result = self.acquire()
+        self.count(result, time.time() - t0)
+        if result in ("rejected", "timeout"):
+            return self.rejection()
+        metrics = self.Metrics
+        if metrics is not None:
+            metrics.add("webpie_bulkhead_active", 1, (("pool", self.Name),))
+        if held is not None:
+            held.add(self)
+        try:
+            return function()
+        finally:
+            if held is not None:
+                held.discard(self)
+            self.release()
+            if metrics is not None:
+                metrics.add("webpie_bulkhead_active", -1, (("pool", self.Name),))
+
+    def wrap(self, function, environ = None):
+        return lambda: self.call(function, environ)
+
+    def stats(self):
+        with self.Lock:
+            stats = self.Counts.copy()
+            stats["active"] = self.Active
+            stats["waiting"] = self.Waiting
+            return stats
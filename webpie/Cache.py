@@ -0,0 +1,517 @@
+import time, io, sys
+from threading import RLock, Thread
+from collections import OrderedDict, deque
+from email.utils import parsedate_tz, mktime_tz
+
+from .WPApp import makeResponse, FastResponse, _WebMethodSignature
+from .webob.cachecontrol import CacheControl
+from .headers import environ_key
+
+#
+# Response memoization for handler methods
+#
+#   class Handler(WPHandler):
+#
+#       @cached(ttl=60)
+#       def menu(self, request, relpath, **args):
+#           ...
+#
+#       @webmethod(permissions=["user"])
+#       @cached(ttl=300, max_bytes=10*1024*1024, vary=["Accept-Language"])
+#       def table(self, request, relpath, **args):
+#           ...
+#
+#   Handler.menu.cache.stats()      # hits, misses, evictions, entries, bytes
+#   Handler.menu.cache.clear()
+#
+# GET and HEAD responses are cached by route, relpath, query arguments and the values of the "vary"
+# request headers. The finalized response is stored: status, headers and the body as bytes, so
+# iterator bodies are consumed once and replayed from memory. Only "200 OK" responses without
+# Set-Cookie and without "Cache-Control: no-store" or "private" are cached.
+#
+# The cache is shared by all handler instances. Concurrent misses for the same key are not
+# coalesced, each of them calls the method.
+#
+# @cached must be applied below @webmethod, so the permissions are checked before the cache is used: the
+# cache key does not include the client identity. cached() refuses to wrap a webmethod.
+#
+
+class MethodCache(object):
+
+    EntryOverhead = 200         # approximate per-entry memory besides the body, bytes
+
+    def __init__(self, ttl = None, maxsize = 1000, max_bytes = 16*1024*1024):
+        self.TTL = ttl                  # seconds, None - no expiration
+        self.MaxSize = maxsize          # entries
+        self.MaxBytes = max_bytes
+        self.Lock = RLock()
+        self.Entries = OrderedDict()    # key -> (expires, status, headerlist, body, size), least recently used first
+        self.Bytes = 0
+        self.Hits = self.Misses = self.Evictions = 0
+
+    def get(self, key):
+        with self.Lock:
+            entry = self.Entries.get(key)
+            if entry is not None:
+                if entry[0] is not None and entry[0] < time.time():
+                    self.remove(key)
+                    entry = None
+                else:
+                    self.Entries.move_to_end(key)
+            if entry is None:
+                self.Misses += 1
+            else:
+                self.Hits += 1
+            return entry
+
+    def put(self, key, status, headerlist, body):
+        size = len(body) + self.EntryOverhead
+        if size > self.MaxBytes:
+            return None
+        expires = None if self.TTL is None else time.time() + self.TTL
+        entry = (expires, status, headerlist, body, size)
+        with self.Lock:
+            self.remove(key)
+            self.Entries[key] = entry
+            self.Bytes += size
+            while self.Entries and (len(self.Entries) > self.MaxSize or self.Bytes > self.MaxBytes):
+                _, evicted = self.Entries.popitem(last=False)
+                self.Bytes -= evicted[4]
+                self.Evictions += 1
+        return entry
+
+    def remove(self, key):
+        with self.Lock:
+            entry = self.Entries.pop(key, None)
+            if entry is not None:
+                self.Bytes -= entry[4]
+
+    def clear(self):
+        with self.Lock:
+            self.Entries.clear()
+            self.Bytes = 0
+
+    def stats(self):
+        with self.Lock:
+            return {
+                "hits":         self.Hits,
+                "misses":       self.Misses,
+                "evictions":    self.Evictions,
+                "entries":      len(self.Entries),
+                "bytes":        self.Bytes
+            }
+
+    @staticmethod
+    def cacheable(response):
+        if response.status_code != 200:
+            return False
+        for h, v in response.headerlist:
+            h = h.lower()
+            if h == "set-cookie":
+                return False
+            if h == "cache-control":
+                v = v.lower()
+                if "no-store" in v or "private" in v:
+                    return False
+        return True
+
+    @staticmethod
+    def response(entry):
+        _, status, headerlist, body, _ = entry
+        response = FastResponse(body, status)
+        response.headerlist = list(headerlist)      # the response may be modified downstream
+        return response
+
+def _args_key(args):
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in args.items()))
+
+def cached(ttl = None, maxsize = 1000, max_bytes = 16*1024*1024, vary = ()):
+    vary_keys = tuple(environ_key(h) for h in vary)
+    cache = MethodCache(ttl, maxsize, max_bytes)
+
+    def decorator(method):
+        if getattr(method, "__doc__", None) == _WebMethodSignature:
+            raise TypeError("@cached must be applied below @webmethod, otherwise cached responses bypass the permission check")
+        def decorated(handler, request, relpath, *params, **args):
+            environ = request.environ
+            if environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+                return method(handler, request, relpath, *params, **args)
+            route = environ.get("webpie.route")
+            key = (route, relpath, _args_key(args), tuple(environ.get(k) for k in vary_keys))
+            entry = cache.get(key)
+            metrics = handler.App.Metrics if handler.App is not None else None
+            if metrics is not None:
+                metrics.inc("webpie_method_cache_requests_total", 1,
+                        (("route", route or ""), ("result", "miss" if entry is None else "hit")))
+            if entry is not None:
+                return cache.response(entry)
+            response = makeResponse(method(handler, request, relpath, *params, **args))
+            if cache.cacheable(response):
+                headerlist = tuple((h, v) for h, v in response.headerlist if h.lower() != "content-length")
+                entry = cache.put(key, response.status, headerlist, response.body)
+                if entry is not None:
+                    return cache.response(entry)
+            return response
+        decorated.__doc__ = method.__doc__          # keep webmethod() signature
+        decorated.__name__ = method.__name__
+        decorated.cache = cache
+        return decorated
+    return decorator
+
+#
+# Shared HTTP response cache
+#
+# Caches whole responses of a WSGI application according to the Cache-Control, Expires and Vary 
+# response headers, like a reverse proxy cache would do:
+#
+#   app = WPApp(Handler, response_cache = ResponseCache(max_bytes = 100*1024*1024))
+#
+#   # or, as WSGI middleware for any application
+#   app = ResponseCache(wsgi_app, max_bytes = 100*1024*1024)
+#
+# Handlers control caching with response headers:
+#
+#   response.cache_control = "public, max-age=60, stale-while-revalidate=30, stale-if-error=600"
+#
+# Fresh hits are served without calling the application. A response which is stale but still within
+# its stale-while-revalidate window is served as is, while a background thread refreshes it.
+# A stale response within its stale-if-error window is served when the application fails with 5xx.
+#
+# Responses are stored only if they:
+#   - answer a GET request without Authorization header, cached responses are used for HEAD requests too,
+#   - have status 200, 203, 204, 300, 301, 404 or 410,
+#   - have explicit freshness: s-maxage, max-age or Expires,
+#   - do not have Cache-Control private, no-cache or no-store, Vary: * or Set-Cookie
+#
+# POST, PUT, PATCH and DELETE requests invalidate cached responses for their URL.
+#
+
+class _CachedResponse(object):
+
+    __slots__ = ("status", "headerlist", "body", "stored_at", "fresh_until", "stale_until", 
+                    "error_until", "vary", "vary_values", "size")
+
+class ResponseCache(object):
+
+    StatusHeader = "X-Cache"                # HIT, MISS, STALE or None to not add the header
+    CacheableStatus = frozenset([200, 203, 204, 300, 301, 404, 410])
+    InvalidatingMethods = frozenset(["POST", "PUT", "PATCH", "DELETE"])
+    HopByHopHeaders = frozenset(["connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+            "te", "trailers", "transfer-encoding", "upgrade"])
+    EntryOverhead = 500
+    RefreshThreads = 2                      # background refresh threads
+    MaxRefreshQueued = 100                  # stale keys waiting for a refresh thread, more are served stale
+
+    def __init__(self, app = None, max_bytes = 64*1024*1024, max_entry_bytes = 1024*1024, metrics = None):
+        from .Metrics import resolve_registry
+        self.App = app
+        self.MaxBytes = max_bytes
+        self.MaxEntryBytes = max_entry_bytes
+        self.Lock = RLock()
+        self.Entries = OrderedDict()        # (path, query, vary values) -> _CachedResponse, least recently used first
+        self.VaryHeaders = {}               # (path, query) -> environ keys of the request headers the response varies on
+        self.UrlKeys = {}                   # (path, query) -> set of keys in Entries
+        self.Bytes = 0
+        self.Refreshing = set()             # keys queued or being refreshed in background
+        self.RefreshQueue = deque()         # (app, key, environ)
+        self.RefreshWorkers = 0
+        self.Counts = {"hit": 0, "miss": 0, "stale": 0, "refresh": 0, "stale_error": 0, "pass": 0}
+        self.Metrics = resolve_registry(metrics)
+        if self.Metrics is not None:
+            self.Metrics.describe("webpie_response_cache_requests_total", "counter", 
+                "Response cache lookups by result: hit, miss, stale, stale_error, pass")
+
+    def __call__(self, environ, start_response):
+        return self.handle(self.App, environ, start_response)
+
+    def count(self, result):
+        with self.Lock:
+            self.Counts[result] += 1
+        if self.Metrics is not None:
+            self.Metrics.inc("webpie_response_cache_requests_total", 1, (("result", result),))
+
+    def stats(self):
+        with self.Lock:
+            stats = self.Counts.copy()
+            stats["entries"] = len(self.Entries)
+            stats["bytes"] = self.Bytes
+            return stats
+
+    def clear(self):
+        with self.Lock:
+            self.Entries.clear()
+            self.VaryHeaders.clear()
+            self.UrlKeys.clear()
+            self.Bytes = 0
+
+    #
+    # storage
+    #
+
+    @staticmethod
+    def urlKey(environ):
+        return (environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", ""), environ.get("QUERY_STRING", ""))
+
+    def lookup(self, url_key, environ):
+        with self.Lock:
+            vary = self.VaryHeaders.get(url_key)
+            if vary is None:
+                return None, None
+            key = url_key + (tuple(environ.get(k) for k in vary),)
+            entry = self.Entries.get(key)
+            if entry is not None:
+                self.Entries.move_to_end(key)
+            return key, entry
+
+    def store(self, url_key, entry):
+        with self.Lock:
+            key = url_key + (tuple(entry.vary_values),)
+            if self.VaryHeaders.get(url_key) != entry.vary:
+                self.invalidate(url_key)
+                self.VaryHeaders[url_key] = entry.vary
+            old = self.Entries.pop(key, None)
+            if old is not None:
+                self.Bytes -= old.size
+            self.Entries[key] = entry
+            self.UrlKeys.setdefault(url_key, set()).add(key)
+            self.Bytes += entry.size
+            while self.Entries and self.Bytes > self.MaxBytes:
+                evicted_key, evicted = self.Entries.popitem(last=False)        # least recently used
+                self.Bytes -= evicted.size
+                evicted_url = evicted_key[:2]
+                keys = self.UrlKeys.get(evicted_url)
+                if keys is not None:
+                    keys.discard(evicted_key)
+                    if not keys:
+                        del self.UrlKeys[evicted_url]
+                        self.VaryHeaders.pop(evicted_url, None)
+
+    def invalidate(self, url_key):
+        with self.Lock:
+            for key in self.UrlKeys.pop(url_key, ()):
+                self.Bytes -= self.Entries.pop(key).size
+            self.VaryHeaders.pop(url_key, None)
+
+    #
+    # HTTP semantics
+    #
+
+    def makeEntry(self, environ, status, headerlist):
+        # returns a _CachedResponse without body if the response can be stored, otherwise None
+        try:    code = int(status.split(None, 1)[0])
+        except ValueError:
+            return None
+        if code not in self.CacheableStatus:
+            return None
+        headers = {}
+        for h, v in headerlist:
+            h = h.lower()
+            headers[h] = headers[h] + ", " + v if h in headers else v
+        if "set-cookie" in headers:
+            return None
+        cc = CacheControl.parse(headers.get("cache-control", ""), type="response")
+        if cc.no_store or cc.private or cc.no_cache:
+            return None
+        now = time.time()
+        lifetime = cc.s_maxage if cc.s_maxage is not None else cc.max_age
+        if lifetime is None or lifetime < 0:
+            if cc.s_maxage is None and cc.max_age is None and "expires" in headers:
+                expires = parsedate_tz(headers["expires"])
+                date = parsedate_tz(headers.get("date", ""))
+                if expires is None:
+                    return None             # invalid Expires means already expired
+                lifetime = mktime_tz(expires) - (mktime_tz(date) if date is not None else now)
+            else:
+                return None
+        if "authorization" in headers or (environ.get("HTTP_AUTHORIZATION") and not (cc.public or cc.s_maxage)):
+            return None
+        vary = tuple(sorted(set(
+            environ_key(h) for h in headers.get("vary", "").split(",") if h.strip()
+        )))
+        if "HTTP_*" in vary:
+            return None
+        try:    age = max(0, int(headers.get("age", 0)))
+        except ValueError:
+            age = 0
+        entry = _CachedResponse()
+        entry.status = status
+        entry.headerlist = [(h, v) for h, v in headerlist 
+                if h.lower() not in self.HopByHopHeaders and h.lower() not in ("age", "content-length")]
+        entry.stored_at = now - age
+        entry.fresh_until = entry.stored_at + lifetime
+        entry.stale_until = entry.fresh_until + (cc.stale_while_revalidate or 0)
+        entry.error_until = entry.fresh_until + (cc.stale_if_error or 0)
+        entry.vary = vary
+        entry.vary_values = tuple(environ.get(k) for k in vary)
+        return entry
+
+    @staticmethod
+    def requestAllowsCached(environ):
+        cc = environ.get("HTTP_CACHE_CONTROL")
+        if cc:
+            cc = CacheControl.parse(cc, type="request")
+            if cc.no_cache or cc.no_store or cc.max_age == 0:
+                return False
+        return environ.get("HTTP_PRAGMA", "").lower() != "no-cache"
+
+    def respond(self, entry, environ, start_response, cache_status):
+        headers = entry.headerlist + [
+            ("Age", str(int(max(0, time.time() - entry.stored_at)))),
+            ("Content-Length", str(len(entry.body)))
+        ]
+        if self.StatusHeader:
+            headers.append((self.StatusHeader, cache_status))
+        start_response(entry.status, headers)
+        return [] if environ.get("REQUEST_METHOD") == "HEAD" else [entry.body]
+
+    #
+    # request processing
+    #
+
+    def handle(self, app, environ, start_response):
+        method = environ.get("REQUEST_METHOD")
+        url_key = self.urlKey(environ)
+        if method not in ("GET", "HEAD"):
+            self.count("pass")
+            if method in self.InvalidatingMethods:
+                self.invalidate(url_key)
+            return app(environ, start_response)
+
+        use_cached = self.requestAllowsCached(environ)
+        stale = None
+        if use_cached:
+            key, entry = self.lookup(url_key, environ)
+            if entry is not None:
+                now = time.time()
+                if now < entry.fresh_until:
+                    self.count("hit")
+                    return self.respond(entry, environ, start_response, "HIT")
+                if now < entry.stale_until:
+                    self.count("stale")
+                    self.refreshInBackground(app, key, environ)
+                    return self.respond(entry, environ, start_response, "STALE")
+                if now < entry.error_until:
+                    stale = entry
+        self.count("miss")
+        return self.fetch(app, url_key, environ, start_response, stale)
+
+    def fetch(self, app, url_key, environ, start_response, stale = None):
+        # calls the application, stores the response if it is cacheable
+        captured = []
+        def capture_start_response(status, headers, exc_info = None):
+            captured[:] = [status, headers, exc_info]
+            
+        out = app(environ, capture_start_response)
+        
+        if not captured:
+            # start_response is called when the iteration starts
+            out = iter(out)
+            first = next(out, None)
+            out = _Chain(first, out)
+        if not captured:
+            # the application did not call start_response, pass the response through
+            self.count("pass")
+            return out
+        status, headers, exc_info = captured
+
+        if stale is not None and status[:1] == "5":
+            self.count("stale_error")
+            if hasattr(out, "close"):
+                out.close()
+            return self.respond(stale, environ, start_response, "STALE")
+        
+        entry = self.makeEntry(environ, status, headers) if environ.get("REQUEST_METHOD") == "GET" else None
+        if self.StatusHeader:
+            headers = headers + [(self.StatusHeader, "MISS")]
+        if exc_info is not None:
+            start_response(status, headers, exc_info)
+        else:
+            start_response(status, headers)
+        if entry is None:
+            return out
+        return self.storing(out, url_key, entry)
+
+    def storing(self, out, url_key, entry):
+        # passes the body through, storing it in the cache if it is complete and not too large
+        chunks = []
+        size = 0
+        complete = False
+        try:
+            for chunk in out:
+                if chunks is not None:
+                    size += len(chunk)
+                    if size > self.MaxEntryBytes:
+                        chunks = None
+                    else:
+                        chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if hasattr(out, "close"):
+                out.close()
+            if complete and chunks is not None:
+                entry.body = b"".join(c if isinstance(c, bytes) else c.encode("utf-8") for c in chunks)
+                entry.size = len(entry.body) + self.EntryOverhead
+                self.store(url_key, entry)
+
+    def refreshInBackground(self, app, key, environ):
+        # queues the refresh for one of at most RefreshThreads threads
+        with self.Lock:
+            if key in self.Refreshing or len(self.RefreshQueue) >= self.MaxRefreshQueued:
+                return
+            self.Refreshing.add(key)
+        env = environ.copy()
+        env["REQUEST_METHOD"] = "GET"
+        env["wsgi.input"] = io.BytesIO(b"")
+        env["CONTENT_LENGTH"] = "0"
+        for k in list(env.keys()):
+            if k.startswith("webpie.") or k.startswith("webob.") or k == "query_dict":
+                del env[k]              # per-request state cached in the environ
+        with self.Lock:
+            self.RefreshQueue.append((app, key, env))
+            if self.RefreshWorkers >= self.RefreshThreads:
+                return
+            self.RefreshWorkers += 1
+        t = Thread(target=self.refreshQueued)
+        t.daemon = True
+        t.start()
+
+    def refreshQueued(self):
+        # runs in a refresh thread until the queue is empty
+        while True:
+            with self.Lock:
+                if not self.RefreshQueue:
+                    self.RefreshWorkers -= 1
+                    return
+                app, key, environ = self.RefreshQueue.popleft()
+            self.refresh(app, key, environ)
+
+    def refresh(self, app, key, environ):
+        try:
+            self.count("refresh")
+            out = self.fetch(app, key[:2], environ, lambda status, headers, exc_info = None: None)
+            for _ in out:
+                pass
+            if hasattr(out, "close"):
+                out.close()
+        except:
+            sys.stderr.write("ResponseCache: background refresh failed for %s?%s\n" % key[:2])
+        finally:
+            with self.Lock:
+                self.Refreshing.discard(key)
+
+class _Chain(object):
+
+    def __init__(self, first, rest):
+        self.First = first
+        self.Rest = rest
+
+    def __iter__(self):
+        if self.First is not None:
+            yield self.First
+        for x in self.Rest:
+            yield x
+
+    def close(self):
+        if hasattr(self.Rest, "close"):
+            self.Rest.close()
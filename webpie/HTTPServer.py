@@ -1,59 +1,414 @@
-import fnmatch, traceback, sys, select, time, os.path, stat, pprint
+import fnmatch, traceback, sys, select, time, os, os.path, stat, mimetypes
+from collections import deque
+from threading import Lock, Event, current_thread
+from email.utils import formatdate
 from socket import *
-from pythreader import PyThread, synchronized, Task, TaskQueue
-from .WebPieApp import Response
+from pythreader import PyThread, synchronized, Task
+from .Metrics import resolve_registry
+from .Timers import TimerWheel
+from .WorkerPool import WorkerPool
+from .query import parse_query, pairs_to_dict
+from .headers import environ_key
 
 from .py3 import to_bytes, PY3
 
 Debug = False
+
+try:
+    from sys import intern                      # Python 3
+except ImportError:
+    pass
+
+try:
+    from urllib.parse import unquote            # Python 3
+except ImportError:
+    from urllib import unquote
+
+class HTTPHeaders(object):
+
+    # Case-insensitive map of request headers, built once when the request is parsed.
+    # Repeated headers are combined into a single comma-separated value.
+
+    __slots__ = ("Dict", "List")
+
+    def __init__(self):
+        self.Dict = {}              # lower case name -> value
+        self.List = []              # [(name, value)] as received
+
+    def add(self, name, value):
+        self.List.append((name, value))
+        lname = name.lower()
+        old = self.Dict.get(lname)
+        if old is None:
+            self.Dict[lname] = value
+        else:
+            self.Dict[lname] = old + ("; " if lname == "cookie" else ", ") + value
+
+    def get(self, name, default = None):
+        return self.Dict.get(name.lower(), default)
+
+    def __getitem__(self, name):
+        return self.Dict[name.lower()]
+
+    def __contains__(self, name):
+        return name.lower() in self.Dict
+
+    def __len__(self):
+        return len(self.Dict)
+
+    def items(self):
+        return self.List
+
+    def addToEnviron(self, env):
+        for lname, v in self.Dict.items():
+            env[environ_key(lname)] = v
         
+class RequestBodyTooLarge(IOError):
+    pass
+
 class BodyFile(object):
+
+    # Request body stream, wsgi.input
+    #
+    # Data received together with the request headers is kept as a deque of memoryviews, 
+    # the rest is received from the socket only when the application asks for it. At most MaxBuffered bytes
+    # are received ahead of the application, so the unread part of the body stays in the kernel and TCP flow
+    # control slows down the client. Data beyond Content-Length is never returned.
+    #
+    # If max_size is set, at most max_size bytes are returned. An attempt to read more raises RequestBodyTooLarge
+    # and sets TooLarge, the server then responds with 413. This limits bodies sent without Content-Length.
+
+    ReadSize = 64*1024
+    MaxBuffered = 1024*1024
     
-    def __init__(self, buf, sock, length):
-        self.Buffer = buf
+    def __init__(self, chunks, sock, length, max_buffered = None, max_size = None):
+        self.Chunks = deque()
+        self.Buffered = 0
         self.Sock = sock
-        self.Remaining = length
-        
-    def get_chunk(self, n):
-        if self.Buffer:
-            chunk = self.Buffer[0]
-            if len(chunk) > n:
-                out = chunk[:n]
-                self.Buffer[0] = chunk[n:]
+        self.Remaining = length                 # body bytes not yet returned to the application, None - until EOF
+        self.BytesReceived = 0
+        self.MaxSize = max_size
+        self.Received = 0                       # body bytes buffered or returned, up to MaxSize
+        self.TooLarge = False
+        self.WaitingSince = None                # time when the application started waiting in recv(), or None
+        self.MaxBuffered = max_buffered or self.MaxBuffered
+        for c in chunks:
+            self.append(c)
+            
+    def append(self, data):
+        # adds received data to the buffer, truncated at the end of the body
+        view = memoryview(data)
+        if self.Remaining is not None:
+            room = self.Remaining - self.Buffered
+            if len(view) > room:
+                view = memoryview(view[:max(room, 0)].tobytes())
+        if self.MaxSize is not None and self.Received + len(view) > self.MaxSize:
+            self.TooLarge = True
+            view = memoryview(view[:max(self.MaxSize - self.Received, 0)].tobytes())
+        self.Received += len(view)
+        if len(view):
+            self.Chunks.append(view)
+            self.Buffered += len(view)
+
+    def toReceive(self, n):
+        # number of bytes which can be received from the socket now, up to n
+        # called when more data is needed
+        self.checkSize()
+        if self.Sock is None:
+            return 0
+        if self.MaxSize is not None:
+            n = min(n, self.MaxSize - self.Received + 1)        # one more byte to see if the body is too large
+        if self.Remaining is not None:
+            n = min(n, self.Remaining - self.Buffered)
+        return max(0, min(n, self.MaxBuffered - self.Buffered))
+            
+    def received(self):
+        # True if the whole body has been received from the socket
+        return self.Sock is None or (self.Remaining is not None and self.Remaining <= self.Buffered)
+
+    def checkSize(self):
+        if self.TooLarge:
+            raise RequestBodyTooLarge("Request body is larger than %d bytes" % (self.MaxSize,))
+
+    def fill(self):
+        # receives more data into the buffer, returns False on EOF
+        n = self.toReceive(self.ReadSize)
+        if n <= 0:
+            return False
+        self.WaitingSince = time.time()
+        try:    data = self.Sock.recv(n)
+        finally:
+            self.WaitingSince = None
+        if not data:
+            self.Sock = None
+            return False
+        self.BytesReceived += len(data)
+        self.append(data)
+        if not self.Chunks:
+            self.checkSize()
+        return True
+        
+    def consumed(self, n):
+        self.Buffered -= n
+        if self.Remaining is not None:
+            self.Remaining -= n
+
+    def readinto(self, buf):
+        # copies up to len(buf) bytes into buf, returns the number of bytes copied, 0 on EOF
+        out = memoryview(buf).cast("B")
+        size = len(out)
+        if not size:
+            return 0
+        if not self.Chunks:
+            # nothing buffered, receive directly into the caller's buffer
+            n = self.toReceive(size)
+            if n <= 0:
+                return 0
+            self.WaitingSince = time.time()
+            try:    n = self.Sock.recv_into(out, n)
+            finally:
+                self.WaitingSince = None
+            if not n:
+                self.Sock = None
+                return 0
+            self.BytesReceived += n
+            self.Received += n
+            if self.MaxSize is not None and self.Received > self.MaxSize:
+                self.TooLarge = True
+                n -= self.Received - self.MaxSize
+                self.Received = self.MaxSize
+                if not n:
+                    self.checkSize()
+            if self.Remaining is not None:
+                self.Remaining -= n
+            return n
+        n = 0
+        chunks = self.Chunks
+        while chunks and n < size:
+            chunk = chunks[0]
+            m = min(len(chunk), size - n)
+            out[n:n+m] = chunk[:m]
+            n += m
+            if m < len(chunk):
+                chunks[0] = chunk[m:]
             else:
-                out = chunk
-                self.Buffer = self.Buffer[1:]
-        elif self.Sock is not None:
-            out = self.Sock.recv(n)
-            if not out: self.Sock = None
-        return out
+                chunks.popleft()
+        self.consumed(n)
+        return n
         
-    MAXMSG = 100000
-    
     def read(self, N = None):
-        #print ("read({})".format(N))
-        #print ("Buffer:", self.Buffer)
-        if N is None:   N = self.Remaining
+        if N is None or N < 0:
+            return self.readall()
+        chunks = self.Chunks
+        if not chunks and not self.fill():
+            return b""
+        chunk = chunks[0]
+        if len(chunk) >= N:
+            # common case, no need to assemble
+            out = chunk[:N].tobytes()
+            if len(chunk) > N:
+                chunks[0] = chunk[N:]
+            else:
+                chunks.popleft()
+            self.consumed(N)
+            return out
+        # N comes from the application, often Content-Length declared by the client: do not allocate it up front,
+        # start with ReadSize and grow the buffer when it is filled with received data
+        buf = bytearray(min(N, self.ReadSize))
+        n = 0
+        while n < N:
+            if n == len(buf):
+                buf.extend(bytes(min(N - n, n)))        # double, up to N
+            view = memoryview(buf)
+            m = self.readinto(view[n:])
+            del view
+            if not m:
+                break
+            n += m
+        if n < len(buf):
+            del buf[n:]
+        return bytes(buf)
+        
+    def readall(self):
+        if self.Remaining is not None:
+            return self.read(self.Remaining)
+        out = []
+        while self.Chunks or self.fill():
+            out.extend(c.tobytes() for c in self.Chunks)
+            self.consumed(self.Buffered)
+            self.Chunks.clear()
+        return b"".join(out)
+
+    def readline(self, limit = -1):
         out = []
         n = 0
-        eof = False
-        while not eof and (N is None or n < N):
-            ntoread = self.MAXMSG if N is None else N - n
-            chunk = self.get_chunk(ntoread)
-            if not chunk:
-                eof = True
+        chunks = self.Chunks
+        while limit is None or limit < 0 or n < limit:
+            if not chunks and not self.fill():
+                break
+            chunk = chunks[0]
+            m = len(chunk)
+            if limit is not None and limit >= 0:
+                m = min(m, limit - n)
+            # each buffered chunk is a tail of the received bytes object, search it without copying
+            data = chunk.obj
+            offset = len(data) - len(chunk)
+            i = data.find(b"\n", offset, offset + m)
+            if i >= 0:
+                m = i - offset + 1
+            out.append(chunk[:m].tobytes())
+            n += m
+            if m < len(chunk):
+                chunks[0] = chunk[m:]
             else:
-                n += len(chunk)
-                out.append(chunk)
-        out = b''.join(out)
-        if self.Remaining is not None:
-            self.Remaining -= len(out)
-        #print ("returning:[{}]".format(out))
-        return out
+                chunks.popleft()
+            self.consumed(m)
+            if i >= 0:
+                break
+        return b"".join(out)
+        
+    def readlines(self, hint = -1):
+        lines = []
+        n = 0
+        for line in self:
+            lines.append(line)
+            n += len(line)
+            if hint is not None and hint > 0 and n >= hint:
+                break
+        return lines
+        
+    def __iter__(self):
+        return self
+        
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+        
+    next = __next__             # Python 2
             
             
+class StaticFile(object):
+
+    __slots__ = ("Path", "Size", "MTime", "ETag", "LastModified", "Headers", "CheckedAt")
+
+    def __init__(self, path, st, content_type, max_age):
+        self.Path = path
+        self.Size = st.st_size
+        self.MTime = st.st_mtime
+        self.ETag = '"%x-%x"' % (int(st.st_mtime*1000000), st.st_size)
+        self.LastModified = formatdate(st.st_mtime, usegmt=True)
+        headers = [
+            ("Content-Type", content_type), 
+            ("Content-Length", str(st.st_size)),
+            ("ETag", self.ETag),
+            ("Last-Modified", self.LastModified),
+            ("Accept-Ranges", "none")
+        ]
+        if max_age is not None:
+            headers.append(("Cache-Control", "max-age=%d" % (max_age,)))
+        self.Headers = headers
+        self.CheckedAt = time.time()
+        
+    def sameAs(self, st):
+        return st.st_size == self.Size and st.st_mtime == self.MTime
+
+class StaticFiles(object):
+
+    # Maps request paths under a mount prefix to files under a directory.
+    # Resolved paths and file metadata are cached and re-checked with stat() at most every CheckInterval seconds.
+    
+    MaxCached = 10000
+    CheckInterval = 1.0
+    IndexFile = "index.html"
+    DefaultContentType = "application/octet-stream"
+    Forbidden = "forbidden"         # lookup() result for a directory without the index file
+    
+    def __init__(self, mounts, max_age = None):
+        # mounts: {prefix: directory} or [(prefix, directory)]
+        if isinstance(mounts, dict):
+            mounts = mounts.items()
+        self.Mounts = sorted(
+            [(prefix.rstrip("/"), os.path.realpath(directory)) for prefix, directory in mounts], 
+            key = lambda m: -len(m[0])          # longest prefix first
+        )
+        self.MaxAge = max_age
+        self.Lock = Lock()
+        self.Cache = {}                 # request path -> StaticFile, Forbidden, or None for not found
+        
+    def match(self, path):
+        # returns (mount prefix, mount directory) or None
+        for prefix, directory in self.Mounts:
+            if path == prefix or path.startswith(prefix + "/"):
+                return prefix, directory
+        return None
+        
+    def contentType(self, path):
+        ext = path.rsplit('.',1)[-1].lower()
+        content_type = HTTPServer.MIME_TYPES_BASE.get(ext) or mimetypes.guess_type(path)[0] or self.DefaultContentType
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+        return content_type
+        
+    def resolve(self, path, prefix, directory):
+        relpath = unquote(path[len(prefix)+1:])
+        if "\0" in relpath:
+            return None
+        fullpath = os.path.realpath(os.path.join(directory, relpath))
+        if fullpath != directory and not fullpath.startswith(directory + os.sep):
+            return None                 # outside of the mounted directory
+        try:
+            st = os.stat(fullpath)
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            fullpath = os.path.join(fullpath, self.IndexFile)
+            try:
+                st = os.stat(fullpath)
+            except OSError:
+                return self.Forbidden       # directory listing is not served
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return StaticFile(fullpath, st, self.contentType(fullpath), self.MaxAge)
+    
+    def lookup(self, path):
+        # returns (True, StaticFile, Forbidden or None if not found) if the path is under a static mount, 
+        # (False, None) otherwise
+        with self.Lock:
+            cached = self.Cache.get(path)
+        if cached is not None and time.time() < cached[0] + self.CheckInterval:
+            return True, cached[1]
+        mount = self.match(path)
+        if mount is None:
+            return False, None
+        f = self.resolve(path, *mount)
+        with self.Lock:
+            if len(self.Cache) >= self.MaxCached:
+                self.Cache.clear()
+            self.Cache[path] = (time.time(), f)
+        return True, f
+        
+    def open(self, path, f):
+        # opens the file and makes sure the metadata is current, returns (file object, StaticFile) or (None, None)
+        try:
+            fobj = open(f.Path, "rb")
+        except (IOError, OSError):
+            with self.Lock:
+                self.Cache.pop(path, None)
+            return None, None
+        st = os.fstat(fobj.fileno())
+        if not f.sameAs(st):
+            f = StaticFile(f.Path, st, self.contentType(f.Path), self.MaxAge)
+            with self.Lock:
+                self.Cache[path] = (time.time(), f)
+        return fobj, f
+
 class HTTPConnection(Task):
 
+    UseSendfile = hasattr(os, "sendfile")
+    SendfileChunk = 1024*1024
+
     MAXMSG = 100000
 
     def __init__(self, server, csock, caddr):
@@ -64,10 +419,10 @@ class HTTPConnection(Task):
         self.ReadClosed = False
         self.RequestHeadline = None
         self.RequestReceived = False
-        self.RequestBuffer = ""
+        self.RequestBuffer = b""
         self.Body = []
-        self.Headers = []
-        self.HeadersDict = {}
+        self.HeadersDict = HTTPHeaders()
+        self.Headers = self.HeadersDict.List
         self.URL = None
         self.RequestMethod = None
         self.QueryString = ""
@@ -79,6 +434,20 @@ class HTTPConnection(Task):
         self.ResponseStatus = None
         self.OriginalPathInfo = self.PathInfo = None
         self.ValidRequest = False
+        self.BytesReceived = 0
+        self.Input = None
+        self.QueuedAt = None
+        self.RequestStarted = None
+        self.OutFile = None
+        self.OutFileOffset = 0
+        self.OutFileRemaining = 0
+        self.Deadlines = {}                 # phase -> time
+        self.LastActivity = None
+        self.InApplication = False
+        self.Timer = None                   # TimerWheel handle
+        self.TimerAt = None
+        self.TimerLock = Lock()
+        self.TimedOut = None                # phase which timed out
         
     def debug(self, msg):
         if Debug:
@@ -87,7 +456,10 @@ class HTTPConnection(Task):
     def parseRequest(self):
         #print("requestReceived:[%s]" % (self.RequestBuffer,))
         # parse the request
-        lines = self.RequestBuffer.split('\n')
+        try:    head = self.RequestBuffer.decode("utf-8")
+        except UnicodeDecodeError:
+            head = self.RequestBuffer.decode("latin-1")
+        lines = head.split('\n')
         lines = [l.strip() for l in lines if l.strip()]
         if not lines:
             return False
@@ -96,7 +468,7 @@ class HTTPConnection(Task):
         #self.debug("Request: %s" % (words,))
         if len(words) != 3:
             return False
-        self.RequestMethod = words[0].upper()
+        self.RequestMethod = intern(words[0].upper())
         self.RequestProtocol = words[2]
         self.URL = words[1]
         uwords = self.URL.split('?',1)
@@ -113,23 +485,19 @@ class HTTPConnection(Task):
             if len(words) > 1:
                 value = words[1].strip()
             if name:
-                self.Headers.append((name, value))
-                self.HeadersDict[name] = value
+                self.HeadersDict.add(name, value)
         return True
         
     def getHeader(self, header, default = None):
-        # case-insensitive version of dictionary lookup
-        h = header.lower()
-        for k, v in self.HeadersDict.items():
-            if k.lower() == h:
-                return v
-        return default
+        # case-insensitive
+        return self.HeadersDict.get(header, default)
         
     def addToRequest(self, data):
         #print("Add to request:", data)
+        if not isinstance(data, bytes):   data = to_bytes(data)
         self.RequestBuffer += data
-        inx_nn = self.RequestBuffer.find('\n\n')
-        inx_rnrn = self.RequestBuffer.find('\r\n\r\n')
+        inx_nn = self.RequestBuffer.find(b'\n\n')
+        inx_rnrn = self.RequestBuffer.find(b'\r\n\r\n')
         if inx_nn < 0:
             inx = inx_rnrn
             n = 4
@@ -157,62 +525,97 @@ class HTTPConnection(Task):
     def addToBody(self, data):
         if PY3 and isinstance(data, str):   data = to_bytes(data)
         #print ("addToBody:", data)
-        self.Body.append(data)
+        if self.Input is not None:
+            self.Input.append(data)
+        else:
+            self.Body.append(data)
 
     def parseQuery(self, query):
-        out = {}
-        for w in query.split("&"):
-            if w:
-                words = w.split("=", 1)
-                k = words[0]
-                if k:
-                    v = None
-                    if len(words) > 1:  v = words[1]
-                    if k in out:
-                        old = out[k]
-                        if type(old) != type([]):
-                            old = [old]
-                            out[k] = old
-                        out[k].append(v)
-                    else:
-                        out[k] = v
-        return out
+        return pairs_to_dict(parse_query(query))
                 
+    EnvironTemplate = {
+        "SCRIPT_NAME":          "",
+        "wsgi.version":         (1, 0),
+        "wsgi.url_scheme":      "http",
+        "wsgi.errors":          sys.stderr,
+        "wsgi.multithread":     True,
+        "wsgi.multiprocess":    False,
+        "wsgi.run_once":        False
+    }
+
     def processRequest(self):        
         #self.debug("processRequest()")
-        env = dict(
-            REQUEST_METHOD = self.RequestMethod.upper(),
-            PATH_INFO = self.PathInfo,
-            SCRIPT_NAME = "",
-            SERVER_PROTOCOL = self.RequestProtocol,
-            QUERY_STRING = self.QueryString
-        )
+        metrics = self.Server.Metrics
+        if metrics is not None:
+            self.RequestStarted = time.time()
+            metrics.add("webpie_server_requests_in_flight", 1)
+        headers = self.HeadersDict
+        limiter = self.Server.RateLimiter
+        if limiter is not None:
+            allowed, retry_after = limiter.allow(limiter.clientKey(self.CAddr, headers))
+            if not allowed:
+                if metrics is not None:
+                    metrics.inc("webpie_server_rate_limited_total")
+                self.reject("429 Too Many Requests", "Too many requests\n", 
+                        [("Retry-After", str(int(retry_after) + 1))])
+                return
+        static = self.Server.StaticFiles
+        if static is not None and self.RequestMethod in ("GET", "HEAD"):
+            is_static, f = static.lookup(self.OriginalPathInfo)
+            if is_static:
+                self.sendStatic(static, f)
+                return
+        env = self.EnvironTemplate.copy()
+        headers.addToEnviron(env)
+        env["REQUEST_METHOD"] = self.RequestMethod
+        env["PATH_INFO"] = self.PathInfo
+        env["SERVER_PROTOCOL"] = self.RequestProtocol
+        env["QUERY_STRING"] = self.QueryString
+        env["REMOTE_ADDR"] = self.CAddr[0]
         
-        if self.HeadersDict.get("Expect") == "100-continue":
-            self.CSock.send(b'HTTP/1.1 100 Continue\n\n')
+        content_length = env.get("CONTENT_LENGTH")
+        if content_length is not None:
+            try:    self.BodyLength = int(content_length)
+            except ValueError:
+                del env["CONTENT_LENGTH"]
+
+        #
+        # Decide whether to accept the request body before the client sends it
+        #
+        max_body_size = self.Server.MaxBodySize
+        if max_body_size is not None and self.BodyLength is not None and self.BodyLength > max_body_size:
+            self.reject("413 Request Entity Too Large", 
+                    "Request body is too large. Maximum size is %d bytes\n" % (max_body_size,))
+            return
+        expect = headers.get("expect")
+        if expect is not None:
+            if expect.lower() != "100-continue":
+                self.reject("417 Expectation Failed", "Unsupported expectation: %s\n" % (expect,))
+                return
+            try:    
+                accepted = self.Server.acceptIncomingTransfer(self.RequestMethod, self.URL, headers)
+            except:
+                self.Server.log_error(self.CAddr, traceback.format_exc())
+                accepted = "500 Server Error"
+            if accepted is not True:
+                status = accepted if isinstance(accepted, str) else "417 Expectation Failed"
+                self.reject(status, "Request body rejected\n")
+                return
+            self.CSock.send(b'HTTP/1.1 100 Continue\r\n\r\n')
                 
-        env["wsgi.url_scheme"] = "http"
-        env["query_dict"] = self.parseQuery(self.QueryString)
-        
         #print ("processRequest: env={}".format(env))
         
-        for h, v in self.HeadersDict.items():
-            h = h.lower()
-            if h == "content-type": env["CONTENT_TYPE"] = v
-            elif h == "host":
-                words = v.split(":",1)
-                words.append("")    # default port number
-                env["HTTP_HOST"] = v
-                env["SERVER_NAME"] = words[0]
-                env["SERVER_PORT"] = words[1]
-            elif h == "content-length": 
-                env["CONTENT_LENGTH"] = self.BodyLength = int(v)
-            else:
-                env["HTTP_%s" % (h.upper().replace("-","_"),)] = v
+        host = env.get("HTTP_HOST")
+        if host is not None:
+            name, _, port = host.partition(":")
+            env["SERVER_NAME"] = name
+            env["SERVER_PORT"] = port or str(self.Server.Port)
 
-        env["wsgi.input"] = BodyFile(self.Body, self.CSock, self.BodyLength)
-        
+        env["wsgi.input"] = self.Input = BodyFile(self.Body, self.CSock, self.BodyLength, max_size = max_body_size)
         
+        if self.BodyLength:
+            self.setDeadline("body", self.Server.BodyTimeout)
+        self.InApplication = True
         try:
             self.OutIterable = self.Server.wsgi_app(env, self.start_response)    
         except:
@@ -220,9 +623,81 @@ class HTTPConnection(Task):
                             [("Content-Type","text/plain")])
             self.OutBuffer = error = traceback.format_exc()
             self.Server.log_error(self.CAddr, error)
+        self.InApplication = False
+        self.LastActivity = time.time()
+        self.clearDeadline("body")
+        if self.Input.TooLarge:
+            # the application tried to read more than max_body_size bytes, respond with 413 instead
+            if hasattr(self.OutIterable, "close"):
+                self.OutIterable.close()
+            self.reject("413 Request Entity Too Large", 
+                    "Request body is too large. Maximum size is %d bytes\n" % (max_body_size,))
+            return
         self.OutputEnabled = True
         #self.debug("registering for writing: %s" % (self.CSock.fileno(),))    
 
+    def sendStatic(self, static, f):
+        # serves a file from a static mount without calling the application
+        self.ReadClosed = True
+        if f is None:
+            self.reject("404 Not Found", "Not found\n")
+            return
+        if f is static.Forbidden:
+            self.reject("403 Forbidden", "Forbidden\n")
+            return
+        headers = self.HeadersDict
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == "*" or f.ETag in [t.strip() for t in if_none_match.split(",")]
+        else:
+            not_modified = headers.get("if-modified-since") == f.LastModified
+        if not_modified:
+            self.start_response("304 Not Modified", [("ETag", f.ETag), ("Last-Modified", f.LastModified)])
+        else:
+            fobj = None
+            if self.RequestMethod != "HEAD":
+                fobj, f = static.open(self.OriginalPathInfo, f)
+                if fobj is None:
+                    self.reject("404 Not Found", "Not found\n")
+                    return
+                self.OutFile = fobj
+                self.OutFileOffset = 0
+                self.OutFileRemaining = f.Size
+            self.start_response("200 OK", f.Headers)
+        self.OutIterable = None
+        self.OutputEnabled = True
+
+    def sendFileChunk(self):
+        # returns number of bytes sent, 0 if the connection is closed
+        n = min(self.SendfileChunk, self.OutFileRemaining)
+        try:
+            if self.UseSendfile:
+                sent = os.sendfile(self.CSock.fileno(), self.OutFile.fileno(), self.OutFileOffset, n)
+            else:
+                self.OutFile.seek(self.OutFileOffset)
+                sent = self.CSock.send(self.OutFile.read(min(n, self.MAXMSG)))
+        except:
+            sent = 0
+        self.OutFileOffset += sent
+        self.OutFileRemaining -= sent
+        if not sent or self.OutFileRemaining <= 0:
+            self.closeOutFile()
+        return sent
+        
+    def closeOutFile(self):
+        if self.OutFile is not None:
+            self.OutFile.close()
+            self.OutFile = None
+
+    def reject(self, status, message, headers = []):
+        # responds without calling the application and without reading the request body
+        self.ReadClosed = True
+        self.Body = []
+        self.start_response(status, [("Content-Type", "text/plain"), ("Content-Length", str(len(message))),
+                    ("Connection", "close")] + headers)
+        self.OutIterable = [message]
+        self.OutputEnabled = True
+
     def start_response(self, status, headers):
         #print("start_response({}, {})".format(status, headers))
         self.ResponseStatus = status.split()[0]
@@ -238,9 +713,10 @@ class HTTPConnection(Task):
 
         try:    
             data = self.CSock.recv(self.MAXMSG)
-            if PY3: data = data.decode("utf-8")
+            self.BytesReceived += len(data)
+            self.LastActivity = time.time()
         except: 
-            data = ""
+            data = b""
         
         #print("data:[{}]".format(data))
 
@@ -255,6 +731,7 @@ class HTTPConnection(Task):
             self.ReadClosed = True
             
         if request_just_received:
+            self.clearDeadline("header")
             if self.ValidRequest:
                 self.processRequest()
             else:
@@ -270,6 +747,12 @@ class HTTPConnection(Task):
         if self.OutBuffer:
             line = self.OutBuffer
             self.OutBuffer = None
+        elif self.OutFile is not None:
+            sent = self.sendFileChunk()
+            self.BytesSent += sent
+            if not sent:
+                self.shutdown()
+            return
         elif isinstance(self.OutIterable, list):
             if self.OutIterable:
                 line = self.OutIterable[0]
@@ -278,11 +761,14 @@ class HTTPConnection(Task):
                 self.OutIterable = None
                 #print("OutIterable removed")
         elif self.OutIterable is not None:
+            self.InApplication = True
             try:    
                 line = next(self.OutIterable)
             except StopIteration:
                 self.OutIterable = None
                 #print("OutIterable removed")
+            finally:
+                self.InApplication = False
         if line is not None:
             try:
                 if isinstance(line, str) and sys.version_info >= (3,):
@@ -291,6 +777,7 @@ class HTTPConnection(Task):
             except: 
                 sent = 0
             self.BytesSent += sent
+            self.LastActivity = time.time()
             if not sent:
                 #self.debug("write socket closed")
                 self.shutdown()
@@ -299,31 +786,172 @@ class HTTPConnection(Task):
                 line = line[sent:]
                 self.OutBuffer = line or None
         
+    MetricsMethods = ("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+
+    def recordMetrics(self, metrics):
+        bytes_received = self.BytesReceived
+        if self.Input is not None:
+            bytes_received += self.Input.BytesReceived
+        if self.QueuedAt is not None:
+            metrics.add("webpie_server_connections_open", -1)
+        metrics.inc("webpie_server_bytes_received_total", bytes_received)
+        metrics.inc("webpie_server_bytes_sent_total", self.BytesSent)
+        if self.RequestStarted is not None:
+            method = self.RequestMethod if self.RequestMethod in self.MetricsMethods else "other"
+            metrics.add("webpie_server_requests_in_flight", -1)
+            metrics.observe("webpie_server_request_duration_seconds", time.time() - self.RequestStarted)
+            metrics.inc("webpie_server_responses_total", 1, 
+                    (("method", method), ("status", self.ResponseStatus or "")))
+            self.RequestStarted = None
+
+    #
+    # Timeouts
+    #
+    # Deadlines are kept per phase: "header", "body" and "request". The body deadline ends when the whole body
+    # is received or the application returns. The idle deadline is LastActivity + IdleTimeout. While the application
+    # is running, it applies only to the time the application waits in a single recv() for the request body,
+    # so a client which stops sending the body does not hold the worker. The connection has at most one timer
+    # in the server's TimerWheel, set to the earliest deadline. When it fires, the socket is shut down, which
+    # wakes up the worker blocked in select() or recv(). A running application can not be interrupted, 
+    # but it will not be able to send the response.
+    #
+
+    def setDeadline(self, phase, timeout):
+        if timeout is not None and self.Server is not None and self.Server.Timers is not None:
+            self.Deadlines[phase] = time.time() + timeout
+            self.scheduleTimer()
+
+    def clearDeadline(self, phase):
+        # the timer is moved to the next deadline when it fires
+        self.Deadlines.pop(phase, None)
+
+    def nextDeadline(self, idle_timeout):
+        deadlines = list(self.Deadlines.values())
+        if idle_timeout is not None and self.LastActivity is not None:
+            if not self.InApplication:
+                deadlines.append(self.LastActivity + idle_timeout)
+            else:
+                waiting_since = self.Input.WaitingSince if self.Input is not None else None
+                deadlines.append((waiting_since or time.time()) + idle_timeout)
+        return min(deadlines) if deadlines else None
+
+    def scheduleTimer(self):
+        server = self.Server
+        if server is None or server.Timers is None:
+            return
+        with self.TimerLock:
+            when = self.nextDeadline(server.IdleTimeout)
+            if when is None or (self.Timer is not None and self.TimerAt <= when):
+                return
+            server.Timers.cancel(self.Timer)
+            self.Timer = server.Timers.schedule(when, self.timerExpired)
+            self.TimerAt = when
+
+    def cancelTimer(self):
+        with self.TimerLock:
+            if self.Timer is not None:
+                self.Server.Timers.cancel(self.Timer)
+                self.Timer = None
+
+    def timerExpired(self):
+        # called by the TimerWheel thread
+        server = self.Server
+        if server is None:
+            return
+        now = time.time()
+        expired = None
+        with self.TimerLock:
+            self.Timer = None
+            for phase, t in list(self.Deadlines.items()):
+                if t <= now:
+                    if phase == "body" and self.Input is not None and self.Input.received():
+                        del self.Deadlines[phase]
+                        continue
+                    expired = phase
+                    break
+            else:
+                idle_timeout = server.IdleTimeout
+                if idle_timeout is not None and self.LastActivity is not None:
+                    if not self.InApplication:
+                        idle_since = self.LastActivity
+                    else:
+                        idle_since = self.Input.WaitingSince if self.Input is not None else None
+                    if idle_since is not None and idle_since + idle_timeout <= now:
+                        expired = "idle"
+        if expired is None:
+            self.scheduleTimer()
+        else:
+            self.timeout(expired)
+
+    def timeout(self, phase):
+        self.TimedOut = phase
+        server = self.Server
+        if server is not None:
+            server.timeoutOccurred(self, phase)
+        sock = self.CSock
+        if sock is None:
+            return
+        if phase == "header" and not self.RequestReceived:
+            try:    sock.send(b"HTTP/1.1 408 Request Timeout\r\nContent-Length: 0\r\nConnection: close\r\n\r\n", MSG_DONTWAIT)
+            except: pass        # not possible with TLS sockets
+        self.abort()
+
+    def abort(self):
+        # can be called from any thread, the worker will see the connection closed and shut it down
+        sock = self.CSock
+        if sock is not None:
+            try:    sock.shutdown(SHUT_RDWR)
+            except: pass
+
+    # overridable
+    def begin(self):
+        # called by the worker before the request is read, returns False to close the connection
+        return True
+
+    def close(self):
+        # called by the WorkerPool for a connection still queued when the server stops
+        self.shutdown()
+
     def shutdown(self):
+            if self.Server is None:
+                return          # already shut down
+            if self.Server.Metrics is not None:
+                self.recordMetrics(self.Server.Metrics)
             self.Server.log(self.CAddr, self.RequestMethod, self.URL, self.ResponseStatus, self.BytesSent)
             self.debug("shutdown")
+            self.cancelTimer()
+            self.closeOutFile()
             if self.CSock != None:
                 self.debug("closing client socket")
-                try:    
-                    self.CSock.shutdown(SHUT_RDWR)
-                    self.CSock.close()
-                except:
-                    pass
+                try:    self.CSock.shutdown(SHUT_RDWR)
+                except: pass            # may be shut down already by a timeout
+                try:    self.CSock.close()
+                except: pass
                 self.CSock = None
             if self.Server is not None:
                 self.Server.connectionClosed(self)
                 self.Server = None
             
     def run(self):
+        if self.QueuedAt is not None and self.Server is not None and self.Server.Metrics is not None:
+            self.Server.Metrics.observe("webpie_server_queue_wait_seconds", time.time() - self.QueuedAt)
+        if self.Server is not None and self.Server.Timers is not None:
+            self.LastActivity = time.time()
+            self.setDeadline("request", self.Server.RequestTimeout)
+            self.setDeadline("header", self.Server.HeaderTimeout)
+        if self.CSock is not None and not self.begin():
+            self.shutdown()
+            return
         while self.CSock is not None:       # shutdown() will set it to None
-            rlist = [] if self.ReadClosed else [self.CSock]
+            # once the request headers are received, the body is read by the application from wsgi.input
+            rlist = [] if self.ReadClosed or self.RequestReceived else [self.CSock]
             wlist = [self.CSock] if self.OutputEnabled else []
             rlist, wlist, exlist = select.select(rlist, wlist, [], 10.0)
             if self.CSock in rlist:
                 self.doClientRead()
             if self.CSock in wlist:
                 self.doWrite()
-            if self.OutputEnabled and not self.OutBuffer and self.OutIterable is None:
+            if self.OutputEnabled and not self.OutBuffer and self.OutIterable is None and self.OutFile is None:
                 self.shutdown()     # noting else to send
                 
 class HTTPServer(PyThread):
@@ -340,7 +968,10 @@ class HTTPServer(PyThread):
 
     def __init__(self, port, app, remove_prefix = "", url_pattern="*", max_connections = 100, 
                 enabled = True, max_queued = 100,
-                logging = True, log_file = None):
+                logging = True, log_file = None, metrics = None, max_body_size = None,
+                static = None, static_max_age = None, rate_limit = None,
+                header_timeout = 30.0, body_timeout = 300.0, idle_timeout = 60.0, request_timeout = None,
+                listen_fd = None, backlog = 10, min_workers = 4, worker_idle_timeout = 30.0):
         PyThread.__init__(self)
         #self.debug("Server started")
         self.Port = port
@@ -349,8 +980,41 @@ class HTTPServer(PyThread):
         self.Enabled = False
         self.Logging = logging
         self.LogFile = sys.stdout if log_file is None else log_file
-        self.Connections = TaskQueue(max_connections, capacity = max_queued)
         self.RemovePrefix = remove_prefix
+        self.Metrics = resolve_registry(metrics)
+        # worker threads: min_workers are always running, more are added up to max_connections when connections
+        # wait in the queue, and exit after worker_idle_timeout seconds without work
+        self.Connections = WorkerPool(min_workers, max_connections, capacity = max_queued, 
+                idle_timeout = worker_idle_timeout, metrics = self.Metrics)
+        self.MaxBodySize = max_body_size            # bytes, None - unlimited
+        # static: {"/prefix": "/directory"}, GET and HEAD requests under the prefixes are served by the server
+        self.StaticFiles = StaticFiles(static, static_max_age) if static else None
+        self.RateLimiter = rate_limit               # RateLimit.RateLimiter
+        # timeouts, seconds or None:
+        #   header_timeout:     from the start of the connection processing until the request headers are received
+        #   body_timeout:       from the start of the application call until the request body is received
+        #                       or the application returns, if the request has a body
+        #   idle_timeout:       without any progress receiving the request or sending the response,
+        #                       or while the application waits for the request body
+        #   request_timeout:    total, from the start of the connection processing
+        self.HeaderTimeout = header_timeout
+        self.BodyTimeout = body_timeout
+        self.IdleTimeout = idle_timeout
+        self.RequestTimeout = request_timeout
+        self.TimeoutCounts = {"header": 0, "body": 0, "idle": 0, "request": 0}
+        self.TimeoutLock = Lock()
+        self.Timers = None
+        if any(t is not None for t in (header_timeout, body_timeout, idle_timeout, request_timeout)):
+            self.Timers = TimerWheel()
+        # listen_fd: file descriptor of an already listening socket, by default taken from WEBPIE_LISTEN_FD
+        # environment variable set by handoff()
+        self.ListenFD = listen_fd
+        self.Backlog = backlog
+        self.Sock = None
+        self.Stopping = False
+        self.Stopped = Event()              # set when stop() is complete
+        self.ActiveLock = Lock()
+        self.Active = set()                 # accepted connections not closed yet
         if enabled:
             self.enableServer()
         
@@ -388,6 +1052,12 @@ class HTTPServer(PyThread):
     def wsgi_app(self, env, start_response):
         return self.WSGIApp(env, start_response)
         
+    def acceptIncomingTransfer(self, method, uri, headers):
+        # called before "100 Continue" is sent, headers is HTTPHeaders
+        # returns True to accept the request body, False to reject it with 417, or the status line to reject it with
+        accept = getattr(self.WSGIApp, "acceptIncomingTransfer", None)
+        return True if accept is None else accept(method, uri, headers)
+        
     @synchronized
     def enableServer(self, backlog = 5):
         self.Enabled = True
@@ -397,87 +1067,248 @@ class HTTPServer(PyThread):
         self.Enabled = False
 
     def connectionClosed(self, conn):
-        pass
+        with self.ActiveLock:
+            self.Active.discard(conn)
+        
+    def timeoutOccurred(self, conn, phase):
+        with self.TimeoutLock:
+            self.TimeoutCounts[phase] += 1
+        if self.Metrics is not None:
+            self.Metrics.inc("webpie_server_timeouts_total", 1, (("phase", phase),))
             
     @synchronized
     def connectionCount(self):
         return len(self.Connections)    
+        
+    def workerStats(self):
+        return self.Connections.stats()
+        
+    def activeCount(self):
+        with self.ActiveLock:
+            return len(self.Active)
             
+    #
+    # Graceful shutdown and restart
+    #
+    #   server.stop(timeout)        - stop accepting connections, wait for the accepted ones to complete, 
+    #                                 close those still open after the timeout
+    #   server.restart(timeout)     - start a new server process which inherits the listening socket, then stop(timeout).
+    #                                 Connections are accepted by one of the processes at any time, none is refused
+    #
+    # See also Reload.py
+    #
+    
+    ListenFDVariable = "WEBPIE_LISTEN_FD"
+    AcceptPollInterval = 0.5
+    
+    def listeningSocket(self):
+        fd = self.ListenFD
+        if fd is None:
+            fd = os.environ.pop(self.ListenFDVariable, None)        # inherited from the previous server process
+        if fd is not None:
+            sock = socket(fileno = int(fd))
+        else:
+            sock = socket(AF_INET, SOCK_STREAM)
+            sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            sock.bind(('', self.Port))
+            sock.listen(self.Backlog)
+        self.Port = sock.getsockname()[1]
+        sock.setblocking(False)         # the socket may be shared with another process during restart
+        return sock
+        
+    def stop(self, timeout = 30.0):
+        # returns the number of connections closed because of the timeout
+        self.Stopping = True
+        if self.is_alive() and current_thread() is not self:
+            self.join()
+        if self.Sock is not None:
+            self.Sock.close()           # a process it was handed off to keeps its own copy
+        deadline = None if timeout is None else time.time() + timeout
+        while self.activeCount() and (deadline is None or time.time() < deadline):
+            time.sleep(0.05)
+        with self.ActiveLock:
+            remaining = list(self.Active)
+        for conn in remaining:
+            conn.abort()
+        self.Connections.stop()
+        if self.Timers is not None:
+            self.Timers.stop()
+        shutdown = getattr(self.WSGIApp, "shutdown", None)
+        if shutdown is not None:
+            shutdown()                  # e.g. WPApp process pool
+        self.Stopped.set()
+        return len(remaining)
+        
+    def handoff(self, argv = None):
+        # starts new server process with the listening socket inherited, returns subprocess.Popen object
+        # argv: command to run, default - the command line of this process
+        import subprocess
+        fd = self.Sock.fileno()
+        os.set_inheritable(fd, True)
+        env = os.environ.copy()
+        env[self.ListenFDVariable] = str(fd)
+        return subprocess.Popen(argv or [sys.executable] + sys.argv, env=env, pass_fds=(fd,))
+        
+    def restart(self, timeout = 30.0, argv = None, startup_wait = 1.0):
+        # returns the new process, or None if it exited within startup_wait seconds. In this case, 
+        # this server continues to run
+        process = self.handoff(argv)
+        time.sleep(startup_wait)
+        if process.poll() is not None:
+            self.log_error(("-",), "Restart failed: new server process exited with status %s" % (process.returncode,))
+            return None
+        self.stop(timeout)
+        return process
+
     def run(self):
-        self.Sock = socket(AF_INET, SOCK_STREAM)
-        self.Sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.Sock.bind(('', self.Port))
-        self.Sock.listen(10)
-        while True:
-            csock, caddr = self.Sock.accept()
+        self.Sock = self.listeningSocket()
+        if self.Timers is not None:
+            self.Timers.start()
+        while not self.Stopping:
+            if not self.Enabled:
+                time.sleep(self.AcceptPollInterval)
+                continue
+            if not select.select([self.Sock], [], [], self.AcceptPollInterval)[0]:
+                continue
+            try:
+                csock, caddr = self.Sock.accept()
+            except (BlockingIOError, InterruptedError):
+                continue            # accepted by another process sharing the socket
+            csock.setblocking(True)
             conn = self.createConnection(csock, caddr)
             if conn is not None:
+                with self.ActiveLock:
+                    self.Active.add(conn)
+                if self.Metrics is not None:
+                    conn.QueuedAt = time.time()
+                    self.Metrics.inc("webpie_server_connections_total")
+                    self.Metrics.add("webpie_server_connections_open", 1)
                 self.Connections << conn
 
     # overridable
     def createConnection(self, csock, caddr):
         return HTTPConnection(self, csock, caddr)
 
-                
-    def isStaticURI(self, uri):
-        return False
-        return self.StaticURI is not None and uri.startswith(self.StaticURI + "/")
-        
-    def processStaticRequest(self, env, path, start_response):
-        #print ("processStaticRequest({})".format(path))
-        assert path.startswith(self.StaticURI + "/")
-        path = path[len(self.StaticURI)+1:]
-        while ".." in path:
-            path = path.replace("..",".")       # can not jump up
-        path = os.path.join(self.StaticLocation, path)
-        #print ("path=", path)
-        try:
-            st_mode = os.stat(path).st_mode
-            if not stat.S_ISREG(st_mode):
-                #print "not a regular file"
-                return Response("Prohibited", status=403)
-        except:
-            return Response("Not found", status=404)
-            
-        ext = path.rsplit('.',1)[-1]
-        mime_type = self.MIME_TYPES_BASE.get(ext, "text/html")
 
-        def read_iter(f):
+class HTTPSConnection(HTTPConnection):
+
+    # The TLS handshake is done by the connection worker, so a slow or malicious client 
+    # does not stall the accept loop
+    
+    UseSendfile = False             # data has to go through the TLS layer
+    
+    EnvironTemplate = HTTPConnection.EnvironTemplate.copy()
+    EnvironTemplate.update({
+        "wsgi.url_scheme":      "https",
+        "HTTPS":                "on"
+    })
+
+    def __init__(self, server, tls_socket, caddr, handshake_timeout):
+        HTTPConnection.__init__(self, server, tls_socket, caddr)
+        self.HandshakeTimeout = handshake_timeout
+        self.ALPNProtocol = None
+        self.TLSVersion = None
+
+    def handshake(self):
+        # non-blocking handshake with a deadline, returns True on success
+        from ssl import SSLWantReadError, SSLWantWriteError, SSLError
+        sock = self.CSock
+        t0 = time.time()
+        deadline = t0 + self.HandshakeTimeout
+        error = None
+        try:
+            sock.setblocking(False)
             while True:
-                data = f.read(100000)
-                if not data:    break
-                yield data
-            
-        return Response(app_iter = read_iter(open(path, "rb")),
-            content_type = mime_type)
+                try:
+                    sock.do_handshake()
+                    break
+                except SSLWantReadError:
+                    rlist, wlist = [sock], []
+                except SSLWantWriteError:
+                    rlist, wlist = [], [sock]
+                timeout = deadline - time.time()
+                if timeout <= 0 or not any(select.select(rlist, wlist, [], timeout)):
+                    error = "timeout"
+                    break
+            sock.setblocking(True)
+        except (SSLError, OSError) as e:
+            error = getattr(e, "reason", None) or e.__class__.__name__
+            self.Server.log_error(self.CAddr, "TLS handshake failed: %s" % (e,))
             
+        metrics = self.Server.Metrics
+        if error is not None:
+            if metrics is not None:
+                metrics.inc("webpie_server_tls_handshake_failures_total", 1, (("reason", str(error)),))
+            return False
+        self.ALPNProtocol = sock.selected_alpn_protocol()
+        self.TLSVersion = sock.version()
+        if metrics is not None:
+            metrics.observe("webpie_server_tls_handshake_seconds", time.time() - t0)
+            if sock.session_reused:
+                metrics.inc("webpie_server_tls_sessions_resumed_total")
+        return True
+        
+    def begin(self):
+        return self.handshake()
+
 class HTTPSServer(HTTPServer):
 
-    def __init__(self, port, app, certfile, keyfile, password=None, **args):
+    # session_tickets:  enable TLS session tickets for session resumption, OpenSSL server-side session cache
+    #                   is used for session id based resumption in any case
+    # num_tickets:      number of TLS 1.3 session tickets sent after the handshake, None - OpenSSL default
+    # alpn_protocols:   protocols offered in ALPN negotiation, the server speaks HTTP/1.1 only
+    # handshake_timeout: seconds
+
+    def __init__(self, port, app, certfile, keyfile, password=None, 
+                session_tickets = True, num_tickets = None, alpn_protocols = ("http/1.1",), 
+                handshake_timeout = 10.0, **args):
         HTTPServer.__init__(self, port, app, **args)
         import ssl
-        self.SSLContext = ssl.SSLContext(ssl.PROTOCOL_TLS)
+        self.SSLContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         self.SSLContext.load_cert_chain(certfile, keyfile, password=password)
         self.SSLContext.verify_mode = ssl.CERT_OPTIONAL
         self.SSLContext.load_default_certs()
+        if not session_tickets:
+            self.SSLContext.options |= ssl.OP_NO_TICKET
+        if num_tickets is not None and hasattr(self.SSLContext, "num_tickets"):
+            self.SSLContext.num_tickets = num_tickets
+        if alpn_protocols:
+            self.SSLContext.set_alpn_protocols(list(alpn_protocols))
+        self.HandshakeTimeout = handshake_timeout
+        if self.Metrics is not None:
+            self.Metrics.describe("webpie_server_tls_handshake_seconds", "histogram", "TLS handshake duration")
+            self.Metrics.describe("webpie_server_tls_handshake_failures_total", "counter", "Failed TLS handshakes")
+            self.Metrics.describe("webpie_server_tls_sessions_resumed_total", "counter", "TLS handshakes resuming a session")
         
     def createConnection(self, csock, caddr):
+        # wraps the socket only, the handshake is done by the connection worker
         from ssl import SSLError
         try:    
-            tls_socket = self.SSLContext.wrap_socket(csock, server_side=True)
-        except SSLError as e:
+            tls_socket = self.SSLContext.wrap_socket(csock, server_side=True, do_handshake_on_connect=False)
+        except (SSLError, OSError) as e:
             self.log_error(caddr, str(e))
             csock.close()
             return None
-        else:
-            pprint.pprint(tls_socket.getpeercert())
-            return HTTPConnection(self, tls_socket, caddr)
+        return HTTPSConnection(self, tls_socket, caddr, self.HandshakeTimeout)
             
 
-def run_server(port, app, url_pattern="*"):
-    srv = HTTPServer(port, app, url_pattern=url_pattern)
+def run_server(port, app, url_pattern="*", reload=False, drain_timeout=30.0, signals=None, **args):
+    # reload=True restarts the server when source files of loaded modules change, see Reload.py
+    # signals: install SIGTERM, SIGINT and SIGHUP handlers, see Reload.py. Signal handlers can be installed
+    # only in the main thread, so by default they are installed if run_server is called from the main thread
+    from threading import main_thread
+    from .Reload import install_signal_handlers, ModuleWatcher
+    srv = HTTPServer(port, app, url_pattern=url_pattern, **args)
+    if signals is None:
+        signals = current_thread() is main_thread()
+    if signals:
+        install_signal_handlers(srv, drain_timeout)
+    if reload:
+        ModuleWatcher(lambda: srv.restart(drain_timeout)).start()
     srv.start()
     srv.join()
+    if srv.Stopping:
+        srv.Stopped.wait()          # worker threads are daemon threads, let them finish the requests
     
 
 if __name__ == '__main__':
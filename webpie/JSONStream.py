@@ -0,0 +1,85 @@
+import json
+
+from .py3 import to_bytes
+
+#
+# JSON responses
+#
+# Handler methods can return JSON values directly:
+#
+#   return {"a": 1}                         # dict
+#   return [{"a": 1}, {"b": 2}]             # list of non-string items
+#   return {"a": 1}, 201                    # with status, content type or headers, like any other body
+#   return JSONStream(generator)            # streamed as JSON array
+#   return JSONStream(generator, ndjson=True)   # streamed as newline-delimited JSON
+#
+# A list of strings or bytes is still treated as a list of body chunks. Use JSONStream
+# or wrap it into a dict to send it as JSON.
+#
+# The encoder can be replaced with a faster one:
+#
+#   set_json_encoder(orjson.dumps)          # any function object -> str or bytes
+#
+
+def _default_encoder():
+    return json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+Encoder = _default_encoder()
+
+def set_json_encoder(encoder = None):
+    # encoder: callable converting JSON-serializable object to str or bytes; None restores the default
+    global Encoder
+    Encoder = encoder or _default_encoder()
+
+def encode_json(obj):
+    return to_bytes(Encoder(obj))
+
+class JSONStream(object):
+
+    ContentType = "application/json"
+    NDJSONContentType = "application/x-ndjson"
+    ChunkSize = 64*1024
+
+    def __init__(self, items, ndjson = False, chunk_size = None):
+        self.Items = items
+        self.NDJSON = ndjson
+        self.ChunkSize = chunk_size or self.ChunkSize
+        self.content_type = self.NDJSONContentType if ndjson else self.ContentType
+
+    def __iter__(self):
+        # yields chunks of about ChunkSize bytes
+        encode = encode_json
+        chunk_size = self.ChunkSize
+        buf = bytearray()
+        if self.NDJSON:
+            for item in self.Items:
+                buf += encode(item)
+                buf += b"\n"
+                if len(buf) >= chunk_size:
+                    yield bytes(buf)
+                    buf = bytearray()
+        else:
+            buf += b"["
+            separator = b""
+            for item in self.Items:
+                buf += separator
+                buf += encode(item)
+                separator = b","
+                if len(buf) >= chunk_size:
+                    yield bytes(buf)
+                    buf = bytearray()
+            buf += b"]"
+        if buf:
+            yield bytes(buf)
+
+    def close(self):
+        if hasattr(self.Items, "close"):
+            self.Items.close()
+
+def is_json_body(body):
+    if isinstance(body, (dict, JSONStream)):
+        return True
+    if isinstance(body, list):
+        # a non-empty list of strings is the body as chunks, an empty list is JSON []
+        return not body or not all(isinstance(x, (str, bytes)) for x in body)
+    return False
@@ -0,0 +1,219 @@
+import time, threading
+from threading import RLock
+from bisect import bisect_left
+
+#
+# Metrics registry
+#
+# Counters, gauges and histograms are aggregated in per-thread buckets, so
+# recording a value never takes a lock. The buckets are merged only when
+# the metrics are collected, e.g. by the MetricsHandler, see MetricsHandler.py.
+#
+# Labels are passed as tuples of (name, value) pairs, e.g.:
+#
+#   registry.inc("webpie_app_responses_total", labels=(("route", "/hello"), ("status", "200")))
+#
+
+class _Bucket(object):
+
+    __slots__ = ("Thread", "Counters", "Histograms")
+
+    def __init__(self, thread):
+        self.Thread = thread
+        self.Counters = {}          # (name, labels) -> value
+        self.Histograms = {}        # (name, labels) -> [counts, sum, count]
+
+    def merge(self, other):
+        for key, v in list(other.Counters.items()):
+            self.Counters[key] = self.Counters.get(key, 0) + v
+        for key, (counts, s, n) in list(other.Histograms.items()):
+            h = self.Histograms.get(key)
+            if h is None:
+                self.Histograms[key] = [list(counts), s, n]
+            else:
+                hcounts = h[0]
+                for i, c in enumerate(counts):
+                    hcounts[i] += c
+                h[1] += s
+                h[2] += n
+
+class MetricsRegistry(object):
+
+    DefaultBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    CompactThreshold = 64       # compact dead thread buckets when this many new ones were created
+
+    def __init__(self, buckets = None):
+        self.Buckets = tuple(sorted(buckets or self.DefaultBuckets))
+        self.Lock = RLock()
+        self.Local = threading.local()
+        self.ThreadBuckets = []
+        self.Retired = _Bucket(None)        # totals from threads which ended
+        self.CreatedSinceCompact = 0
+        self.Descriptions = {}              # name -> (type, help)
+        self.describeStandardMetrics()
+
+    def describe(self, name, kind, help=""):
+        # kind is one of "counter", "gauge", "histogram"
+        self.Descriptions[name] = (kind, help)
+
+    def describeStandardMetrics(self):
+        self.describe("webpie_server_connections_total", "counter", "Connections accepted by the server")
+        self.describe("webpie_server_connections_open", "gauge", "Connections accepted and not closed yet")
+        self.describe("webpie_server_queue_wait_seconds", "histogram", "Time connections wait in the queue for a worker")
+        self.describe("webpie_server_requests_in_flight", "gauge", "Requests being processed by the server")
+        self.describe("webpie_server_request_duration_seconds", "histogram", "Time from request received to connection closed")
+        self.describe("webpie_server_responses_total", "counter", "Responses sent by the server")
+        self.describe("webpie_server_bytes_received_total", "counter", "Bytes received from clients")
+        self.describe("webpie_server_bytes_sent_total", "counter", "Bytes sent to clients")
+        self.describe("webpie_server_rate_limited_total", "counter", "Requests rejected by the rate limiter")
+        self.describe("webpie_server_timeouts_total", "counter", "Connections closed by timeouts per phase: header, body, idle, request")
+        self.describe("webpie_server_workers", "gauge", "Worker threads in the server pool")
+        self.describe("webpie_server_workers_busy", "gauge", "Worker threads processing connections")
+        self.describe("webpie_server_pool_adjustments_total", "counter", "Worker pool size changes by action: grow, shrink")
+        self.describe("webpie_app_requests_in_flight", "gauge", "Requests being processed by the application")
+        self.describe("webpie_app_request_duration_seconds", "histogram", "Application request processing time per route")
+        self.describe("webpie_app_responses_total", "counter", "Application responses per route and status")
+        self.describe("webpie_coalesced_requests_total", "counter", "Coalesced requests by result: leader, follower, timeout, unshared")
+        self.describe("webpie_bulkhead_requests_total", "counter", "Calls per bulkhead by result: admitted, queued, rejected, timeout")
+        self.describe("webpie_bulkhead_active", "gauge", "Calls running in the bulkhead")
+        self.describe("webpie_bulkhead_queue_wait_seconds", "histogram", "Time calls wait for a bulkhead slot")
+        self.describe("webpie_method_cache_requests_total", "counter", "Cached method calls per route and result, hit or miss")
+
+    def bucket(self):
+        try:
+            return self.Local.Bucket
+        except AttributeError:
+            pass
+        b = self.Local.Bucket = _Bucket(threading.current_thread())
+        with self.Lock:
+            self.ThreadBuckets.append(b)
+            self.CreatedSinceCompact += 1
+            if self.CreatedSinceCompact >= self.CompactThreshold:
+                self.compact()
+        return b
+
+    def compact(self):
+        # merge buckets of the threads which ended into the retired totals
+        with self.Lock:
+            alive = []
+            for b in self.ThreadBuckets:
+                if b.Thread.is_alive():
+                    alive.append(b)
+                else:
+                    self.Retired.merge(b)
+            self.ThreadBuckets = alive
+            self.CreatedSinceCompact = 0
+
+    #
+    # Recording
+    #
+
+    def inc(self, name, value=1, labels=()):
+        counters = self.bucket().Counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    add = inc           # gauges are aggregated as sums of per-thread deltas
+
+    def observe(self, name, value, labels=()):
+        histograms = self.bucket().Histograms
+        key = (name, labels)
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = [[0]*(len(self.Buckets)+1), 0.0, 0]
+        h[0][bisect_left(self.Buckets, value)] += 1
+        h[1] += value
+        h[2] += 1
+
+    def timer(self, name, labels=()):
+        return _Timer(self, name, labels)
+
+    #
+    # Collection
+    #
+
+    def collect(self):
+        with self.Lock:
+            self.compact()
+            total = _Bucket(None)
+            total.merge(self.Retired)
+            for b in self.ThreadBuckets:
+                total.merge(b)
+        return total.Counters, total.Histograms
+
+    def reset(self):
+        with self.Lock:
+            for b in self.ThreadBuckets:
+                b.Counters.clear()
+                b.Histograms.clear()
+            self.Retired = _Bucket(None)
+
+    @staticmethod
+    def formatLabels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for k, v in labels) + "}"
+
+    @staticmethod
+    def formatValue(v):
+        if isinstance(v, float):
+            if v == float("inf"):   return "+Inf"
+            return repr(v)
+        return str(v)
+
+    def exposition(self):
+        # Prometheus text exposition format, version 0.0.4
+        counters, histograms = self.collect()
+        by_name = {}
+        for (name, labels), v in counters.items():
+            by_name.setdefault(name, []).append((labels, v))
+        for (name, labels), h in histograms.items():
+            by_name.setdefault(name, []).append((labels, h))
+        lines = []
+        for name in sorted(by_name.keys()):
+            kind, help = self.Descriptions.get(name, ("untyped", ""))
+            if help:
+                lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, v in sorted(by_name[name], key=lambda x: x[0]):
+                if kind == "histogram":
+                    counts, s, n = v
+                    cumulative = 0
+                    for le, c in zip(self.Buckets + (float("inf"),), counts):
+                        cumulative += c
+                        lines.append("%s_bucket%s %d" % (name, self.formatLabels(labels, (("le", self.formatValue(float(le))),)), cumulative))
+                    lines.append("%s_sum%s %s" % (name, self.formatLabels(labels), self.formatValue(s)))
+                    lines.append("%s_count%s %d" % (name, self.formatLabels(labels), n))
+                else:
+                    lines.append("%s%s %s" % (name, self.formatLabels(labels), self.formatValue(v)))
+        return "\n".join(lines) + "\n"
+
+class _Timer(object):
+
+    def __init__(self, registry, name, labels):
+        self.Registry = registry
+        self.Name = name
+        self.Labels = labels
+        self.T0 = None
+
+    def __enter__(self):
+        self.T0 = time.time()
+        return self
+
+    def __exit__(self, *params):
+        self.Registry.observe(self.Name, time.time() - self.T0, self.Labels)
+
+GlobalRegistry = MetricsRegistry()
+
+def resolve_registry(metrics):
+    # metrics argument accepted by HTTPServer and WPApp:
+    #   None or False   - metrics disabled
+    #   True            - use the global registry
+    #   MetricsRegistry - use this registry
+    if metrics is None or metrics is False:
+        return None
+    if metrics is True:
+        return GlobalRegistry
+    return metrics
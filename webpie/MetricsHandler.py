@@ -0,0 +1,30 @@
+from .WPApp import WPHandler
+from .Metrics import GlobalRegistry
+
+#
+# Prometheus exposition of a MetricsRegistry
+#
+# In a module of its own, so that the HTTPServer, which uses Metrics, does not import WPApp and webob
+#
+
+class MetricsHandler(WPHandler):
+
+    #
+    # Usage:
+    #
+    # class TopHandler(WPHandler):
+    #   def __init__(self, request, app):
+    #       WPHandler.__init__(self, request, app)
+    #       self.metrics = MetricsHandler(request, app)
+    #
+    # GET /metrics returns the metrics in Prometheus text format
+    #
+
+    ContentType = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, request, app, registry=None):
+        WPHandler.__init__(self, request, app)
+        self.Registry = registry or getattr(app, "Metrics", None) or GlobalRegistry
+
+    def __call__(self, request, relpath, **args):
+        return self.Registry.exposition(), self.ContentType
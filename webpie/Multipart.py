@@ -0,0 +1,282 @@
+import re, tempfile, shutil
+
+from .webob.exc import HTTPBadRequest
+from .py3 import PY3, to_bytes
+
+try:
+    from urllib.parse import unquote        # Python 3
+except ImportError:
+    from urllib import unquote
+
+#
+# Streaming multipart/form-data parser
+#
+# The request body is read from wsgi.input in chunks and is never held in memory as a whole.
+#
+# Streaming, parts are iterated as they arrive:
+#
+#   for part in request.multipart():
+#       if part.filename:
+#           with open(path, "wb") as f:
+#               for chunk in part:          # part data, chunk by chunk
+#                   f.write(chunk)
+#       else:
+#           value = part.value()            # small field, read into memory
+#
+# Collected, file parts are spooled to temporary files above a size threshold:
+#
+#   form = request.multipart_form(spool_threshold=1024*1024)
+#   form.fields["name"]                     # str, or list of str for repeated fields
+#   upload = form.files["file"]             # UploadedFile, or list of them
+#   upload.filename, upload.content_type, upload.size
+#   upload.file                             # file object positioned at the beginning
+#   upload.save("/path/to/file")
+#
+
+class MultipartError(HTTPBadRequest):
+    pass
+
+_ParamRE = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+def parse_header_value(value):
+    # 'form-data; name="a"; filename="b"' -> ("form-data", {"name": "a", "filename": "b"})
+    main = value.split(";", 1)[0].strip().lower()
+    params = {}
+    for k, v in _ParamRE.findall(value):
+        k = k.lower()
+        v = v.strip()
+        if v.startswith('"') and v.endswith('"') and len(v) >= 2:
+            v = v[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        if k.endswith("*"):
+            # RFC 5987: charset'language'percent-encoded
+            k = k[:-1]
+            charset, _, rest = v.partition("'")
+            _, _, encoded = rest.partition("'")
+            try:    v = unquote(encoded, encoding = charset or "utf-8") if PY3 else unquote(encoded)
+            except LookupError:
+                v = unquote(encoded)
+        elif k in params:
+            continue            # extended parameter takes precedence
+        params[k] = v
+    return main, params
+
+def _decode(b):
+    try:    return b.decode("utf-8")
+    except UnicodeDecodeError:
+        return b.decode("latin-1")
+
+class Part(object):
+
+    def __init__(self, parser, headers):
+        self.Parser = parser
+        self.headers = headers              # lower case name -> value
+        disposition, params = parse_header_value(headers.get("content-disposition", ""))
+        self.disposition = disposition
+        self.name = params.get("name")
+        self.filename = params.get("filename")
+        self.content_type = headers.get("content-type", "text/plain" if self.filename is None else "application/octet-stream")
+        self.Data = parser.partData()
+
+    def __iter__(self):
+        # iterates over the part data chunks
+        return self.Data
+
+    def read(self, max_size = None):
+        out = []
+        size = 0
+        for chunk in self.Data:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise MultipartError("Multipart field %s is too large" % (self.name,))
+            out.append(chunk)
+        return b"".join(out)
+
+    def value(self, max_size = None):
+        return _decode(self.read(max_size if max_size is not None else self.Parser.MaxFieldSize))
+
+    def drain(self):
+        for _ in self.Data:
+            pass
+
+class UploadedFile(object):
+
+    def __init__(self, name, filename, content_type, headers, file, size):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.file = file
+        self.size = size
+
+    def save(self, path, buffer_size = 64*1024):
+        self.file.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(self.file, f, buffer_size)
+        self.file.seek(0)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return "<UploadedFile %s %s %s %d bytes>" % (self.name, self.filename, self.content_type, self.size)
+
+class MultipartForm(object):
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+    @staticmethod
+    def _add(d, name, value):
+        if name in d:
+            old = d[name]
+            if type(old) != type([]):
+                old = d[name] = [old]
+            old.append(value)
+        else:
+            d[name] = value
+
+    def close(self):
+        for f in self.files.values():
+            for u in (f if isinstance(f, list) else [f]):
+                u.close()
+
+class MultipartParser(object):
+
+    ChunkSize = 64*1024
+    MaxHeaderSize = 16*1024
+    MaxFieldSize = 1024*1024
+    SpoolThreshold = 1024*1024
+
+    def __init__(self, stream, boundary, content_length = None, chunk_size = None):
+        if not boundary or len(boundary) > 200:
+            raise MultipartError("Invalid multipart boundary")
+        self.Stream = stream
+        self.Remaining = content_length
+        self.ChunkSize = chunk_size or self.ChunkSize
+        self.Delimiter = b"\r\n--" + to_bytes(boundary)
+        self.Buffer = bytearray(b"\r\n")        # so that the first boundary looks like any other delimiter
+        self.EOF = False
+        self.Done = False
+        self.CurrentPart = None
+
+    @staticmethod
+    def fromEnviron(environ, **args):
+        content_type, params = parse_header_value(environ.get("CONTENT_TYPE", ""))
+        if content_type != "multipart/form-data":
+            raise MultipartError("Request content type is not multipart/form-data")
+        content_length = environ.get("CONTENT_LENGTH")
+        try:    content_length = int(content_length) if content_length not in (None, "") else None
+        except ValueError:
+            raise MultipartError("Invalid Content-Length")
+        return MultipartParser(environ["wsgi.input"], params.get("boundary"), content_length, **args)
+
+    def fill(self):
+        # reads next chunk into the buffer, returns False on EOF
+        if self.EOF:
+            return False
+        n = self.ChunkSize
+        if self.Remaining is not None:
+            n = min(n, self.Remaining)
+        data = self.Stream.read(n) if n > 0 else b""
+        if not data:
+            self.EOF = True
+            return False
+        if self.Remaining is not None:
+            self.Remaining -= len(data)
+        self.Buffer += data
+        return True
+
+    def findDelimiter(self):
+        # skips data until the next delimiter, returns False if not found
+        while True:
+            i = self.Buffer.find(self.Delimiter)
+            if i >= 0:
+                del self.Buffer[:i + len(self.Delimiter)]
+                return True
+            keep = len(self.Delimiter) - 1
+            if len(self.Buffer) > keep:
+                del self.Buffer[:len(self.Buffer) - keep]
+            if not self.fill():
+                return False
+
+    def readHeaders(self):
+        # called right after a delimiter. Returns dict of headers or None at the end of the body
+        while len(self.Buffer) < 2:
+            if not self.fill():
+                raise MultipartError("Unexpected end of multipart body")
+        if self.Buffer[:2] == b"--":
+            self.Done = True
+            return None
+        while True:
+            i = self.Buffer.find(b"\r\n\r\n")
+            if i >= 0:
+                break
+            if len(self.Buffer) > self.MaxHeaderSize:
+                raise MultipartError("Multipart part headers are too large")
+            if not self.fill():
+                raise MultipartError("Unexpected end of multipart body")
+        head = bytes(self.Buffer[:i])
+        del self.Buffer[:i+4]
+        headers = {}
+        lines = head.split(b"\r\n")
+        # first line is the rest of the delimiter line, possibly with transport padding
+        for line in lines[1:]:
+            name, colon, value = _decode(line).partition(":")
+            if colon:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def partData(self):
+        # generator of the current part data chunks, ends at the next delimiter
+        delimiter = self.Delimiter
+        keep = len(delimiter) - 1
+        while True:
+            i = self.Buffer.find(delimiter)
+            if i >= 0:
+                if i > 0:
+                    yield bytes(self.Buffer[:i])
+                del self.Buffer[:i + len(delimiter)]
+                return
+            if len(self.Buffer) > keep:
+                n = len(self.Buffer) - keep
+                chunk = bytes(self.Buffer[:n])
+                del self.Buffer[:n]
+                yield chunk
+            if not self.fill():
+                raise MultipartError("Unexpected end of multipart body")
+
+    def __iter__(self):
+        if not self.findDelimiter():
+            raise MultipartError("Multipart boundary not found")
+        while True:
+            headers = self.readHeaders()
+            if headers is None:
+                break
+            part = self.CurrentPart = Part(self, headers)
+            yield part
+            part.drain()            # skip what the caller did not read
+        self.CurrentPart = None
+
+    def form(self, spool_threshold = None, max_field_size = None):
+        spool_threshold = self.SpoolThreshold if spool_threshold is None else spool_threshold
+        form = MultipartForm()
+        try:
+            for part in self:
+                if part.name is None:
+                    continue
+                if part.filename is None:
+                    form._add(form.fields, part.name, part.value(max_field_size))
+                else:
+                    f = tempfile.SpooledTemporaryFile(max_size = spool_threshold)
+                    size = 0
+                    for chunk in part:
+                        f.write(chunk)
+                        size += len(chunk)
+                    f.seek(0)
+                    form._add(form.files, part.name,
+                        UploadedFile(part.name, part.filename, part.content_type, part.headers, f, size))
+        except:
+            form.close()
+            raise
+        return form
@@ -0,0 +1,71 @@
+from threading import Lock
+
+#
+# Content negotiation for a fixed set of offers
+#
+#   class Handler(WPHandler):
+#
+#       Formats = Negotiator(["application/json", "text/html"], default = "text/html")
+#       Languages = Negotiator(["en", "de", "fr"], header = "Accept-Language", default = "en")
+#
+#       def data(self, request, relpath, **args):
+#           if self.Formats.best_match(request) == "application/json":
+#               ...
+#
+# The offers are declared once, so the result depends only on the raw header value and is cached per value:
+# in the common case negotiation is a dict lookup. On a miss, the header is parsed by webob.acceptparse
+# (which caches parsed headers too) and matched against the offers.
+#
+# Requests without the header, or with an invalid one, get the first offer. Requests accepting none of
+# the offers get the default.
+#
+
+class Negotiator(object):
+
+    Headers = {
+        # header -> (environ key, acceptparse function creating the header object)
+        "accept":           ("HTTP_ACCEPT",             "create_accept_header"),
+        "accept-charset":   ("HTTP_ACCEPT_CHARSET",     "create_accept_charset_header"),
+        "accept-encoding":  ("HTTP_ACCEPT_ENCODING",    "create_accept_encoding_header"),
+        "accept-language":  ("HTTP_ACCEPT_LANGUAGE",    "create_accept_language_header")
+    }
+    MaxCached = 1000
+
+    def __init__(self, offers, default = None, header = "Accept"):
+        header = header.lower()
+        if header not in self.Headers:
+            raise ValueError("Unsupported header for content negotiation: %s" % (header,))
+        self.Header = header
+        self.EnvironKey, self.CreateName = self.Headers[header]
+        self.Offers = list(offers)
+        self.Default = default
+        self.Lock = Lock()
+        self.Matches = {}           # header value -> best offer or default
+        self.Create = None
+
+    def match(self, header_value):
+        # uncached
+        if self.Create is None:
+            from .webob import acceptparse
+            self.Create = getattr(acceptparse, self.CreateName)
+        parsed = self.Create(header_value)
+        if self.Header == "accept-language":
+            offers = parsed.basic_filtering(self.Offers)       # RFC 4647 basic filtering, sorted by quality
+        else:
+            offers = parsed.acceptable_offers(self.Offers)
+        return offers[0][0] if offers else self.Default
+
+    def best_match(self, request):
+        # request: Request or WSGI environ
+        environ = getattr(request, "environ", request)
+        header_value = environ.get(self.EnvironKey)
+        try:
+            return self.Matches[header_value]
+        except KeyError:
+            pass
+        match = self.match(header_value)
+        with self.Lock:
+            if len(self.Matches) >= self.MaxCached:
+                self.Matches.clear()            # unusually many distinct values, start over
+            self.Matches[header_value] = match
+        return match
@@ -0,0 +1,118 @@
+import sys, io, importlib
+
+#
+# Running CPU bound handler methods in worker processes
+#
+#   class Handler(WPHandler):
+#
+#       @webmethod(offload="process")
+#       def thumbnail(self, request, relpath, size="100", **args):
+#           return render_thumbnail(request.body, int(size)), "image/png"
+#
+#   app = WPApp(Handler, process_pool = 4,         # number of worker processes, or a ProcessPoolExecutor
+#               offload_timeout = 60.0)             # seconds or None, default 300
+#
+# The method runs in a process of the app's ProcessPoolExecutor, created on first use with os.cpu_count() workers
+# by default, so it does not hold the GIL of the server process. The server worker thread waits for the result
+# up to offload_timeout seconds, then the request is answered with "504 Gateway Timeout". The method keeps running
+# in the worker process, its result is discarded. When the pool is shut down or broken, e.g. a worker process
+# was killed, requests are answered with "503 Service Unavailable".
+#
+# WPApp.shutdown() shuts the pool down. HTTPServer.stop() calls it after the requests in progress are finished.
+#
+# In the worker process:
+#   - self is an instance of the handler class created without calling __init__: class attributes and methods are
+#     available, the handler tree and the app are not
+#   - request is a Request built from the request body and the picklable part of the WSGI environ:
+#     CGI variables, HTTP_* headers and webpie.route
+#   - relpath and query arguments are passed as usual
+#
+# The return value is converted with makeResponse() and buffered in the worker process, so generators are
+# consumed there. The method is found by its module and qualified name, so it must be defined in a module
+# the worker process can import, or in the main script when the pool uses the "fork" start method (default on Linux).
+#
+
+EnvironKeys = frozenset([
+    "REQUEST_METHOD", "SCRIPT_NAME", "PATH_INFO", "QUERY_STRING", "CONTENT_TYPE", "CONTENT_LENGTH",
+    "SERVER_NAME", "SERVER_PORT", "SERVER_PROTOCOL", "REMOTE_ADDR", "REMOTE_PORT", "HTTPS",
+    "wsgi.url_scheme", "webpie.route", "WebPie.original_path"
+])
+
+_Methods = {}           # (module, qualname) -> undecorated method
+
+def register(method):
+    key = (method.__module__, method.__qualname__)
+    _Methods[key] = method
+    return key
+
+def portable_environ(environ):
+    return dict((k, v) for k, v in environ.items()
+            if isinstance(v, str) and (k in EnvironKeys or k.startswith("HTTP_")))
+
+def resolve(key):
+    module_name, qualname = key
+    method = _Methods.get(key)
+    if method is None:
+        if module_name == "__main__" and "__mp_main__" in sys.modules:
+            module_name = "__mp_main__"         # main script re-imported by "spawn" or "forkserver"
+        else:
+            importlib.import_module(module_name)
+        method = _Methods[(module_name, qualname)]
+    owner = sys.modules[module_name]
+    for name in qualname.split(".")[:-1]:
+        owner = getattr(owner, name)
+    handler = owner.__new__(owner) if isinstance(owner, type) else None
+    return handler, method
+
+def buffer_response(response, environ):
+    # returns (status, headerlist, body)
+    out = []
+    def start_response(status, headers, exc_info = None):
+        out[:] = [status, headers]
+    app_iter = response(environ, start_response)
+    try:
+        body = b"".join(app_iter)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    status, headers = out
+    return status, tuple((h, v) for h, v in headers if h.lower() != "content-length"), body
+
+def run_offloaded(key, environ, body, relpath, params, args):
+    # runs in the worker process
+    from .WPApp import Request, makeResponse, HTTPResponseException
+    from .webob.exc import HTTPException
+    environ = dict(environ)
+    environ["wsgi.input"] = io.BytesIO(body)
+    environ["wsgi.errors"] = sys.stderr
+    handler, method = resolve(key)
+    try:
+        result = method(handler, Request(environ), relpath, *params, **args)
+    except HTTPException as e:
+        result = e
+    except HTTPResponseException as e:
+        result = e.value
+    return buffer_response(makeResponse(result), environ)
+
+def offload(executor, key, request, relpath, params, args, timeout = None):
+    # runs in the server process, returns FastResponse, or 503 or 504 response
+    from concurrent.futures import TimeoutError, CancelledError
+    from concurrent.futures.process import BrokenProcessPool
+    from .WPApp import FastResponse
+    from .webob.exc import HTTPServiceUnavailable, HTTPGatewayTimeout
+    try:
+        future = executor.submit(run_offloaded, key, portable_environ(request.environ), request.body,
+                    relpath, params, args)
+    except RuntimeError:
+        # shut down or broken (BrokenProcessPool is a RuntimeError)
+        return HTTPServiceUnavailable("Worker processes are not available")
+    try:
+        status, headerlist, body = future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        return HTTPGatewayTimeout("Worker process did not respond in %s seconds" % (timeout,))
+    except (CancelledError, BrokenProcessPool):
+        return HTTPServiceUnavailable("Worker processes are not available")
+    response = FastResponse(body, status)
+    response.headerlist = list(headerlist)
+    return response
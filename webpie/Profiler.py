@@ -0,0 +1,221 @@
+import cProfile, pstats, marshal, random, time, hmac, hashlib
+from threading import RLock, Lock
+
+from .WPApp import WPHandler
+from .py3 import PY3, to_bytes
+from .headers import environ_key
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+#
+# Per-request profiler
+#
+# Usage:
+#
+#   profiler = RequestProfiler(sample_rate=0.01, secret="my secret")
+#   application = WPApp(TopHandler, profiler=profiler)
+#
+# A request is profiled if it is randomly selected according to the sample rate,
+# or if it carries the X-WebPie-Profile header signed with the secret, see sign().
+# Only one request is profiled at a time. The results are aggregated per route,
+# the resolved handler method path, and can be viewed via the ProfilerHandler.
+#
+
+class _ProfiledIterable(object):
+
+    # Profiles the iteration over the response body of a streaming response
+
+    def __init__(self, profiler, profile, environ, iterable):
+        self.Profiler = profiler
+        self.Profile = profile
+        self.Environ = environ
+        self.Iterable = iterable
+        self.Iterator = iter(iterable)
+        self.Done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.Done:
+            raise StopIteration()
+        self.Profile.enable()
+        try:
+            return next(self.Iterator)
+        except:
+            self.Profile.disable()
+            self.finish()
+            raise
+        finally:
+            self.Profile.disable()
+
+    next = __next__         # Python 2
+
+    def finish(self):
+        if not self.Done:
+            self.Done = True
+            self.Profiler.record(self.Environ, self.Profile)
+
+    def close(self):
+        try:
+            if hasattr(self.Iterable, "close"):
+                self.Iterable.close()
+        finally:
+            self.finish()
+
+    def __del__(self):
+        self.finish()
+
+class RequestProfiler(object):
+
+    Header = "X-WebPie-Profile"
+
+    def __init__(self, sample_rate = 0.0, secret = None, header = None):
+        self.SampleRate = sample_rate
+        self.Secret = to_bytes(secret) if secret is not None else None
+        if header is not None:
+            self.Header = header
+        self.EnvironKey = environ_key(self.Header)
+        self.Busy = Lock()          # only one request is profiled at a time
+        self.Lock = RLock()
+        self.Stats = {}             # route -> [pstats.Stats, nrequests]
+
+    def signature(self, path, expires):
+        return hmac.new(self.Secret, to_bytes("%d:%s" % (expires, path)), hashlib.sha256).hexdigest()
+
+    def sign(self, path, ttl = 300):
+        # returns the header value which will enable profiling of requests for the path during ttl seconds
+        assert self.Secret is not None, "Profiler secret is not set"
+        expires = int(time.time() + ttl)
+        return "%d:%s" % (expires, self.signature(path, expires))
+
+    def signedRequest(self, environ):
+        if self.Secret is None:
+            return False
+        value = environ.get(self.EnvironKey)
+        if not value:
+            return False
+        try:
+            expires, signature = value.split(":", 1)
+            expires = int(expires)
+        except ValueError:
+            return False
+        if expires < time.time():
+            return False
+        path = environ.get("WebPie.original_path", environ.get("PATH_INFO", ""))
+        return hmac.compare_digest(signature, self.signature(path, expires))
+
+    def sample(self, environ):
+        return self.signedRequest(environ) or \
+            (self.SampleRate > 0.0 and random.random() < self.SampleRate)
+
+    def profile(self, app, environ, start_response):
+        if not self.Busy.acquire(False):
+            return app(environ, start_response)        # another request is being profiled
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            out = app(environ, start_response)
+        except:
+            profile.disable()
+            self.record(environ, profile)
+            raise
+        profile.disable()
+        if isinstance(out, (list, tuple)):
+            self.record(environ, profile)
+            return out
+        return _ProfiledIterable(self, profile, environ, out)
+
+    def record(self, environ, profile):
+        try:
+            route = environ.get("webpie.route") or environ.get("PATH_INFO", "")
+            stats = pstats.Stats(profile)
+            with self.Lock:
+                entry = self.Stats.get(route)
+                if entry is None:
+                    self.Stats[route] = [stats, 1]
+                else:
+                    entry[0].add(stats)
+                    entry[1] += 1
+        finally:
+            self.Busy.release()
+
+    def routes(self):
+        with self.Lock:
+            return sorted((route, n) for route, (stats, n) in self.Stats.items())
+
+    def report(self, route, sort = "cumulative", limit = 50):
+        with self.Lock:
+            entry = self.Stats.get(route)
+            if entry is None:
+                return None
+            stream = StringIO()
+            stats, n = entry
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+        return "Route: %s\nRequests profiled: %d\n%s" % (route, n, stream.getvalue())
+
+    def dump(self, route):
+        # returns the stats in the binary format of pstats.Stats.dump_stats()
+        with self.Lock:
+            entry = self.Stats.get(route)
+            if entry is None:
+                return None
+            return marshal.dumps(entry[0].stats)
+
+    def reset(self, route = None):
+        with self.Lock:
+            if route is None:
+                self.Stats = {}
+            else:
+                self.Stats.pop(route, None)
+
+class ProfilerHandler(WPHandler):
+
+    #
+    # Usage:
+    #
+    # class TopHandler(WPHandler):
+    #   def __init__(self, request, app):
+    #       WPHandler.__init__(self, request, app)
+    #       self.profiler = ProfilerHandler(request, app)
+    #
+    # GET /profiler                         - list of profiled routes
+    # GET /profiler/stats/<route>?sort=tottime&limit=20
+    # GET /profiler/dump/<route>            - pstats file, e.g. for snakeviz
+    # GET /profiler/reset[/<route>]
+    #
+
+    def __init__(self, request, app, profiler = None):
+        WPHandler.__init__(self, request, app)
+        self.Profiler = profiler or app.Profiler
+
+    def __call__(self, request, relpath, **args):
+        lines = ["%6d %s" % (n, route) for route, n in self.Profiler.routes()]
+        return "\n".join(lines) + "\n", "text/plain"
+
+    def stats(self, request, relpath, sort = "cumulative", limit = "50", **args):
+        try:    limit = int(limit)
+        except (ValueError, TypeError):
+            return "Invalid limit: %s\n" % (limit,), 400, "text/plain"
+        if limit < 0:
+            return "Invalid limit: %s\n" % (limit,), 400, "text/plain"
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            return "Invalid sort key: %s\n" % (sort,), 400, "text/plain"
+        report = self.Profiler.report("/" + relpath, sort, limit)
+        if report is None:
+            return "Route not found\n", 404, "text/plain"
+        return report, "text/plain"
+
+    def dump(self, request, relpath, **args):
+        data = self.Profiler.dump("/" + relpath)
+        if data is None:
+            return "Route not found\n", 404, "text/plain"
+        return data, "application/octet-stream"
+
+    def reset(self, request, relpath, **args):
+        self.Profiler.reset(("/" + relpath) if relpath else None)
+        return "OK\n", "text/plain"
@@ -0,0 +1,90 @@
+import time
+from threading import Lock
+
+#
+# Per-client token bucket rate limiting, enforced by HTTPServer before the application is called
+#
+#   limiter = RateLimiter(rate = 10.0, burst = 50)                     # by client address
+#   limiter = RateLimiter(rate = 10.0, burst = 50, key_header = "X-Forwarded-For")   # behind a proxy
+#   server = HTTPServer(8080, app, rate_limit = limiter)
+#
+# Behind trusted_proxies proxies (default 1), each of them appends the address it received the request from to
+# X-Forwarded-For, so the client address is the trusted_proxies-th value from the right. The values to the left
+# of it are sent by the client and are not used: otherwise a client could get a new bucket with every request.
+# Without key_header, or with trusted_proxies = 0, the client is identified by the address of the connection.
+#
+# Each client gets a bucket of "burst" tokens, refilled at "rate" tokens per second. A request takes one token.
+# Requests from a client with an empty bucket are answered with "429 Too Many Requests" and Retry-After.
+#
+# The table keeps one (tokens, time) pair per client. Buckets which would be full again are removed from it
+# every compact_interval seconds, or when the table reaches max_clients. If the table is still full
+# after compaction, requests from new clients are allowed without tracking.
+#
+
+class RateLimiter(object):
+
+    def __init__(self, rate, burst = None, key_header = None, trusted_proxies = 1, max_clients = 100000, 
+                compact_interval = 60.0):
+        self.Rate = float(rate)                             # tokens per second
+        self.Burst = float(burst if burst is not None else max(1.0, rate))
+        self.KeyHeader = key_header.lower() if key_header and trusted_proxies > 0 else None
+        self.TrustedProxies = trusted_proxies
+        self.MaxClients = max_clients
+        self.CompactInterval = compact_interval
+        self.RefillTime = self.Burst/self.Rate              # time for an empty bucket to become full
+        self.Lock = Lock()
+        self.Buckets = {}                                   # key -> (tokens, time)
+        self.LastCompact = time.time()
+        self.Rejected = 0
+        self.Untracked = 0
+
+    def clientKey(self, caddr, headers):
+        # headers: HTTPHeaders
+        if self.KeyHeader is not None:
+            value = headers.get(self.KeyHeader)
+            if value:
+                addresses = value.split(",")
+                # appended by the outermost trusted proxy, or the first one if the header has fewer values
+                address = addresses[-min(self.TrustedProxies, len(addresses))].strip()
+                if address:
+                    return address
+        return caddr[0]
+
+    def compact(self, now):
+        refill_time = self.RefillTime
+        buckets = self.Buckets
+        for key in [k for k, (_, t) in buckets.items() if now - t >= refill_time]:
+            del buckets[key]
+        self.LastCompact = now
+
+    def allow(self, key, now = None):
+        # returns (True, 0) or (False, seconds until the next token is available)
+        now = time.time() if now is None else now
+        with self.Lock:
+            if now - self.LastCompact >= self.CompactInterval:
+                self.compact(now)
+            bucket = self.Buckets.get(key)
+            if bucket is None:
+                if len(self.Buckets) >= self.MaxClients:
+                    self.compact(now)
+                    if len(self.Buckets) >= self.MaxClients:
+                        self.Untracked += 1
+                        return True, 0
+                tokens = self.Burst
+            else:
+                tokens, t = bucket
+                tokens = min(self.Burst, tokens + (now - t)*self.Rate)
+            if tokens >= 1.0:
+                self.Buckets[key] = (tokens - 1.0, now)
+                return True, 0
+            self.Buckets[key] = (tokens, now)
+            self.Rejected += 1
+            return False, (1.0 - tokens)/self.Rate
+
+    def stats(self):
+        with self.Lock:
+            return {
+                "clients":      len(self.Buckets),
+                "rejected":     self.Rejected,
+                "untracked":    self.Untracked
+            }
@@ -0,0 +1,84 @@
+import os, sys, time, signal
+from threading import Thread
+from pythreader import PyThread
+
+#
+# Server process lifecycle
+#
+# Signals, installed by run_server() and WPApp.run_server() when called from the main thread:
+#
+#   SIGTERM, SIGINT     - graceful shutdown: stop accepting connections, finish requests in progress
+#   SIGHUP              - zero-downtime restart: start a new process with the same command line, which
+#                         inherits the listening socket and re-imports the application, then shut down gracefully
+#
+# Development mode, run_server(..., reload=True): ModuleWatcher restarts the server the same way when
+# a source file of a loaded module changes.
+#
+
+def install_signal_handlers(server, drain_timeout = 30.0):
+    # must be called from the main thread
+    # the handlers run server.stop() and server.restart() in separate threads to return quickly
+    def run(function, *params):
+        t = Thread(target=function, args=params)
+        t.daemon = True
+        t.start()
+
+    def stop(signum, frame):
+        run(server.stop, drain_timeout)
+
+    def restart(signum, frame):
+        run(server.restart, drain_timeout)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, restart)
+
+class ModuleWatcher(PyThread):
+
+    # Calls callback once, when a source file of a loaded module under one of the directories changes.
+    # Default directories: the current working directory and the directory of the main script.
+
+    def __init__(self, callback, directories = None, interval = 1.0):
+        PyThread.__init__(self)
+        self.daemon = True
+        self.Callback = callback
+        if directories is None:
+            directories = [os.getcwd(), os.path.dirname(os.path.abspath(sys.argv[0]))]
+        self.Directories = [os.path.join(os.path.realpath(d), "") for d in directories]
+        self.Interval = interval
+
+    def files(self):
+        out = set()
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if path:
+                if path.endswith(".pyc"):
+                    path = path[:-1]
+                path = os.path.realpath(path)
+                if any(path.startswith(d) for d in self.Directories) and "site-packages" not in path:
+                    out.add(path)
+        return out
+
+    def mtimes(self):
+        mtimes = {}
+        for path in self.files():
+            try:    mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def changed(self, old, new):
+        return [path for path, mtime in new.items() if path in old and old[path] != mtime]
+
+    def run(self):
+        mtimes = self.mtimes()
+        while True:
+            time.sleep(self.Interval)
+            new = self.mtimes()
+            changed = self.changed(mtimes, new)
+            mtimes.update(new)
+            if changed:
+                sys.stderr.write("ModuleWatcher: %s changed, restarting\n" % (", ".join(changed),))
+                if self.Callback() is not None:
+                    break           # restarted, this process is going away
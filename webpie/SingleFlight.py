@@ -0,0 +1,156 @@
+import time
+from threading import RLock, Event
+from .headers import environ_key
+
+#
+# Coalescing of identical concurrent requests
+#
+# Handlers opt in by listing the methods to coalesce, similarly to _Methods:
+#
+#   class Handler(WPHandler):
+#
+#       _Coalesce = ["report"]          # or "*" for all methods of the handler
+#
+#       def report(self, request, relpath, **args):
+#           return self.render_to_response("report.html", ...)
+#
+#   app = WPApp(Handler, single_flight = SingleFlight(timeout = 30.0, max_bytes = 1024*1024))
+#
+# When several GET or HEAD requests for the same route, relpath, query arguments and values of the
+# VaryHeaders request headers run concurrently, only the first one calls the method. The others wait for it
+# and receive a copy of its response, buffered as bytes.
+#
+# A waiting request calls the method itself if:
+#   - the first request does not finish within the timeout,
+#   - the first request raised an exception,
+#   - the response body is larger than max_bytes, or the response could not be cached by @cached: it is not
+#     "200 OK", sets a cookie or has Cache-Control private or no-store.
+#
+# Cookie and Authorization are in VaryHeaders, so responses are shared only between requests with the same
+# credentials.
+#
+
+class _Flight(object):
+
+    __slots__ = ("Done", "Response")
+
+    def __init__(self):
+        self.Done = Event()
+        self.Response = None            # (status, headerlist, body) if it can be shared
+
+class SingleFlight(object):
+
+    VaryHeaders = ("HTTP_COOKIE", "HTTP_AUTHORIZATION")
+
+    def __init__(self, timeout = 30.0, max_bytes = 1024*1024, vary_headers = None, metrics = None):
+        self.Timeout = timeout
+        self.MaxBytes = max_bytes
+        if vary_headers is not None:
+            self.VaryHeaders = tuple(environ_key(h) for h in vary_headers)
+        self.Lock = RLock()
+        self.Flights = {}               # key -> _Flight
+        self.Metrics = metrics
+        self.Counts = {"leader": 0, "follower": 0, "timeout": 0, "unshared": 0}
+
+    def key(self, environ, relpath, args):
+        return (
+            environ.get("webpie.route"), relpath,
+            tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in args.items())),
+            tuple(environ.get(k) for k in self.VaryHeaders)
+        )
+
+    def count(self, result):
+        with self.Lock:
+            self.Counts[result] += 1
+        if self.Metrics is not None:
+            self.Metrics.inc("webpie_coalesced_requests_total", 1, (("result", result),))
+
+    def stats(self):
+        with self.Lock:
+            stats = self.Counts.copy()
+            stats["in_flight"] = len(self.Flights)
+            return stats
+
+    def buffer(self, response):
+        # returns (status, headerlist, body) or None if the response can not be shared,
+        # and the response to return to the caller, possibly with the body already consumed
+        from .Cache import MethodCache
+        if not MethodCache.cacheable(response):
+            return None, response
+        app_iter = response.app_iter
+        if isinstance(app_iter, list):
+            body = b"".join(app_iter)
+            if len(body) > self.MaxBytes:
+                return None, response
+        else:
+            # consume the iterator up to MaxBytes
+            chunks = []
+            size = 0
+            it = iter(app_iter)
+            for chunk in it:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.MaxBytes:
+                    response.app_iter = _Resumed(chunks, it, app_iter)
+                    return None, response
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+            body = b"".join(chunks)
+            response.app_iter = [body]
+        headerlist = tuple((h, v) for h, v in response.headerlist if h.lower() != "content-length")
+        return (response.status, headerlist, body), response
+
+    @staticmethod
+    def copy(shared):
+        from .WPApp import FastResponse
+        status, headerlist, body = shared
+        response = FastResponse(body, status)
+        response.headerlist = list(headerlist)
+        return response
+
+    def call(self, key, function):
+        # function() returns a response object, see WPApp.makeResponse
+        from .WPApp import makeResponse
+        with self.Lock:
+            flight = self.Flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.Flights[key] = _Flight()
+        if not leader:
+            if not flight.Done.wait(self.Timeout):
+                self.count("timeout")
+            elif flight.Response is None:
+                self.count("unshared")
+            else:
+                self.count("follower")
+                return self.copy(flight.Response)
+            return makeResponse(function())
+
+        self.count("leader")
+        try:
+            response = makeResponse(function())
+            flight.Response, response = self.buffer(response)
+            return response
+        finally:
+            with self.Lock:
+                del self.Flights[key]
+            flight.Done.set()
+
+class _Resumed(object):
+
+    # the part of the body consumed while buffering, followed by the rest of it
+
+    def __init__(self, chunks, rest, original):
+        self.Chunks = chunks
+        self.Rest = rest
+        self.Original = original
+
+    def __iter__(self):
+        for chunk in self.Chunks:
+            yield chunk
+        for chunk in self.Rest:
+            yield chunk
+
+    def close(self):
+        if hasattr(self.Original, "close"):
+            self.Original.close()
@@ -0,0 +1,83 @@
+import time, traceback, sys
+from threading import Lock
+from pythreader import PyThread
+
+#
+# Timer wheel
+#
+# One thread serves the timers of all connections. Timers are hashed into slots of Tick seconds,
+# so scheduling and cancelling are O(1) and the thread wakes up once per tick regardless of the number
+# of timers. Timers fire up to one tick late.
+#
+#   wheel = TimerWheel(tick = 0.5)
+#   wheel.start()
+#   handle = wheel.schedule(time.time() + 10, callback)
+#   wheel.cancel(handle)
+#
+
+class TimerWheel(PyThread):
+
+    def __init__(self, tick = 0.5):
+        PyThread.__init__(self)
+        self.daemon = True
+        self.Tick = tick
+        self.Lock = Lock()
+        self.Slots = {}                 # slot number -> {timer id: callback}
+        self.NextId = 0
+        self.LastSlot = int(time.time()/tick)
+        self.Stop = False
+
+    def schedule(self, when, callback):
+        # returns handle to be used with cancel()
+        with self.Lock:
+            slot = max(int(when/self.Tick), self.LastSlot + 1)
+            self.NextId += 1
+            timer_id = self.NextId
+            timers = self.Slots.get(slot)
+            if timers is None:
+                timers = self.Slots[slot] = {}
+            timers[timer_id] = callback
+        return (slot, timer_id)
+
+    def cancel(self, handle):
+        if handle is None:
+            return
+        slot, timer_id = handle
+        with self.Lock:
+            timers = self.Slots.get(slot)
+            if timers is not None:
+                timers.pop(timer_id, None)
+                if not timers:
+                    del self.Slots[slot]
+
+    def __len__(self):
+        with self.Lock:
+            return sum(len(timers) for timers in self.Slots.values())
+
+    def expired(self, now):
+        # removes and returns callbacks of expired timers
+        current = int(now/self.Tick)
+        callbacks = []
+        with self.Lock:
+            if current - self.LastSlot > len(self.Slots):
+                slots = [s for s in self.Slots if s <= current]        # after a long pause, e.g. suspend
+            else:
+                slots = range(self.LastSlot + 1, current + 1)
+            for slot in slots:
+                timers = self.Slots.pop(slot, None)
+                if timers:
+                    callbacks.extend(timers.values())
+            self.LastSlot = max(self.LastSlot, current)
+        return callbacks
+
+    def stop(self):
+        self.Stop = True
+
+    def run(self):
+        while not self.Stop:
+            time.sleep(self.Tick)
+            for callback in self.expired(time.time()):
+                try:
+                    callback()
+                except:
+                    sys.stderr.write("TimerWheel: exception in timer callback:\n" + traceback.format_exc())
@@ -1,11 +1,16 @@
 from .webob import Response
 from .webob import Request as webob_request
 from .webob.exc import HTTPTemporaryRedirect, HTTPException, HTTPFound, HTTPForbidden, HTTPNotFound
+from .webob.multidict import GetDict
+from .webob.headers import ResponseHeaders
+from .webob.util import status_reasons
     
-import os.path, os, stat, sys, traceback, fnmatch
+import os.path, os, stat, sys, traceback, fnmatch, time
 from threading import RLock
 
 from .py3 import PY3, PY2, to_str, to_bytes
+from .query import parse_query, pairs_to_dict, query_pairs, query_args
+from .JSONStream import JSONStream, encode_json, is_json_body
 
 try:
     from collections.abc import Iterable    # Python3
@@ -18,7 +23,7 @@ _WebMethodSignature = "__WebPie:webmethod__"
 # Decorators
 #
  
-def webmethod(permissions=None):
+def webmethod(permissions=None, pool=None, offload=None):
     #
     # Usage:
     #
@@ -32,10 +37,23 @@ def webmethod(permissions=None):
     #   def method(self, req, relpath, **args):
     #       ...
     #
+    #   @webmethod(pool="reports")             # runs in the "reports" bulkhead, see Bulkhead.py
+    #   def report(self, req, relpath, **args):
+    #       ...
+    #
+    #   @webmethod(offload="process")          # runs in a worker process, see Offload.py
+    #   def render(self, req, relpath, **args):
+    #       ...
+    #
+    if isinstance(permissions, str):
+        permissions = [permissions]
+    if offload not in (None, "process"):
+        raise ValueError("Unsupported offload mode: %r" % (offload,))
     def decorator(method):
+        if offload is not None:
+            from .Offload import register
+            offload_key = register(method)
         def decorated(handler, request, relpath, *params, **args):
-            #if isinstance(permissions, str):
-            #    permissions = [permissions]
             if permissions is not None:
                 try:    roles = handler._roles(request, relpath)
                 except:
@@ -47,7 +65,13 @@ def webmethod(permissions=None):
                         break
                 else:
                     return HTTPForbidden()
-            return method(handler, request, relpath, *params, **args)
+            if offload is not None:
+                function = lambda: handler.App.offload(offload_key, request, relpath, params, args)
+            else:
+                function = lambda: method(handler, request, relpath, *params, **args)
+            if pool is not None:
+                return handler.App.bulkhead(pool).call(function, request.environ)
+            return function()
         decorated.__doc__ = _WebMethodSignature
         return decorated
     return decorator
@@ -61,22 +85,26 @@ def app_synchronized(method):
 atomic = app_synchronized
 
 class Request(webob_request):
-    def __init__(self, *agrs, **kv):
-        webob_request.__init__(self, *agrs, **kv)
-        self.args = self.environ['QUERY_STRING']
-        self._response = Response()
+
+    _response = None        # created on first use, most requests never need it
+
+    @property
+    def args(self):
+        return self.environ['QUERY_STRING']
         
     def write(self, txt):
-        self._response.write(txt)
+        self.getResponse().write(txt)
         
     def getResponse(self):
+        if self._response is None:
+            self._response = Response()
         return self._response
         
     def set_response_content_type(self, t):
-        self._response.content_type = t
+        self.getResponse().content_type = t
         
     def get_response_content_type(self):
-        return self._response.content_type
+        return self.getResponse().content_type
         
     def del_response_content_type(self):
         pass
@@ -86,6 +114,122 @@ class Request(webob_request):
         del_response_content_type, 
         "Response content type")
 
+    def multipart(self, **args):
+        # streaming multipart/form-data parser for the request body, see Multipart.py
+        from .Multipart import MultipartParser
+        return MultipartParser.fromEnviron(self.environ, **args)
+
+    def multipart_form(self, spool_threshold = None, max_field_size = None):
+        return self.multipart().form(spool_threshold, max_field_size)
+
+    @property
+    def GET(self):
+        # same as webob Request.GET, but uses the query string parsed once per request
+        env = self.environ
+        source = env.get('QUERY_STRING', '')
+        cached = env.get('webob._parsed_query_vars')
+        if cached is not None and cached[1] == source:
+            return cached[0]
+        vars = GetDict([(k, "" if v is None else v) for k, v in query_pairs(env)], env)
+        env['webob._parsed_query_vars'] = (vars, source)
+        return vars
+
+class FastResponse(object):
+    #
+    # Minimal response object used by makeResponse() for the most common handler return values:
+    #
+    # text or bytes
+    # (text or bytes, "content_type")
+    # (text or bytes, status)
+    # (text or bytes, status, "content_type")
+    #
+    # It provides the most used attributes of webob Response. Use toWebOb() to get
+    # full webob Response.
+    #
+
+    __slots__ = ("status", "headerlist", "body")
+
+    StatusLines = {}            # status code -> status line
+    ContentTypeHeaders = {}     # content type -> ("Content-Type", content type with charset)
+    MaxCached = 100
+
+    def __init__(self, body = b"", status = 200, content_type = None):
+        self.body = body
+        self.status = self.statusLine(status) if isinstance(status, int) else status
+        self.headerlist = [self.contentTypeHeader(content_type or "text/html")]
+
+    @staticmethod
+    def statusLine(code):
+        line = FastResponse.StatusLines.get(code)
+        if line is None:
+            line = "%d %s" % (code, status_reasons.get(code, "Unknown"))
+            FastResponse.StatusLines[code] = line
+        return line
+
+    @staticmethod
+    def contentTypeHeader(content_type):
+        header = FastResponse.ContentTypeHeaders.get(content_type)
+        if header is None:
+            value = content_type
+            if "charset" not in value and (value.startswith("text/") or value.endswith("xml")):
+                value += "; charset=UTF-8"
+            header = ("Content-Type", value)
+            if len(FastResponse.ContentTypeHeaders) < FastResponse.MaxCached:
+                FastResponse.ContentTypeHeaders[content_type] = header
+        return header
+
+    def __call__(self, environ, start_response):
+        body = self.body
+        start_response(self.status, self.headerlist + [("Content-Length", str(len(body)))])
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return []
+        return [body]
+
+    def toWebOb(self):
+        return Response(body = self.body, status = self.status, headerlist = list(self.headerlist))
+
+    #
+    # webob Response compatible attributes
+    #
+
+    def get_status_code(self):
+        return int(self.status.split(None, 1)[0])
+
+    def set_status_code(self, code):
+        self.status = self.statusLine(code)
+
+    status_code = status_int = property(get_status_code, set_status_code)
+
+    @property
+    def headers(self):
+        return ResponseHeaders.view_list(self.headerlist)
+
+    def get_content_type(self):
+        value = self.headers.get("Content-Type")
+        return value.split(";", 1)[0] if value is not None else None
+
+    def set_content_type(self, content_type):
+        self.headerlist = [(h, v) for h, v in self.headerlist if h.lower() != "content-type"]
+        self.headerlist.append(self.contentTypeHeader(content_type))
+
+    content_type = property(get_content_type, set_content_type)
+
+    def get_text(self):
+        return to_str(self.body)
+
+    def set_text(self, text):
+        self.body = to_bytes(text)
+
+    text = property(get_text, set_text)
+
+    @property
+    def app_iter(self):
+        return [self.body]
+
+    @property
+    def content_length(self):
+        return len(self.body)
+
 class HTTPResponseException(Exception):
     def __init__(self, response):
         self.value = response
@@ -104,10 +248,41 @@ def makeResponse(resp):
     # (text, status, "content_type")
     # (text, status, {headers})
     #
+    # text can also be a JSON value (dict or list of non-strings) or a JSONStream
+    #
     
-    if isinstance(resp, Response):
+    if isinstance(resp, (Response, FastResponse)):
         return resp
     
+    # fast path for the most common shapes
+    if isinstance(resp, bytes):
+        return FastResponse(resp)
+    elif PY3 and isinstance(resp, str):
+        return FastResponse(to_bytes(resp))
+    elif isinstance(resp, (dict, list)) and is_json_body(resp):
+        return FastResponse(encode_json(resp), content_type = JSONStream.ContentType)
+    elif isinstance(resp, tuple) and 2 <= len(resp) <= 3:
+        body = resp[0]
+        content_type = None
+        if isinstance(body, (str, bytes)):
+            body = to_bytes(body)
+        elif isinstance(body, (dict, list)) and is_json_body(body):
+            body = encode_json(body)
+            content_type = JSONStream.ContentType
+        else:
+            body = None
+        if body is not None:
+            if len(resp) == 2:
+                extra = resp[1]
+                if isinstance(extra, str):
+                    return FastResponse(body, content_type = extra)
+                elif isinstance(extra, int):
+                    return FastResponse(body, status = extra, content_type = content_type)
+            else:
+                status, extra = resp[1:]
+                if isinstance(status, int) and isinstance(extra, str):
+                    return FastResponse(body, status = status, content_type = extra)
+    
     body_or_iter = None
     content_type = None
     status = None
@@ -130,9 +305,18 @@ def makeResponse(resp):
         raise ValueError("Handler method returned uninterpretable value: " + repr(resp))
         
     response = Response()
+    json_content_type = None
     
     if body_or_iter is not None:
-        if isinstance(body_or_iter, str):
+        if is_json_body(body_or_iter):
+            if isinstance(body_or_iter, JSONStream):
+                response.app_iter = body_or_iter
+                json_content_type = body_or_iter.content_type
+            else:
+                response.body = encode_json(body_or_iter)
+                json_content_type = JSONStream.ContentType
+            response.content_type = json_content_type
+        elif isinstance(body_or_iter, str):
             if PY3:
                 response.text = body_or_iter
             else:
@@ -144,10 +328,10 @@ def makeResponse(resp):
                 if hasattr(body_or_iter, "__next__"):
                     #print ("converting iterator")
                     body_or_iter = (to_bytes(x) for x in body_or_iter)
-                else:
-                    # assume list or tuple
+                elif not all(isinstance(x, bytes) for x in body_or_iter):
+                    # assume list or tuple, encode lazily while it is being sent
                     #print ("converting list")
-                    body_or_iter = [to_bytes(x) for x in body_or_iter]
+                    body_or_iter = (to_bytes(x) for x in body_or_iter)
             response.app_iter = body_or_iter
         else:
             raise ValueError("Unknown type for response body: " + str(type(body_or_iter)))
@@ -165,6 +349,8 @@ def makeResponse(resp):
             response.status = extra
         else:
             raise ValueError("Unknown type for headers: " + repr(extra))
+    if json_content_type is not None and "Content-Type" not in response.headers:
+        response.content_type = json_content_type
 #print response
     
     return response
@@ -177,14 +363,28 @@ class WPHandler:
     RouteMap = []
     _Strict = False
     _Methods = None
+    _Coalesce = None            # list of method names or "*", see SingleFlight.py
+    _Pools = None               # {method name or "*": bulkhead name}, see Bulkhead.py
     
     def __init__(self, request, app):
         self.Request = request
         self.Path = None
         self.App = app
         self.BeingDestroyed = False
-        try:    self.AppURL = request.application_url
-        except: self.AppURL = None
+
+    _AppURL = None
+
+    def get_app_url(self):
+        # computed on first use instead of in every handler of the tree
+        if self._AppURL is None:
+            try:    self._AppURL = self.Request.application_url
+            except: pass
+        return self._AppURL
+
+    def set_app_url(self, url):
+        self._AppURL = url
+
+    AppURL = property(get_app_url, set_app_url)
 
     def _app_lock(self):
         return self.App._app_lock()
@@ -195,59 +395,63 @@ class WPHandler:
 
         
     def wsgi_call(self, environ, start_response):
+        metrics = self.App.Metrics
+        if metrics is not None:
+            t0 = time.time()
+            metrics.add("webpie_app_requests_in_flight", 1)
         # path_to = '/'
         path = environ.get('PATH_INFO', '')
         path_down = path.split("/")
+        response = None
         try:
-            args = self.parseQuery(environ.get("QUERY_STRING", ""))
-            request = Request(environ)
-            #response = self.walk_down(request, path_to, path_down)    
-            response = self.walk_down(request, "", path_down, args)    
-        except HTTPFound as val:    
-            # redirect
-            response = val
-        except HTTPException as val:
-            #print 'caught:', type(val), val
-            response = val
-        except HTTPResponseException as val:
-            #print 'caught:', type(val), val
-            response = val
-        except:
-            response = self.App.applicationErrorResponse(
-                "Uncaught exception", sys.exc_info())
+            try:
+                args = environ["query_dict"] = query_args(environ)
+                request = self.Request
+                if request is None or request.environ is not environ:
+                    request = self.Request = Request(environ)
+                #response = self.walk_down(request, path_to, path_down)    
+                response = self.walk_down(request, "", path_down, args)    
+            except HTTPFound as val:    
+                # redirect
+                response = val
+            except HTTPException as val:
+                #print 'caught:', type(val), val
+                response = val
+            except HTTPResponseException as val:
+                #print 'caught:', type(val), val
+                response = val
+            except:
+                response = self.App.applicationErrorResponse(
+                    "Uncaught exception", sys.exc_info())
 
-        try:    
-            response = makeResponse(response)
-        except ValueError as e:
-            response = self.App.applicationErrorResponse(str(e), sys.exc_info())
+            try:    
+                response = makeResponse(response)
+            except ValueError as e:
+                response = self.App.applicationErrorResponse(str(e), sys.exc_info())
             
-        res = self.postprocessResponse(response)
-        if res is not None: response = res  # otherwise, use same response object
-        #print("postprocessed:", response)
-        
-        out = response(environ, start_response)
+            if isinstance(response, FastResponse) and self._postprocesses():
+                response = response.toWebOb()     # postprocessResponse may expect full webob Response
+            res = self.postprocessResponse(response)
+            if res is not None: response = res  # otherwise, use same response object
+            #print("postprocessed:", response)
+        
+            out = response(environ, start_response)
+        finally:
+            if metrics is not None:
+                self.recordMetrics(metrics, environ, response, time.time() - t0)
         self.destroy()
         self._destroy()
         return out
     
+    def recordMetrics(self, metrics, environ, response, elapsed):
+        route = environ.get("webpie.route", "")
+        status = str(getattr(response, "status_code", 500))
+        metrics.add("webpie_app_requests_in_flight", -1)
+        metrics.observe("webpie_app_request_duration_seconds", elapsed, (("route", route),))
+        metrics.inc("webpie_app_responses_total", 1, (("route", route), ("status", status)))
+
     def parseQuery(self, query):
-        out = {}
-        for w in (query or "").split("&"):
-            if w:
-                words = w.split("=", 1)
-                k = words[0]
-                if k:
-                    v = None
-                    if len(words) > 1:  v = words[1]
-                    if k in out:
-                        old = out[k]
-                        if type(old) != type([]):
-                            old = [old]
-                            out[k] = old
-                        out[k].append(v)
-                    else:
-                        out[k] = v
-        return out
+        return pairs_to_dict(parse_query(query or ""))
         
                 
     def walk_down(self, request, path, path_down, args):
@@ -259,7 +463,8 @@ class WPHandler:
     
         if not path_down:
             if callable(self):
-                return self(request, "", **request["query_dict"])
+                request.environ["webpie.route"] = self.Path
+                return self(request, "", **args)
             else:
                 return HTTPNotFound("Invalid path %s" % (request.path_info,))
         
@@ -286,13 +491,28 @@ class WPHandler:
                 else:
                     allowed = self._Methods is None or method_name in self._Methods
                 if allowed:
+                    request.environ["webpie.route"] = path + "/" + method_name
                     relpath = "/".join(path_down[1:])
+                    pools = self._Pools
+                    pool = pools and pools.get(method_name, pools.get("*"))
+                    coalesce = self._Coalesce
+                    if coalesce and (coalesce == "*" or method_name in coalesce) \
+                                and request.environ.get("REQUEST_METHOD") in ("GET", "HEAD"):
+                        # waiting followers do not take bulkhead slots
+                        function = lambda: method(request, relpath, **args)
+                        if pool:
+                            function = self.App.bulkhead(pool).wrap(function, request.environ)
+                        single_flight = self.App.singleFlight()
+                        return single_flight.call(single_flight.key(request.environ, relpath, args), function)
+                    if pool:
+                        return self.App.bulkhead(pool).call(lambda: method(request, relpath, **args), request.environ)
                     return method(request, relpath, **args)
                 else:
                     return HTTPForbidden(request.path_info)
                 
         # Try callable
         if callable(self):
+            request.environ["webpie.route"] = self.Path
             return self(request, "/".join(path_down), **args)
         
         # ... otherwise ...
@@ -435,6 +655,9 @@ class WPHandler:
     # overridable
     def postprocessResponse(self, response):
         return response
+
+    def _postprocesses(self):
+        return type(self).postprocessResponse is not WPHandler.postprocessResponse
         
 
         
@@ -455,7 +678,8 @@ class WPApp(object):
     def __init__(self, root_class, strict=False, 
             static_path="/static", static_location="static", enable_static=False,
             prefix=None, replace_prefix=None,
-            disable_robots=True):
+            disable_robots=True, metrics=None, profiler=None, response_cache=None, single_flight=None,
+            pools=None, process_pool=None, offload_timeout=300.0):
         assert issubclass(root_class, WPHandler)
         self.RootClass = root_class
         self.JEnv = None
@@ -469,10 +693,77 @@ class WPApp(object):
         self.DisableRobots = disable_robots
         self.Prefix = prefix
         self.ReplacePrefix = replace_prefix
+        from .Metrics import resolve_registry
+        self.Metrics = resolve_registry(metrics)
+        self.Profiler = profiler
+        self.ResponseCache = response_cache     # Cache.ResponseCache, used for all requests
+        self.SingleFlight = single_flight       # SingleFlight.SingleFlight, used by handlers with _Coalesce
+        self.Bulkheads = {}                     # name -> Bulkhead.Bulkhead, see webmethod(pool=) and WPHandler._Pools
+        for name, pool in (pools or {}).items():
+            self.addBulkhead(name, pool)
+        self.ProcessPool = process_pool         # ProcessPoolExecutor or number of processes, see Offload.py
+        self.OffloadTimeout = offload_timeout   # seconds or None
 
     def _app_lock(self):
         return self._AppLock
         
+    def singleFlight(self):
+        if self.SingleFlight is None:
+            from .SingleFlight import SingleFlight
+            with self._AppLock:
+                if self.SingleFlight is None:
+                    self.SingleFlight = SingleFlight()
+        if self.SingleFlight.Metrics is None and self.Metrics is not None:
+            self.SingleFlight.Metrics = self.Metrics
+        return self.SingleFlight
+        
+    def addBulkhead(self, name, pool):
+        # pool: Bulkhead object or the number of concurrent calls
+        from .Bulkhead import Bulkhead
+        if not isinstance(pool, Bulkhead):
+            pool = Bulkhead(pool)
+        pool.Name = name
+        if pool.Metrics is None:
+            pool.Metrics = self.Metrics
+        with self._AppLock:
+            self.Bulkheads[name] = pool
+        return pool
+
+    def bulkhead(self, name):
+        # bulkheads not configured with pools= are created with default limits on first use
+        pool = self.Bulkheads.get(name)
+        if pool is None:
+            with self._AppLock:
+                pool = self.Bulkheads.get(name)
+                if pool is None:
+                    from .Bulkhead import Bulkhead
+                    pool = self.addBulkhead(name, Bulkhead())
+        return pool
+        
+    def processPool(self):
+        pool = self.ProcessPool
+        if pool is None or isinstance(pool, int):
+            from concurrent.futures import ProcessPoolExecutor
+            with self._AppLock:
+                if self.ProcessPool is pool:
+                    self.ProcessPool = ProcessPoolExecutor(pool)
+                pool = self.ProcessPool
+        return pool
+
+    def offload(self, key, request, relpath, params, args):
+        from .Offload import offload
+        return offload(self.processPool(), key, request, relpath, params, args, self.OffloadTimeout)
+
+    def shutdown(self):
+        # called by HTTPServer.stop(), shuts down the process pool
+        with self._AppLock:
+            pool = self.ProcessPool
+            if pool is None or isinstance(pool, int):
+                return
+        try:    pool.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            pool.shutdown(wait=False)           # Python < 3.9
+        
     def __enter__(self):
         return self._AppLock.__enter__()
         
@@ -480,6 +771,11 @@ class WPApp(object):
         return self._AppLock.__exit__(*params)
     
     # override
+    # Called by HTTPServer when the client sends "Expect: 100-continue", before the request body is transferred.
+    # headers is a case-insensitive mapping. Return True to accept the body, False to reject the request
+    # with "417 Expectation Failed", or a status line string, e.g. "401 Unauthorized", to reject it with
+    # that status. When the request is rejected, the body is not read, the application is not called and
+    # the connection is closed after the response.
     @app_synchronized
     def acceptIncomingTransfer(self, method, uri, headers):
         return True
@@ -574,6 +870,16 @@ class WPApp(object):
             
 
     def __call__(self, environ, start_response):
+        if self.ResponseCache is not None:
+            return self.ResponseCache.handle(self.dispatch, environ, start_response)
+        return self.dispatch(environ, start_response)
+        
+    def dispatch(self, environ, start_response):
+        if self.Profiler is not None and self.Profiler.sample(environ):
+            return self.Profiler.profile(self.process, environ, start_response)
+        return self.process(environ, start_response)
+
+    def process(self, environ, start_response):
         #print 'app call ...'
         path = environ.get('PATH_INFO', '')
         environ["WebPie.original_path"] = path
@@ -632,10 +938,9 @@ class WPApp(object):
         return t.generate(self.addEnvironment(kv))
 
     def run_server(self, port, **args):
-        from .HTTPServer import HTTPServer
-        srv = HTTPServer(port, self, **args)
-        srv.start()
-        srv.join()
+        # see HTTPServer.run_server for reload, drain_timeout and signals arguments
+        from .HTTPServer import run_server
+        run_server(port, self, **args)
 
 if __name__ == '__main__':
     from HTTPServer import HTTPServer
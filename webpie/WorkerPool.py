@@ -0,0 +1,187 @@
+import time, sys, traceback
+from threading import Condition, Lock, Thread
+from collections import deque
+from pythreader import PyThread
+
+#
+# Autoscaling pool of worker threads
+#
+#   pool = WorkerPool(min_workers = 4, max_workers = 100, capacity = 100)
+#   pool << task                # task.run() will be called by one of the workers, blocks if the queue is full
+#   pool.stop()                 # task.close(), if defined, is called for the tasks still in the queue
+#   pool.stats()
+#
+# The pool starts with min_workers threads. The controller checks the pool every Interval seconds:
+#
+#   - grow:     if tasks waited in the queue longer than target_wait on average, or the oldest queued task
+#               is waiting longer than that, and at least GrowUtilization of the workers are busy, add a worker
+#               per queued task, or GrowFactor of the pool size if more, but no more than doubling the pool
+#   - shrink:   workers idle for longer than idle_timeout exit, down to min_workers
+#
+# When the workers are busy but tasks do not wait, e.g. CPU bound, the pool does not grow, so
+# threads are not added just to compete for the GIL.
+#
+# Metrics: webpie_server_workers, webpie_server_workers_busy, webpie_server_pool_adjustments_total{action=grow|shrink}
+#
+
+class _Worker(Thread):
+
+    def __init__(self, pool):
+        Thread.__init__(self)
+        self.daemon = True
+        self.Pool = pool
+
+    def run(self):
+        self.Pool.work()
+
+class _Controller(PyThread):
+
+    def __init__(self, pool):
+        PyThread.__init__(self)
+        self.daemon = True
+        self.Pool = pool
+
+    def run(self):
+        pool = self.Pool
+        while not pool.Stop:
+            time.sleep(pool.Interval)
+            pool.adjust()
+
+class WorkerPool(object):
+
+    Interval = 0.25                 # controller period, seconds
+    GrowUtilization = 0.75
+    GrowFactor = 0.25
+    WaitSmoothing = 0.2             # weight of the new sample in the queue wait moving average
+
+    def __init__(self, min_workers = 4, max_workers = 100, capacity = None, idle_timeout = 30.0,
+                target_wait = 0.005, metrics = None):
+        self.MinWorkers = max(1, min(min_workers, max_workers))
+        self.MaxWorkers = max_workers
+        self.Capacity = capacity
+        self.IdleTimeout = idle_timeout
+        self.TargetWait = target_wait
+        self.Metrics = metrics
+        self.Lock = Lock()
+        self.NotEmpty = Condition(self.Lock)        # workers wait for tasks
+        self.NotFull = Condition(self.Lock)         # add() waits for a slot in the queue
+        self.Queue = deque()            # (time queued, task)
+        self.Workers = 0
+        self.Busy = 0
+        self.Stop = False
+        self.WaitEWMA = 0.0             # seconds
+        self.Grown = self.Shrunk = 0
+        with self.Lock:
+            self.startWorkers(self.MinWorkers)
+        self.Controller = _Controller(self)
+        self.Controller.start()
+
+    def __len__(self):
+        with self.Lock:
+            return len(self.Queue) + self.Busy
+
+    def __lshift__(self, task):
+        self.add(task)
+        return self
+
+    def add(self, task):
+        with self.Lock:
+            if self.Stop:
+                raise RuntimeError("WorkerPool is stopped")
+            while self.Capacity is not None and len(self.Queue) >= self.Capacity:
+                self.NotFull.wait()
+                if self.Stop:
+                    raise RuntimeError("WorkerPool is stopped")
+            self.Queue.append((time.time(), task))
+            self.NotEmpty.notify()
+
+    def stop(self):
+        # workers finish the tasks they are running, queued tasks are not started
+        with self.Lock:
+            self.Stop = True
+            queued = [task for _, task in self.Queue]
+            self.Queue.clear()
+            self.NotEmpty.notify_all()
+            self.NotFull.notify_all()
+        for task in queued:
+            close = getattr(task, "close", None)
+            if close is not None:
+                try:    close()
+                except:
+                    sys.stderr.write("WorkerPool: exception closing task:\n" + traceback.format_exc())
+
+    def startWorkers(self, n):
+        # called with the lock held
+        n = min(n, self.MaxWorkers - self.Workers)
+        for _ in range(n):
+            self.Workers += 1
+            _Worker(self).start()
+        if n > 0 and self.Metrics is not None:
+            self.Metrics.add("webpie_server_workers", n)
+        return n
+
+    def work(self):
+        lock = self.Lock
+        not_empty = self.NotEmpty
+        while True:
+            with lock:
+                idle_since = time.time()
+                while not self.Queue and not self.Stop:
+                    not_empty.wait(self.IdleTimeout)
+                    if not self.Queue and self.Workers > self.MinWorkers \
+                                and time.time() - idle_since >= self.IdleTimeout:
+                        break
+                if self.Stop or not self.Queue:
+                    # stopped or idle for too long
+                    self.Workers -= 1
+                    if not self.Stop:
+                        self.Shrunk += 1
+                    if self.Metrics is not None:
+                        self.Metrics.add("webpie_server_workers", -1)
+                        if not self.Stop:
+                            self.Metrics.inc("webpie_server_pool_adjustments_total", 1, (("action", "shrink"),))
+                    return
+                queued_at, task = self.Queue.popleft()
+                self.NotFull.notify()       # a slot is available in the queue
+                wait = time.time() - queued_at
+                self.WaitEWMA += (wait - self.WaitEWMA)*self.WaitSmoothing
+                self.Busy += 1
+            if self.Metrics is not None:
+                self.Metrics.add("webpie_server_workers_busy", 1)
+            try:
+                task.run()
+            except:
+                sys.stderr.write("WorkerPool: exception in task:\n" + traceback.format_exc())
+            finally:
+                if self.Metrics is not None:
+                    self.Metrics.add("webpie_server_workers_busy", -1)
+                with lock:
+                    self.Busy -= 1
+
+    def adjust(self):
+        with self.Lock:
+            if self.Stop:
+                return
+            wait = self.WaitEWMA
+            if self.Queue:
+                wait = max(wait, time.time() - self.Queue[0][0])       # the oldest queued task waits now
+            else:
+                self.WaitEWMA *= (1 - self.WaitSmoothing)               # decay when there is nothing to take
+            utilization = float(self.Busy)/self.Workers if self.Workers else 1.0
+            if wait > self.TargetWait and utilization >= self.GrowUtilization and self.Workers < self.MaxWorkers:
+                n = max(1, int(self.Workers*self.GrowFactor), min(len(self.Queue), self.Workers))
+                n = self.startWorkers(n)
+                self.Grown += n
+                if self.Metrics is not None:
+                    self.Metrics.inc("webpie_server_pool_adjustments_total", n, (("action", "grow"),))
+
+    def stats(self):
+        with self.Lock:
+            return {
+                "workers":      self.Workers,
+                "busy":         self.Busy,
+                "queued":       len(self.Queue),
+                "queue_wait":   self.WaitEWMA,
+                "grown":        self.Grown,
+                "shrunk":       self.Shrunk
+            }
@@ -1,11 +1,71 @@
-from .WebPieApp import (WebPieApp, WebPieHandler, Response, app_synchronized, webmethod, atomic,
-    WebPieStaticHandler)
-from .WebPieSessionApp import (WebPieSessionApp,)
-from .WPApp import WPApp, WPHandler
-from .HTTPServer import (HTTPServer, HTTPSServer, run_server)
+import sys
+from types import ModuleType
 
+#
+# Exported names are imported on first use, so "import webpie" does not load webob, the HTTP server
+# (and pythreader), sessions etc. until the application uses them
+#
 
-__all__ = [ "WebPieApp", "WebPieHandler", "Response", 
-	"WebPieSessionApp", "HTTPServer", "app_synchronized", "webmethod", "WebPieStaticHandler"
+_Exports = {
+    # name -> module
+    "WebPieApp":            "WebPieApp",
+    "WebPieHandler":        "WebPieApp",
+    "Response":             "WebPieApp",
+    "app_synchronized":     "WebPieApp",
+    "atomic":               "WebPieApp",
+    "WebPieStaticHandler":  "WebPieApp",
+    "WebPieSessionApp":     "WebPieSessionApp",
+    "WPApp":                "WPApp",
+    "WPHandler":            "WPApp",
+    "webmethod":            "WPApp",
+    "HTTPServer":           "HTTPServer",
+    "HTTPSServer":          "HTTPServer",
+    "run_server":           "HTTPServer",
+    "MetricsRegistry":      "Metrics",
+    "MetricsHandler":       "MetricsHandler",
+    "RequestProfiler":      "Profiler",
+    "ProfilerHandler":      "Profiler",
+    "JSONStream":           "JSONStream",
+    "set_json_encoder":     "JSONStream",
+    "cached":               "Cache",
+    "ResponseCache":        "Cache",
+    "SingleFlight":         "SingleFlight",
+    "RateLimiter":          "RateLimit",
+    "Bulkhead":             "Bulkhead",
+    "Negotiator":           "Negotiation"
+}
+
+__all__ = [ "WebPieApp", "WebPieHandler", "Response",
+	"WebPieSessionApp", "HTTPServer", "app_synchronized", "webmethod", "WebPieStaticHandler",
+	"MetricsRegistry", "MetricsHandler", "RequestProfiler", "ProfilerHandler", "JSONStream", "set_json_encoder",
+	"cached", "ResponseCache", "SingleFlight", "RateLimiter", "Bulkhead", "Negotiator"
 ]
 
+def __getattr__(name):
+    module = _Exports.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    from importlib import import_module
+    value = getattr(import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_Exports))
+
+class _Package(ModuleType):
+
+    # Importing a submodule binds it as an attribute of the package, e.g. "import webpie.WPApp" sets webpie.WPApp
+    # to the module. Keep such names resolving to the exported class instead, as with the eager imports
+
+    def __setattr__(self, name, value):
+        if name in _Exports and isinstance(value, ModuleType) and not isinstance(value, _Package):
+            return
+        ModuleType.__setattr__(self, name, value)
+
+if sys.version_info >= (3, 7):
+    sys.modules[__name__].__class__ = _Package
+else:
+    # no module __getattr__, import everything now
+    for _name in _Exports:
+        __getattr__(_name)
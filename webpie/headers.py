@@ -0,0 +1,33 @@
+#
+# Request header names as WSGI environ keys
+#
+#   environ_key("Accept-Language")      # -> "HTTP_ACCEPT_LANGUAGE"
+#   environ_key("content-type")         # -> "CONTENT_TYPE", no HTTP_ prefix, as for Content-Length
+#
+# The keys are interned and cached by lower case header name, so the server builds each request environ
+# with dict lookups. Only the first MaxCached distinct names are cached, so clients sending random
+# header names do not grow the cache.
+#
+
+try:
+    from sys import intern                      # Python 3
+except ImportError:
+    pass
+
+MaxCached = 1000
+
+_Keys = {                                       # lower case header name -> interned environ key
+    "content-type":     "CONTENT_TYPE",
+    "content-length":   "CONTENT_LENGTH"
+}
+
+def environ_key(header):
+    key = _Keys.get(header)                     # the server passes lower case names
+    if key is None:
+        lname = header.strip().lower()
+        key = _Keys.get(lname)
+        if key is None:
+            key = intern("HTTP_" + lname.upper().replace("-", "_"))
+            if len(_Keys) < MaxCached:
+                _Keys[lname] = key
+    return key
@@ -0,0 +1,61 @@
+#
+# Query string parsing
+#
+# The query string is parsed once per request. The result is cached in the environ
+# and shared by the handler tree dispatch, webob Request.GET and the server.
+#
+
+try:
+    from urllib.parse import unquote_plus      # Python 3
+except ImportError:
+    from urllib import unquote_plus
+
+CacheKey = "webpie.query"               # environ key: (query string, pairs, args dict)
+
+def parse_query(query):
+    # returns list of (name, value) pairs, names and values are percent-decoded, "+" is decoded as space
+    # value is None if the item has no "=", e.g. "?flag"
+    pairs = []
+    for w in query.split("&"):
+        if w:
+            k, eq, v = w.partition("=")
+            if "%" in k or "+" in k:    k = unquote_plus(k)
+            if k:
+                if not eq:
+                    v = None
+                elif "%" in v or "+" in v:
+                    v = unquote_plus(v)
+                pairs.append((k, v))
+    return pairs
+
+def pairs_to_dict(pairs):
+    # repeated names are collected into lists: "a=1&a=2" -> {"a": ["1", "2"]}
+    out = {}
+    for k, v in pairs:
+        if k in out:
+            old = out[k]
+            if type(old) != type([]):
+                old = out[k] = [old]
+            old.append(v)
+        else:
+            out[k] = v
+    return out
+
+def parsed_query(environ):
+    query = environ.get("QUERY_STRING", "")
+    cached = environ.get(CacheKey)
+    if cached is not None and cached[0] == query:
+        return cached
+    if not query:
+        parsed = (query, [], {})
+    else:
+        pairs = parse_query(query)
+        parsed = (query, pairs, pairs_to_dict(pairs))
+    environ[CacheKey] = parsed
+    return parsed
+
+def query_pairs(environ):
+    return parsed_query(environ)[1]
+
+def query_args(environ):
+    return parsed_query(environ)[2]
@@ -0,0 +1,248 @@
+#
+# In-process WSGI client for tests and benchmarks
+#
+# Calls the WSGI application directly, without sockets or the HTTPServer:
+#
+#   client = Client(WPApp(MyHandler))
+#   response = client.get("/hello?name=world")
+#   print(response.status_code, response.text, response.elapsed)
+#
+#   # repeated requests reuse a prepared environ
+#   environ = client.prepare("GET", "/hello")
+#   for _ in range(1000):
+#       client.call(environ)
+#
+#   # concurrent drivers
+#   stats = Driver(app, threads=8).run(lambda client: client.call(environ), 10000)
+#
+#   # lock contention
+#   probe = LockProbe.install(app, "_AppLock")
+#   ...
+#   print(probe.stats())
+#
+
+import time, json, io, sys
+from threading import Thread, RLock
+
+from .py3 import to_bytes, to_str
+from .headers import environ_key
+
+class TestResponse(object):
+
+    __slots__ = ("status", "headers", "body", "elapsed")
+
+    def __init__(self, status, headers, body, elapsed):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.elapsed = elapsed          # seconds, from the application call to the end of the body
+
+    @property
+    def status_code(self):
+        return int(self.status.split(None, 1)[0])
+
+    @property
+    def text(self):
+        return to_str(self.body)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def header(self, name, default = None):
+        name = name.lower()
+        for h, v in self.headers:
+            if h.lower() == name:
+                return v
+        return default
+
+    def __repr__(self):
+        return "<TestResponse %s %d bytes %.3fms>" % (self.status, len(self.body), self.elapsed*1000)
+
+class Client(object):
+
+    def __init__(self, app, server_name = "localhost", server_port = "80", script_name = "",
+                headers = None, cookies = True, environ = None):
+        self.App = app
+        self.Template = {
+            "SERVER_NAME":          server_name,
+            "SERVER_PORT":          str(server_port),
+            "SERVER_PROTOCOL":      "HTTP/1.1",
+            "SCRIPT_NAME":          script_name,
+            "REMOTE_ADDR":          "127.0.0.1",
+            "HTTP_HOST":            server_name if str(server_port) == "80" else "%s:%s" % (server_name, server_port),
+            "wsgi.version":         (1, 0),
+            "wsgi.url_scheme":      "http",
+            "wsgi.errors":          sys.stderr,
+            "wsgi.multithread":     True,
+            "wsgi.multiprocess":    False,
+            "wsgi.run_once":        False
+        }
+        for h, v in (headers or {}).items():
+            self.Template[environ_key(h)] = v
+        if environ:
+            self.Template.update(environ)
+        self.Cookies = {} if cookies else None
+        self.Timings = []               # elapsed times of all calls, seconds
+
+    def prepare(self, method, uri, headers = None, body = None):
+        # returns an environ dictionary to be passed to call(), possibly many times
+        env = self.Template.copy()
+        path, _, query = uri.partition("?")
+        env["REQUEST_METHOD"] = method.upper()
+        env["PATH_INFO"] = path
+        env["QUERY_STRING"] = query
+        for h, v in (headers or {}).items():
+            env[environ_key(h)] = v
+        if body is not None:
+            body = to_bytes(body)
+            env["CONTENT_LENGTH"] = str(len(body))
+            env["webpie.testing.body"] = body
+        return env
+
+    def call(self, environ):
+        env = environ.copy()
+        body = env.get("webpie.testing.body", b"")
+        env["wsgi.input"] = io.BytesIO(body)
+        if self.Cookies:
+            env["HTTP_COOKIE"] = "; ".join("%s=%s" % (k, v) for k, v in self.Cookies.items())
+
+        status_headers = []
+        def start_response(status, headers, exc_info = None):
+            status_headers[:] = [status, headers]
+
+        t0 = time.perf_counter()
+        out = self.App(env, start_response)
+        try:
+            body = b"".join(to_bytes(x) for x in out)
+        finally:
+            if hasattr(out, "close"):
+                out.close()
+        elapsed = time.perf_counter() - t0
+        self.Timings.append(elapsed)
+
+        status, headers = status_headers
+        if self.Cookies is not None:
+            for h, v in headers:
+                if h.lower() == "set-cookie":
+                    name, _, value = v.split(";", 1)[0].partition("=")
+                    self.Cookies[name.strip()] = value.strip()
+        return TestResponse(status, headers, body, elapsed)
+
+    def request(self, method, uri, headers = None, body = None):
+        return self.call(self.prepare(method, uri, headers, body))
+
+    def get(self, uri, headers = None):
+        return self.request("GET", uri, headers)
+
+    def head(self, uri, headers = None):
+        return self.request("HEAD", uri, headers)
+
+    def delete(self, uri, headers = None):
+        return self.request("DELETE", uri, headers)
+
+    def post(self, uri, body = b"", headers = None):
+        return self.request("POST", uri, headers, body)
+
+    def put(self, uri, body = b"", headers = None):
+        return self.request("PUT", uri, headers, body)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values)-1, int(round(p*(len(sorted_values)-1))))]
+
+class Driver(object):
+
+    # Runs a function(client) concurrently in several threads, each with its own Client
+
+    def __init__(self, app, threads = 8, **client_args):
+        self.App = app
+        self.NThreads = threads
+        self.ClientArgs = client_args
+        self.Errors = []
+
+    def worker(self, client, function, n):
+        for _ in range(n):
+            try:
+                function(client)
+            except Exception as e:
+                self.Errors.append(e)
+
+    def run(self, function, requests = 1000):
+        clients = [Client(self.App, **self.ClientArgs) for _ in range(self.NThreads)]
+        per_thread = max(1, requests // self.NThreads)
+        threads = [Thread(target=self.worker, args=(c, function, per_thread)) for c in clients]
+        t0 = time.perf_counter()
+        for t in threads:   t.start()
+        for t in threads:   t.join()
+        elapsed = time.perf_counter() - t0
+        timings = sorted(t for c in clients for t in c.Timings)
+        n = len(timings)
+        return {
+            "requests":     n,
+            "errors":       len(self.Errors),
+            "elapsed":      elapsed,
+            "req_per_sec":  n/elapsed if elapsed > 0 else None,
+            "mean_ms":      sum(timings)/n*1000 if n else None,
+            "p50_ms":       percentile(timings, 0.5)*1000 if n else None,
+            "p99_ms":       percentile(timings, 0.99)*1000 if n else None
+        }
+
+class LockProbe(object):
+
+    # Wraps a lock and records how long threads wait to acquire it
+
+    def __init__(self, lock = None):
+        self.Lock = lock if lock is not None else RLock()
+        self.StatsLock = RLock()
+        self.reset()
+
+    @staticmethod
+    def install(obj, attribute):
+        # replaces obj.<attribute> lock with a probe wrapping it, returns the probe
+        probe = LockProbe(getattr(obj, attribute))
+        setattr(obj, attribute, probe)
+        return probe
+
+    def reset(self):
+        self.Acquisitions = 0
+        self.Contended = 0
+        self.WaitTime = 0.0
+        self.MaxWait = 0.0
+
+    def acquire(self, blocking = True, timeout = -1):
+        if self.Lock.acquire(False):
+            with self.StatsLock:
+                self.Acquisitions += 1
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        acquired = self.Lock.acquire(True, timeout)
+        waited = time.perf_counter() - t0
+        with self.StatsLock:
+            self.Contended += 1
+            self.WaitTime += waited
+            self.MaxWait = max(self.MaxWait, waited)
+            if acquired:
+                self.Acquisitions += 1
+        return acquired
+
+    def release(self):
+        self.Lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *params):
+        self.release()
+
+    def stats(self):
+        with self.StatsLock:
+            return {
+                "acquisitions":     self.Acquisitions,
+                "contended":        self.Contended,
+                "wait_time":        self.WaitTime,
+                "max_wait":         self.MaxWait
+            }
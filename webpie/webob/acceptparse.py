@@ -5,7 +5,8 @@ The four headers are ``Accept``, ``Accept-Charset``, ``Accept-Encoding`` and
 ``Accept-Language``.
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from threading import Lock
 import re
 import textwrap
 import warnings
@@ -5356,3 +5357,60 @@ def accept_language_property():
             pass
 
     return property(fget, fset, fdel, textwrap.dedent(doc))
+
+
+class _HeaderCache(object):
+    """
+    LRU cache of header objects created from raw header values.
+
+    Real traffic has a small number of distinct ``Accept*`` header values,
+    so the header objects are created once per value instead of being
+    parsed on every property access. The header objects are not modified
+    after they are created, so they are shared between requests.
+    """
+
+    def __init__(self, create, maxsize=256):
+        self.create = create
+        self.maxsize = maxsize
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __call__(self, header_value):
+        if not isinstance(header_value, str):
+            return self.create(header_value=header_value)
+        with self.lock:
+            header = self.entries.get(header_value)
+            if header is not None:
+                self.entries.move_to_end(header_value)
+                self.hits += 1
+                return header
+            self.misses += 1
+        header = self.create(header_value=header_value)
+        with self.lock:
+            self.entries[header_value] = header
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return header
+
+    def cache_clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+def _memoized(create):
+    cache = _HeaderCache(create)
+
+    def create_header(header_value):
+        return cache(header_value)
+    create_header.__name__ = create.__name__
+    create_header.__doc__ = create.__doc__
+    create_header.cache = cache
+    return create_header
+
+
+create_accept_header = _memoized(create_accept_header)
+create_accept_charset_header = _memoized(create_accept_charset_header)
+create_accept_encoding_header = _memoized(create_accept_encoding_header)
+create_accept_language_header = _memoized(create_accept_language_header)
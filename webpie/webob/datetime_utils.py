@@ -1,5 +1,3 @@
-import calendar
-
 from datetime import (
     date,
     datetime,
@@ -7,12 +5,6 @@ from datetime import (
     tzinfo,
     )
 
-from email.utils import (
-    formatdate,
-    mktime_tz,
-    parsedate_tz,
-    )
-
 import time
 
 from .compat import (
@@ -68,6 +60,7 @@ def parse_date(value):
         value = native_(value)
     except:
         return None
+    from email.utils import mktime_tz, parsedate_tz     # slow to import
     t = parsedate_tz(value)
     if t is None:
         # Could not parse
@@ -86,11 +79,13 @@ def serialize_date(dt):
     if isinstance(dt, (datetime, date)):
         dt = dt.timetuple()
     if isinstance(dt, (tuple, time.struct_time)):
+        import calendar
         dt = calendar.timegm(dt)
     if not (isinstance(dt, float) or isinstance(dt, integer_types)):
         raise ValueError(
             "You must pass in a datetime, date, time tuple, or integer object, "
             "not %r" % dt)
+    from email.utils import formatdate
     return formatdate(dt, usegmt=True)
 
 
@@ -170,7 +170,6 @@ from string import Template
 import re
 import sys
 
-from .acceptparse import create_accept_header
 from .compat import (
     class_types,
     text_,
@@ -330,6 +329,7 @@ ${body}''')
         if self.content_length is not None:
             del self.content_length
         headerlist = list(self.headerlist)
+        from .acceptparse import create_accept_header
         accept_value = environ.get('HTTP_ACCEPT', '')
         accept_header = create_accept_header(header_value=accept_value)
         acceptable_offers = accept_header.acceptable_offers(
@@ -11,12 +11,6 @@ except ImportError:
     import json
 import warnings
 
-from .acceptparse import (
-    accept_charset_property,
-    accept_encoding_property,
-    accept_language_property,
-    accept_property,
-    )
 
 from .cachecontrol import (
     CacheControl,
@@ -88,6 +82,33 @@ _LATIN_ENCODINGS = (
     'iso-8859-1', 'iso8859_1', 'iso_8859_1', 'iso8859', '8859',
     )
 
+class _lazy_accept_property(object):
+    """ Accept* header property which imports acceptparse on first use
+
+    acceptparse is large and most requests never look at these headers
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.prop = None
+
+    def resolve(self):
+        if self.prop is None:
+            from . import acceptparse
+            self.prop = getattr(acceptparse, self.factory)()
+        return self.prop
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self.resolve()
+        return self.resolve().__get__(obj, type)
+
+    def __set__(self, obj, value):
+        self.resolve().__set__(obj, value)
+
+    def __delete__(self, obj):
+        self.resolve().__delete__(obj)
+
+
 class BaseRequest(object):
     # The limit after which request bodies should be stored on disk
     # if they are read in (under this, and the request body is stored
@@ -1046,10 +1067,10 @@ class BaseRequest(object):
             if key in self.environ:
                 del self.environ[key]
 
-    accept = accept_property()
-    accept_charset = accept_charset_property()
-    accept_encoding = accept_encoding_property()
-    accept_language = accept_language_property()
+    accept = _lazy_accept_property('accept_property')
+    accept_charset = _lazy_accept_property('accept_charset_property')
+    accept_encoding = _lazy_accept_property('accept_encoding_property')
+    accept_language = _lazy_accept_property('accept_language_property')
 
     authorization = converter(
         environ_getter('HTTP_AUTHORIZATION', None, '14.8'),
@@ -1547,20 +1568,6 @@ class LimitedLengthFile(io.RawIOBase):
         return sz
 
 
-def _cgi_FieldStorage__repr__patch(self):
-    """ monkey patch for FieldStorage.__repr__
-
-    Unbelievably, the default __repr__ on FieldStorage reads
-    the entire file content instead of being sane about it.
-    This is a simple replacement that doesn't do that
-    """
-    if self.file:
-        return "FieldStorage(%r, %r)" % (self.name, self.filename)
-    return "FieldStorage(%r, %r, %r)" % (self.name, self.filename, self.value)
-
-cgi_FieldStorage.__repr__ = _cgi_FieldStorage__repr__patch
-
-
 class FakeCGIBody(io.RawIOBase):
     def __init__(self, vars, content_type):
         warnings.warn(